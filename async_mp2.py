@@ -0,0 +1,552 @@
+import asyncio
+import random
+from decimal import Decimal
+
+import asyncpg
+
+from config import read_config
+from messages import *
+from admin import Administrator, User
+from mp2 import MAX_RETRIES, PREPARED_STATEMENTS, RETRY_DELAY, RETRY_SQLSTATES, STATUS_MESSAGES, SUMMARY_CHECKS
+from quota import QuotaBuffer
+
+# psycopg2 connection settings understood by asyncpg, under asyncpg's name
+ASYNCPG_PARAMS = {"host": "host", "port": "port", "user": "user", "password": "password",
+                  "database": "database", "dbname": "database"}
+
+
+"""
+    Makes numeric values travel as text, like psycopg2 does: Python floats are stored with
+    their shortest repr and values are read back as e.g. Decimal('3000000'), not Decimal('3.00E+6').
+"""
+async def init_connection(conn):
+    await conn.set_type_codec("numeric", schema="pg_catalog", encoder=str, decoder=Decimal, format="text")
+
+
+"""
+    Creates the asyncpg connection pool shared by every AsyncMp2Client of the process.
+    Connection settings come from the [postgresql] section, pool sizes from the optional [pool] section
+    unless maxconn is given.
+"""
+async def create_pool(config_filename, maxconn=None):
+    db_conn_params = read_config(filename=config_filename, section="postgresql")
+    pool_params = read_config(filename=config_filename, section="pool", required=False)
+
+    connect_params = {ASYNCPG_PARAMS[key]: value for key, value in db_conn_params.items() if key in ASYNCPG_PARAMS}
+    if "port" in connect_params:
+        connect_params["port"] = int(connect_params["port"])
+
+    return await asyncpg.create_pool(
+        min_size=int(pool_params.get("minconn", 1)),
+        max_size=maxconn or int(pool_params.get("maxconn", 5)),
+        init=init_connection,
+        **connect_params
+    )
+
+
+"""
+    Returns the positional statement of STATEMENTS[name] followed by its arguments,
+    ready to be passed to asyncpg's execute/fetch methods.
+"""
+def statement_args(name, params):
+    statement, param_names = PREPARED_STATEMENTS[name]
+    return [statement] + [params[param_name] for param_name in param_names]
+
+
+"""
+    asyncio counterpart of Mp2Client, one object per session (guest or signed-in admin).
+    - Every command borrows a connection from the shared asyncpg pool only while it runs,
+      so one process can serve many concurrent sessions with a few connections.
+    - asyncpg prepares the statements on each pooled connection and caches them.
+    - Commands return the same tuples and messages as Mp2Client; printed rows are passed to out.
+    - quota_settings (see quota.read_quota_config) enables buffered guest quota accounting.
+    - Creating it needs no database round trip, the guest row is created by its first query.
+"""
+class AsyncMp2Client:
+    user = None
+    def __init__(self, pool, out=print, quota_settings=None):
+        self.pool = pool
+        self.out = out
+
+        self.quota = QuotaBuffer(**quota_settings) if quota_settings is not None else None
+        self.quota_timer = None
+        self.quota_flush = None
+
+        self.user = User(user_id=None, current_query_count=0, max_query_limit=10000)
+
+        # statements run again after a serialization failure or deadlock, see fetch_with_retry
+        self.retry_count = 0
+
+    """
+        Runs fetch (e.g. pool.fetchrow) on one of STATEMENTS, like Mp2Client.fetch_with_retry:
+        a statement aborted by a serialization failure or a deadlock is run again.
+    """
+    async def fetch_with_retry(self, fetch, name, params):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return await fetch(*statement_args(name, params))
+            except asyncpg.PostgresError as error:
+                if error.sqlstate not in RETRY_SQLSTATES or attempt == MAX_RETRIES:
+                    raise
+                self.retry_count += 1
+                await asyncio.sleep(RETRY_DELAY * 2 ** attempt * random.random())
+
+    """
+        Creates the users row of the guest if it has none yet.
+    """
+    async def create_guest_row(self, conn):
+        if self.user is None or self.user.user_id is not None:
+            return
+
+        user_id, max_query_limit = await conn.fetchrow(*statement_args("create_guest", {}))
+        self.user.user_id = str(user_id)
+        self.user.max_query_limit = max_query_limit
+
+    """
+        Flushes buffered guest queries flush_interval seconds after they were counted,
+        so counts of an idle session still reach the users table.
+    """
+    def schedule_quota_flush(self):
+        if self.quota_timer is None:
+            self.quota_timer = asyncio.get_running_loop().call_later(self.quota.flush_interval, self.start_quota_flush)
+
+    def start_quota_flush(self):
+        self.quota_timer = None
+        self.quota_flush = asyncio.ensure_future(self.flush_quota())
+
+    def cancel_quota_flush(self):
+        if self.quota_timer is not None:
+            self.quota_timer.cancel()
+            self.quota_timer = None
+        self.quota.discard()
+
+    """
+        Writes the buffered guest query count; a failed flush is retried later.
+    """
+    async def flush_quota(self):
+        user = self.user
+        if user is None or user.user_id is None:
+            return
+
+        count = self.quota.take()
+        if count == 0:
+            return
+
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(*statement_args("flush_quota", {"query_count": count, "user_id": int(user.user_id)}))
+        except Exception:
+            self.quota.add(count)
+            self.schedule_quota_flush()
+
+    """
+        Prints list of available commands of the software.
+    """
+    def help(self):
+        self.out("\n*** Geographic Information System ***")
+        self.out("> help")
+        self.out("> sign_up <admin_id> <password> <level_id>")
+        self.out("> sign_in <admin_id> <password>")
+        self.out("> sign_out")
+        self.out("> show_levels")
+        self.out("> show_my_level")
+        self.out("> change_level <new_level_id>")
+        self.out("> get_statistics <name> [<country_name>]")
+        self.out("> update_religion <country_name> <religion_name1> <religion_name2> <percentage>")
+        self.out("> transfer_city <city_name> <current_country> <new_country>")
+        self.out("> adjust_population <name> [<country_name>] <new_population>")
+        self.out("> check_summaries")
+        self.out("> quit")
+
+    """
+        Saves admin with given details, see Mp2Client.sign_up.
+    """
+    async def sign_up(self, admin_id, password, level_id):
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    # checking if level exist
+                    if await conn.fetchrow("SELECT level_id FROM accesslevels WHERE level_id = $1", int(level_id)) is None:
+                        return False, CMD_EXECUTION_FAILED
+
+                    # checking if admin already exists
+                    if await conn.fetchrow("SELECT admin_id FROM administrators WHERE admin_id = $1", admin_id) is not None:
+                        return False, USERNAME_EXISTS
+
+                    await conn.execute(
+                        "INSERT INTO administrators (admin_id, password, session_count, level_id) VALUES ($1, $2, 0, $3)",
+                        admin_id, password, int(level_id)
+                    )
+            return True, CMD_EXECUTION_SUCCESS
+
+        except Exception:
+            return False, CMD_EXECUTION_FAILED
+
+    """
+        Signs the admin in and removes the guest user, see Mp2Client.sign_in.
+    """
+    async def sign_in(self, admin_id, password):
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    admin_row = await conn.fetchrow(*statement_args("admin_by_id", {"admin_id": admin_id}))
+
+                    # if admin_id does not exist or password does not match
+                    if admin_row is None or admin_row[1] != password:
+                        return None, USER_SIGNIN_FAILED
+
+                    if await conn.fetchrow(*statement_args("level_by_id", {"level_id": admin_row[2]})) is None:
+                        return None, USER_SIGNIN_FAILED
+
+                    admin_data = await conn.fetchrow(
+                        *statement_args("admin_sessions", {"admin_id": admin_id, "password": password}))
+                    if admin_data is None:
+                        return None, USER_SIGNIN_FAILED
+
+                    admin_id, level_id, session_count, max_sessions = admin_data
+
+                    if session_count >= max_sessions:
+                        return None, USER_ALL_SESSIONS_ARE_USED
+
+                    await conn.execute(*statement_args("admin_increment_sessions", {"admin_id": admin_id}))
+
+                    # removing guest user if exists
+                    if self.user is not None and self.user.user_id is not None:
+                        await conn.execute(*statement_args("delete_guest", {"user_id": int(self.user.user_id)}))
+
+            self.user = None
+            if self.quota is not None:
+                self.cancel_quota_flush()
+            return Administrator(admin_id, level_id), CMD_EXECUTION_SUCCESS
+
+        except Exception:
+            return None, USER_SIGNIN_FAILED
+
+    """
+        Signs the admin out and starts a new guest session, see Mp2Client.sign_out.
+    """
+    async def sign_out(self, admin):
+        if admin is None:
+            return False, NO_ACTIVE_ADMIN
+
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("""
+                        UPDATE administrators
+                        SET session_count = GREATEST(0, session_count - 1)
+                        WHERE admin_id = $1
+                    """, admin.admin_id)
+
+            self.user = User(user_id=None, current_query_count=0, max_query_limit=10000)
+            return True, CMD_EXECUTION_SUCCESS
+
+        except Exception:
+            return False, CMD_EXECUTION_FAILED
+
+    """
+        Ends the session: signs the admin out or removes the guest user, see Mp2Client.quit.
+    """
+    async def quit(self, admin):
+        # a guest that never queried has no row to remove
+        if admin is None and (self.user is None or self.user.user_id is None):
+            self.user = None
+            return True, CMD_EXECUTION_SUCCESS
+
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    if admin is not None:
+                        await conn.execute("""
+                            UPDATE administrators
+                            SET session_count = GREATEST(0, session_count - 1)
+                            WHERE admin_id = $1
+                        """, admin.admin_id)
+
+                    if self.user is not None and self.user.user_id is not None:
+                        await conn.execute(*statement_args("delete_guest", {"user_id": int(self.user.user_id)}))
+
+            # buffered queries are dropped with the guest row
+            self.user = None
+            if self.quota is not None:
+                self.cancel_quota_flush()
+            return True, CMD_EXECUTION_SUCCESS
+
+        except Exception:
+            return False, CMD_EXECUTION_FAILED
+
+    """
+        Prints all available access levels, see Mp2Client.show_levels.
+    """
+    async def show_levels(self):
+        try:
+            async with self.pool.acquire() as conn:
+                levels = await conn.fetch("SELECT * FROM accesslevels")
+        except Exception:
+            return False, CMD_EXECUTION_FAILED
+
+        self.out("ID|Level Name|Max Sessions")
+        for level in levels:
+            self.out(f"{level[0]}|{level[1]}|{level[2]}")
+        return True, CMD_EXECUTION_SUCCESS
+
+    """
+        Prints the level of the signed-in admin, see Mp2Client.show_my_level.
+    """
+    async def show_my_level(self, admin):
+        if admin is None:
+            return False, USER_NOT_AUTHORIZED
+
+        try:
+            async with self.pool.acquire() as conn:
+                level_info = await conn.fetchrow("""
+                    SELECT a.level_id, al.name, al.max_parallel_sessions
+                    FROM administrators a
+                    JOIN accesslevels al ON a.level_id = al.level_id
+                    WHERE a.admin_id = $1
+                """, admin.admin_id)
+        except Exception:
+            return False, CMD_EXECUTION_FAILED
+
+        if level_info is None:
+            return False, CMD_EXECUTION_FAILED
+
+        self.out("ID|Level Name|Max Sessions")
+        self.out(f"{level_info[0]}|{level_info[1]}|{level_info[2]}")
+        return True, CMD_EXECUTION_SUCCESS
+
+    """
+        Upgrades the signed-in admin to a new level, see Mp2Client.change_level.
+    """
+    async def change_level(self, admin, new_level_id):
+        if admin is None:
+            return None, USER_NOT_AUTHORIZED
+
+        try:
+            new_level_id = int(new_level_id)
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    new_level = await conn.fetchrow(
+                        "SELECT level_id, max_parallel_sessions FROM accesslevels WHERE level_id = $1", new_level_id)
+                    if new_level is None:
+                        return None, CMD_EXECUTION_FAILED
+
+                    current_info = await conn.fetchrow("""
+                        SELECT a.level_id, a.session_count, al.max_parallel_sessions
+                        FROM administrators a
+                        JOIN accesslevels al ON a.level_id = al.level_id
+                        WHERE a.admin_id = $1
+                    """, admin.admin_id)
+                    if current_info is None:
+                        return None, CMD_EXECUTION_FAILED
+
+                    current_level_id, session_count, current_max_sessions = current_info
+
+                    if current_level_id == new_level_id:
+                        return None, SAMEGRADE_NOT_ALLOWED
+
+                    if new_level[1] <= current_max_sessions:
+                        return None, DOWNGRADE_NOT_ALLOWED
+
+                    if session_count > 1:
+                        return None, CMD_EXECUTION_FAILED
+
+                    await conn.execute("UPDATE administrators SET level_id = $1 WHERE admin_id = $2",
+                                       new_level_id, admin.admin_id)
+
+            admin.level_id = new_level_id
+            return admin, CMD_EXECUTION_SUCCESS
+
+        except Exception:
+            return None, CMD_EXECUTION_FAILED
+
+    """
+        Prints statistics of the given city/country/continent, see Mp2Client.get_statistics.
+    """
+    async def get_statistics(self, name, country_name=None):
+        query_count = 1
+        write_count = False
+        row = None
+        if self.user is not None:
+            # the count kept here includes the buffered queries
+            if self.user.current_query_count >= self.user.max_query_limit:
+                self.out(f"{self.user.max_query_limit} query limit reached.")
+                return False, CMD_EXECUTION_FAILED
+
+            # buffered mode writes the count only when a flush is due
+            if self.quota is not None:
+                query_count = self.quota.take_due()
+            write_count = query_count > 0
+
+        try:
+            async with self.pool.acquire() as conn:
+                await self.create_guest_row(conn)
+                guest_user_id = int(self.user.user_id) if write_count else None
+                row = await conn.fetchrow(*statement_args(
+                    "get_statistics",
+                    {"user_id": guest_user_id, "query_count": query_count, "name": name, "country_name": country_name}))
+
+            (continent_name, continent_country_count,
+             country_name_found, population, has_economy, gdp,
+             top_language, top_language_percentage, top_religion, top_religion_percentage,
+             city_count, city_name, city_population, city_elevation, city_country_name) = row
+
+            if self.user is not None:
+                self.user.current_query_count += 1
+                if self.quota is not None and query_count == 0:
+                    self.quota.add()
+                    self.schedule_quota_flush()
+
+            if continent_name is not None:
+                self.out("TYPE|NAME|COUNTRIES")
+                self.out(f"Continent|{continent_name}|{continent_country_count}")
+                return True, CMD_EXECUTION_SUCCESS
+
+            if country_name_found is not None:
+                if not has_economy:
+                    gdp = "N/A"
+                top_lang_str = f"{top_language} ({top_language_percentage}%)" if top_language is not None else "N/A"
+                top_rel_str = f"{top_religion} ({top_religion_percentage}%)" if top_religion is not None else "N/A"
+
+                self.out("TYPE|NAME|POPULATION|GDP|TOP_LANGUAGE|TOP_RELIGION")
+                self.out(f"Country|{country_name_found}|{population:,}|${gdp}|{top_lang_str}|{top_rel_str}")
+                return True, CMD_EXECUTION_SUCCESS
+
+            if country_name is None:
+                if city_count is not None and city_count > 1:
+                    return False, AMBIGUOUS_CITY
+
+                if city_count == 1 and city_country_name is not None:
+                    self.out("TYPE|NAME|POPULATION|ELEVATION")
+                    self.out(f"City|{city_name}|{city_population:,}|{city_elevation}m")
+                    return True, CMD_EXECUTION_SUCCESS
+
+            elif city_name is not None:
+                self.out("TYPE|NAME|COUNTRY|POPULATION|ELEVATION")
+                self.out(f"City|{city_name}|{city_country_name}|{city_population:,}|{city_elevation}m")
+                return True, CMD_EXECUTION_SUCCESS
+
+            return False, NO_ENTITY_FOUND
+
+        except Exception:
+            # the flushed count was not written if the query failed, keep it buffered
+            if row is None and self.quota is not None and write_count:
+                self.quota.add(query_count - 1)
+                self.schedule_quota_flush()
+            # also rows that can not be formatted, e.g. a city without population
+            return False, CMD_EXECUTION_FAILED
+
+    """
+        Moves percentage points from religion_name2 to religion_name1, see Mp2Client.update_religion.
+    """
+    async def update_religion(self, admin, country_name, religion_name1, religion_name2, percentage):
+        if admin is None:
+            return False, USER_NOT_AUTHORIZED
+        if religion_name1.lower() == religion_name2.lower():
+            return False, SAME_RELIGION
+
+        try:
+            percentage = float(percentage)
+            if percentage < 0 or percentage > 100:
+                return False, INVALID_PERCENTAGE
+
+            status, new_religion1_percentage, new_religion2_percentage = await self.fetch_with_retry(
+                self.pool.fetchrow, "update_religion", {
+                    "country_name": country_name,
+                    "religion_name1": religion_name1,
+                    "religion_name2": religion_name2,
+                    "percentage": percentage
+                })
+            if status != "CMD_EXECUTION_SUCCESS":
+                return False, STATUS_MESSAGES[status]
+
+            new_religion1_percentage = float(new_religion1_percentage)
+            new_religion2_percentage = float(new_religion2_percentage)
+
+        except Exception:
+            return False, CMD_EXECUTION_FAILED
+
+        self.out("RELIGION|PERCENTAGE")
+        self.out(f"{religion_name1}|{new_religion1_percentage}% (+{percentage})")
+        if new_religion2_percentage > 0:
+            self.out(f"{religion_name2}|{new_religion2_percentage}% (-{percentage})")
+        else:
+            self.out(f"{religion_name2}|0% (-{percentage}) [REMOVED]")
+        return True, CMD_EXECUTION_SUCCESS
+
+    """
+        Transfers the city from current country to new country, see Mp2Client.transfer_city.
+    """
+    async def transfer_city(self, admin, city_name, current_country, new_country):
+        if admin is None:
+            return False, USER_NOT_AUTHORIZED
+
+        if current_country.lower() == new_country.lower():
+            return False, SAME_COUNTRY
+
+        try:
+            status, removed_country = await self.fetch_with_retry(
+                self.pool.fetchrow, "transfer_city",
+                {"city_name": city_name, "current_country": current_country, "new_country": new_country})
+            if status != "CMD_EXECUTION_SUCCESS":
+                return False, STATUS_MESSAGES[status]
+
+        except Exception:
+            return False, CMD_EXECUTION_FAILED
+
+        if removed_country is not None:
+            self.out(f"Notice: Country named {removed_country} has been removed.")
+        return True, CMD_EXECUTION_SUCCESS
+
+    """
+        Sets the population of the given city/country, see Mp2Client.adjust_population.
+    """
+    async def adjust_population(self, admin, name, country_name=None, new_population=None):
+        if admin is None:
+            return False, USER_NOT_AUTHORIZED
+
+        try:
+            new_population = int(new_population)
+            if new_population < 0:
+                return False, NO_NEGATIVE_POPULATION
+
+            status = await self.fetch_with_retry(
+                self.pool.fetchval, "adjust_population",
+                {"name": name, "country_name": country_name, "population": new_population})
+            if status != "CMD_EXECUTION_SUCCESS":
+                return False, STATUS_MESSAGES[status]
+            return True, CMD_EXECUTION_SUCCESS
+
+        except Exception:
+            return False, CMD_EXECUTION_FAILED
+
+    """
+        Compares the trigger maintained summary tables with a full recompute, see Mp2Client.check_summaries.
+    """
+    async def check_summaries(self, admin):
+        if admin is None:
+            return False, USER_NOT_AUTHORIZED
+
+        try:
+            mismatches = []
+            counts = []
+            async with self.pool.acquire() as conn:
+                for summary, query in SUMMARY_CHECKS.items():
+                    rows = await conn.fetch(query)
+                    counts.append((summary, len(rows)))
+                    mismatches.extend((summary,) + tuple(row) for row in rows)
+
+        except Exception:
+            return False, CMD_EXECUTION_FAILED
+
+        self.out("SUMMARY|MISMATCHES")
+        for summary, count in counts:
+            self.out(f"{summary}|{count}")
+
+        if mismatches:
+            self.out("SUMMARY|KEY|STORED|RECOMPUTED")
+            for summary, key, stored, recomputed in mismatches:
+                self.out(f"{summary}|{key}|{stored}|{recomputed}")
+            return False, SUMMARY_INCONSISTENT
+
+        return True, CMD_EXECUTION_SUCCESS
@@ -0,0 +1,212 @@
+"""
+    Compares bulk_transfer_city with one transfer_city per city: picks --moves random cities of
+    --sources countries (some of them emptied completely) and moves them to other countries, once
+    with transfer_city_v1 per city and once with the bulk_transfer_city statements. Both runs are
+    rolled back afterwards; the script prints both times and checks that they leave the same cities,
+    capitals and countries behind.
+
+    Cities only move into countries that lose none, the case where both forms have to agree
+    (bulk_transfer_city checks every row against the database as it was before the batch).
+    A second, small file then checks the capitals picked in file order: a country loses its
+    capital, then the city that became its capital, then gains a city named before all of its own.
+
+    Usage (from the repository root, against a migrated database):
+        python -m benchmarks.bulk_transfer [--config database.cfg] [--moves 2000] [--sources 40]
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+import psycopg2
+
+from config import read_config
+from mp2 import (BULK_WORK_MEM, TRANSFER_IMPORT_CAPITALS, TRANSFER_IMPORT_CLEANUP, TRANSFER_IMPORT_COLUMNS,
+                 TRANSFER_IMPORT_MOVE, TRANSFER_IMPORT_RESOLVE, TRANSFER_IMPORT_SKIPPED, TRANSFER_IMPORT_TABLE)
+
+# everything transfer_city can change, in a fixed order
+STATE_QUERY = """
+    SELECT md5(string_agg(row_text, E'\\n' ORDER BY row_text)), count(*)
+    FROM (
+        SELECT 'city|' || name || '|' || country AS row_text FROM city
+        UNION ALL SELECT 'country|' || code || '|' || coalesce(capital, '') FROM country
+        UNION ALL SELECT 'encompasses|' || country || '|' || continent FROM encompasses
+        UNION ALL SELECT 'economy|' || country FROM economy
+        UNION ALL SELECT 'religion|' || country || '|' || name FROM religion
+        UNION ALL SELECT 'spoken|' || country || '|' || language FROM spoken
+    ) state
+"""
+
+
+def pick_moves(cursor, moves, sources, rng):
+    cursor.execute("""
+        SELECT co.name, co.code, array_agg(ci.name ORDER BY ci.name)
+        FROM country co JOIN city ci ON ci.country = co.code
+        GROUP BY co.name, co.code
+    """)
+    countries = cursor.fetchall()
+    rng.shuffle(countries)
+
+    source_countries = countries[:sources]
+    targets = countries[sources:]
+    taken = {(name, code) for _, code, cities in targets for name in cities}
+
+    rows = []
+    for number, (country_name, _, cities) in enumerate(source_countries):
+        # every fourth source country loses all its cities and is removed
+        count = len(cities) if number % 4 == 0 else max(1, len(cities) // 2)
+        for city_name in rng.sample(cities, count):
+            target_name, target_code, _ = rng.choice(targets)
+            if (city_name, target_code) not in taken:
+                taken.add((city_name, target_code))
+                rows.append((city_name, country_name, target_name))
+
+    rng.shuffle(rows)
+    return rows[:moves]
+
+
+"""
+    Returns the rows of the capital chain check, None when the database has no country for it:
+    the capital of a country with three cities or more leaves, then the first city by name it
+    has left, then a city of another country named before all its cities moves in. One
+    transfer_city per row leaves the third city by name as capital, not the city moved in.
+"""
+def pick_capital_chain(cursor):
+    cursor.execute("""
+        SELECT co.name, co.capital, array_agg(ci.name ORDER BY ci.name)
+        FROM country co JOIN city ci ON ci.country = co.code
+        GROUP BY co.name, co.capital
+        HAVING count(*) >= 3 AND bool_or(ci.name = co.capital)
+        ORDER BY co.name
+    """)
+    for country_name, capital, cities in cursor.fetchall():
+        next_capital = min(city for city in cities if city != capital)
+        first_left = min(city for city in cities if city not in (capital, next_capital))
+
+        cursor.execute("""
+            SELECT ci.name, co.name
+            FROM city ci JOIN country co ON co.code = ci.country
+            WHERE ci.name < %s AND co.name <> %s AND co.capital <> ci.name
+            ORDER BY ci.name LIMIT 1
+        """, (first_left, country_name))
+        arrival = cursor.fetchone()
+
+        cursor.execute("""
+            SELECT co.name FROM country co
+            WHERE co.name <> %s AND NOT EXISTS (
+                SELECT 1 FROM city WHERE country = co.code AND name IN (%s, %s))
+            ORDER BY co.name LIMIT 1
+        """, (country_name, capital, next_capital))
+        target = cursor.fetchone()
+
+        if arrival is not None and target is not None:
+            return [(capital, country_name, target[0]), (next_capital, country_name, target[0]),
+                    (arrival[0], arrival[1], country_name)]
+    return None
+
+
+def run_single(cursor, rows):
+    removed = 0
+    for city_name, current_country, new_country in rows:
+        cursor.execute("SELECT status, removed_country FROM transfer_city_v1(%s, %s, %s)",
+                       (city_name, current_country, new_country))
+        status, removed_country = cursor.fetchone()
+        if status != "CMD_EXECUTION_SUCCESS":
+            raise RuntimeError(f"transfer_city {city_name} {current_country} {new_country}: {status}")
+        removed += removed_country is not None
+    return removed
+
+
+def run_bulk(cursor, file_path):
+    # the run is rolled back, so the setting does not outlive it
+    cursor.execute("SELECT set_config('work_mem', %s, true)", (BULK_WORK_MEM,))
+    cursor.execute(TRANSFER_IMPORT_TABLE)
+    with open(file_path, newline="", encoding="utf-8") as csv_file:
+        cursor.copy_expert(
+            "COPY transfer_import ({}) FROM STDIN WITH (FORMAT csv, HEADER true)".format(
+                ", ".join(TRANSFER_IMPORT_COLUMNS)),
+            csv_file)
+    cursor.execute(TRANSFER_IMPORT_RESOLVE)
+    cursor.execute(TRANSFER_IMPORT_SKIPPED)
+    skipped = cursor.fetchall()
+    if skipped:
+        raise RuntimeError(f"bulk_transfer_city skipped rows: {skipped[:5]}")
+    cursor.execute(TRANSFER_IMPORT_MOVE)
+    cursor.execute(TRANSFER_IMPORT_CAPITALS)
+    cursor.execute(TRANSFER_IMPORT_CLEANUP)
+    return len(cursor.fetchall())
+
+
+def write_rows(file_path, rows):
+    with open(file_path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(TRANSFER_IMPORT_COLUMNS)
+        writer.writerows(rows)
+
+
+def timed(conn, function, *args):
+    cursor = conn.cursor()
+    started = time.perf_counter()
+    removed = function(cursor, *args)
+    elapsed = time.perf_counter() - started
+    cursor.execute(STATE_QUERY)
+    state = cursor.fetchone()
+    conn.rollback()
+    return elapsed, removed, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare bulk_transfer_city with single transfer_city calls.")
+    parser.add_argument("--config", default="database.cfg", help="database configuration file")
+    parser.add_argument("--moves", type=int, default=2000, help="cities to move")
+    parser.add_argument("--sources", type=int, default=40, help="countries cities are moved out of")
+    parser.add_argument("--seed", type=int, default=352)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    rng = random.Random(args.seed)
+
+    cursor = conn.cursor()
+    rows = pick_moves(cursor, args.moves, args.sources, rng)
+    chain_rows = pick_capital_chain(cursor)
+    conn.rollback()
+
+    file_descriptor, file_path = tempfile.mkstemp(suffix=".csv")
+    os.close(file_descriptor)
+    try:
+        write_rows(file_path, rows)
+        single_time, single_removed, single_state = timed(conn, run_single, rows)
+        bulk_time, bulk_removed, bulk_state = timed(conn, run_bulk, file_path)
+
+        if chain_rows is not None:
+            write_rows(file_path, chain_rows)
+            _, _, chain_single_state = timed(conn, run_single, chain_rows)
+            _, _, chain_bulk_state = timed(conn, run_bulk, file_path)
+    finally:
+        os.remove(file_path)
+        conn.close()
+
+    print(f"{len(rows)} cities moved out of {args.sources} countries")
+    print(f"single transfer_city: {single_time * 1000:9.1f} ms, {single_removed} countries removed")
+    print(f"bulk_transfer_city:   {bulk_time * 1000:9.1f} ms, {bulk_removed} countries removed "
+          f"({single_time / bulk_time:.1f}x faster)")
+
+    if single_state != bulk_state:
+        print("FINAL STATES DIFFER")
+        sys.exit(1)
+    print("same final state")
+
+    if chain_rows is None:
+        print("capital chain: no country to check")
+    elif chain_single_state != chain_bulk_state:
+        print("capital chain: FINAL STATES DIFFER " + "; ".join(",".join(row) for row in chain_rows))
+        sys.exit(1)
+    else:
+        print("capital chain: same final state " + "; ".join(",".join(row) for row in chain_rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+    Benchmarks every REPL command of Mp2Client against a loaded database.
+
+    Each command is run --iterations times with a realistic mix of names taken from the
+    database (countries, unique and ambiguous cities, continents, misses). For every command
+    it reports p50/p95/p99 latency, statements sent per command and throughput, and saves
+    the results as JSON so runs on different commits can be compared.
+
+    The write commands change the data, run it against a scratch database only.
+
+    Usage (from the repository root):
+        python -m benchmarks.commands [--config database.cfg] [--load [--data-dir DIR | --scale N]]
+                                      [--iterations 2000] [--output bench_output.json]
+
+    --scale N loads a synthetic dataset N times the bundled one (see generate_data.py).
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import random
+import subprocess
+import time
+
+import psycopg2
+
+from config import read_config
+from generate_data import generate_tables
+from load_data import load_data
+from mp2 import Mp2Client
+
+BENCH_ADMIN_ID = "bench_admin"
+BENCH_ADMIN_PASSWORD = "bench"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+"""
+    Collects latencies and statement counts of one command.
+"""
+class CommandResult:
+    def __init__(self, command):
+        self.command = command
+        self.latencies = []
+        self.statements = 0
+        self.failures = 0
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        total = sum(latencies)
+        count = len(latencies)
+        return {
+            "count": count,
+            "failures": self.failures,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "mean_ms": total / count * 1000 if count else 0.0,
+            "statements_per_command": self.statements / count if count else 0.0,
+            "throughput_per_s": count / total if total > 0 else 0.0,
+        }
+
+
+"""
+    Runs call() under the benchmark: output of the command is discarded, wall time and
+    statements sent by client are recorded into result.
+"""
+def measure(client, result, call):
+    statements_before = client.statement_count
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        outcome = call()
+        elapsed = time.perf_counter() - started
+    result.latencies.append(elapsed)
+    result.statements += client.statement_count - statements_before
+    if not outcome[0]:
+        result.failures += 1
+    return outcome
+
+
+"""
+    Reads the names the workloads draw from.
+"""
+def sample_names(conn):
+    query_ex = conn.cursor()
+
+    query_ex.execute("SELECT name FROM continent")
+    continents = [row[0] for row in query_ex.fetchall()]
+
+    query_ex.execute("SELECT name, code FROM country")
+    countries = query_ex.fetchall()
+
+    query_ex.execute("""
+        SELECT c.name, co.name, COUNT(*) OVER (PARTITION BY lower(c.name))
+        FROM city c JOIN country co ON c.country = co.code
+        ORDER BY random() LIMIT 20000
+    """)
+    cities = query_ex.fetchall()
+
+    # cities that can move back and forth without deleting a country or touching a capital
+    query_ex.execute("""
+        SELECT c.name, co.name
+        FROM city c JOIN country co ON c.country = co.code
+        WHERE lower(c.name) <> lower(COALESCE(co.capital, ''))
+          AND (SELECT COUNT(*) FROM city c2 WHERE c2.country = c.country) > 1
+          AND (SELECT COUNT(*) FROM city c3 WHERE lower(c3.name) = lower(c.name)) = 1
+        ORDER BY random() LIMIT 200
+    """)
+    movable_cities = query_ex.fetchall()
+
+    # the two biggest religions of countries that have at least two
+    query_ex.execute("""
+        SELECT co.name, r.religions[1], r.religions[2]
+        FROM country co
+        JOIN LATERAL (
+            SELECT array_agg(name ORDER BY percentage DESC) AS religions
+            FROM religion WHERE country = co.code AND percentage >= 1
+        ) r ON array_length(r.religions, 1) >= 2
+        ORDER BY random() LIMIT 200
+    """)
+    religion_pairs = query_ex.fetchall()
+
+    conn.rollback()
+    return continents, countries, cities, movable_cities, religion_pairs
+
+
+"""
+    Builds the get_statistics name mix: mostly countries and cities, some ambiguous
+    city names, continents, city+country pairs and names that do not exist.
+"""
+def statistics_mix(rng, continents, countries, cities, count):
+    unique_cities = [city for city in cities if city[2] == 1] or cities
+    ambiguous_cities = [city for city in cities if city[2] > 1] or cities
+
+    mix = []
+    for _ in range(count):
+        draw = rng.random()
+        if draw < 0.35:
+            mix.append((rng.choice(countries)[0], None))
+        elif draw < 0.65:
+            mix.append((rng.choice(unique_cities)[0], None))
+        elif draw < 0.75:
+            mix.append((rng.choice(ambiguous_cities)[0], None))
+        elif draw < 0.85:
+            city = rng.choice(cities)
+            mix.append((city[0], city[1]))
+        elif draw < 0.95:
+            mix.append((rng.choice(continents), None))
+        else:
+            mix.append(("Atlantis%d" % rng.randrange(1000), None))
+    return mix
+
+
+def ensure_bench_admin(conn):
+    query_ex = conn.cursor()
+    query_ex.execute("SELECT MIN(level_id) FROM accesslevels")
+    level_id = query_ex.fetchone()[0]
+    query_ex.execute("""
+        INSERT INTO administrators (admin_id, password, session_count, level_id)
+        VALUES (%s, %s, 0, %s)
+        ON CONFLICT (admin_id) DO UPDATE SET session_count = 0, level_id = EXCLUDED.level_id
+    """, (BENCH_ADMIN_ID, BENCH_ADMIN_PASSWORD, level_id))
+    conn.commit()
+
+
+def set_admin_level(conn, level_id):
+    conn.cursor().execute("UPDATE administrators SET level_id = %s WHERE admin_id = %s", (level_id, BENCH_ADMIN_ID))
+    conn.commit()
+
+
+def run_benchmarks(client, conn, iterations, seed=352):
+    rng = random.Random(seed)
+    continents, countries, cities, movable_cities, religion_pairs = sample_names(conn)
+    results = {}
+
+    def result_for(command):
+        if command not in results:
+            results[command] = CommandResult(command)
+        return results[command]
+
+    # guest lookups
+    for name, country_name in statistics_mix(rng, continents, countries, cities, iterations):
+        measure(client, result_for("get_statistics"),
+                lambda: client.get_statistics(name=name, country_name=country_name))
+
+    # sign in / sign out pairs
+    ensure_bench_admin(conn)
+    admin = None
+    for _ in range(iterations):
+        admin, message = measure(client, result_for("sign_in"),
+                                 lambda: client.sign_in(admin_id=BENCH_ADMIN_ID, password=BENCH_ADMIN_PASSWORD))
+        measure(client, result_for("sign_out"), lambda: client.sign_out(admin=admin))
+
+    admin, message = client.sign_in(admin_id=BENCH_ADMIN_ID, password=BENCH_ADMIN_PASSWORD)
+    if admin is None:
+        raise RuntimeError("can not sign in the benchmark admin: " + message)
+
+    # change_level: upgrade, then put the old level back outside the measurement
+    query_ex = conn.cursor()
+    query_ex.execute("SELECT level_id FROM accesslevels ORDER BY max_parallel_sessions")
+    levels = [row[0] for row in query_ex.fetchall()]
+    conn.rollback()
+    if len(levels) >= 2:
+        for _ in range(iterations):
+            measure(client, result_for("change_level"),
+                    lambda: client.change_level(admin=admin, new_level_id=levels[-1]))
+            set_admin_level(conn, levels[0])
+            admin.level_id = levels[0]
+
+    # update_religion: move a small share back and forth between the two biggest religions
+    for i in range(iterations if religion_pairs else 0):
+        country_name, religion1, religion2 = religion_pairs[i % len(religion_pairs)]
+        if (i // len(religion_pairs)) % 2:
+            religion1, religion2 = religion2, religion1
+        measure(client, result_for("update_religion"),
+                lambda: client.update_religion(admin=admin, country_name=country_name, religion_name1=religion1,
+                                               religion_name2=religion2, percentage="0.1"))
+
+    # transfer_city: move non-capital cities to another country and back
+    country_names = [country[0] for country in countries]
+    for i in range(iterations // 2 if movable_cities else 0):
+        city_name, home = movable_cities[i % len(movable_cities)]
+        away = rng.choice(country_names)
+        while away == home:
+            away = rng.choice(country_names)
+        measure(client, result_for("transfer_city"),
+                lambda: client.transfer_city(admin=admin, city_name=city_name, current_country=home,
+                                             new_country=away))
+        measure(client, result_for("transfer_city"),
+                lambda: client.transfer_city(admin=admin, city_name=city_name, current_country=away,
+                                             new_country=home))
+
+    # adjust_population: countries, unique cities and cities with their country
+    unique_cities = [city for city in cities if city[2] == 1] or cities
+    for _ in range(iterations):
+        draw = rng.random()
+        population = str(rng.randrange(1000, 10000000))
+        if draw < 0.4:
+            name, country_name = rng.choice(countries)[0], None
+        elif draw < 0.7:
+            name, country_name = rng.choice(unique_cities)[0], None
+        else:
+            name, country_name = rng.choice(cities)[:2]
+        measure(client, result_for("adjust_population"),
+                lambda: client.adjust_population(admin=admin, name=name, country_name=country_name,
+                                                 new_population=population))
+
+    client.sign_out(admin=admin)
+
+    return {command: result.summary() for command, result in results.items()}
+
+
+def dataset_sizes(conn):
+    query_ex = conn.cursor()
+    sizes = {}
+    for table in ("continent", "country", "city", "economy", "religion", "spoken", "encompasses"):
+        query_ex.execute("SELECT COUNT(*) FROM {}".format(table))
+        sizes[table] = query_ex.fetchone()[0]
+    conn.rollback()
+    return sizes
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'COMMAND':<20}{'COUNT':>7}{'FAIL':>6}{'P50_MS':>9}{'P95_MS':>9}{'P99_MS':>9}{'STMTS':>7}{'CMDS/S':>10}")
+    for command, summary in results.items():
+        print(f"{command:<20}{summary['count']:>7}{summary['failures']:>6}{summary['p50_ms']:>9.3f}"
+              f"{summary['p95_ms']:>9.3f}{summary['p99_ms']:>9.3f}{summary['statements_per_command']:>7.1f}"
+              f"{summary['throughput_per_s']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every Mp2Client command.")
+    parser.add_argument("--config", default="database.cfg", help="database configuration file")
+    parser.add_argument("--load", action="store_true", help="(re)load the datasets before the run")
+    parser.add_argument("--data-dir", default=".", help="directory with the csv files to load")
+    parser.add_argument("--scale", type=int, help="load a generated dataset this many times the bundled one")
+    parser.add_argument("--iterations", type=int, default=2000, help="calls per command")
+    parser.add_argument("--seed", type=int, default=352, help="seed of the name mix")
+    parser.add_argument("--output", default="bench_output.json", help="where to save the JSON results")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+
+    if args.load and args.scale:
+        load_data(conn, sources=generate_tables(args.scale, seed=args.seed), reset=True, repair_encoding=False)
+    elif args.load:
+        load_data(conn, data_dir=args.data_dir, reset=True)
+
+    client = Mp2Client(config_filename=args.config)
+    started = time.monotonic()
+    results = run_benchmarks(client, conn, args.iterations, seed=args.seed)
+    elapsed = time.monotonic() - started
+    client.quit(admin=None)
+    client.close()
+
+    print_results(results)
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "iterations": args.iterations,
+        "seed": args.seed,
+        "scale": args.scale if args.load else None,
+        "pooled": client.pool is not None,
+        "prepared_statements": client.use_prepared,
+        "dataset": dataset_sizes(conn),
+        "elapsed_s": elapsed,
+        "results": results,
+    }
+    conn.close()
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+    Compares the country branch of get_statistics reading the country_summary row with the
+    per-request joins it replaced (country, economy and the top rows of spoken and religion).
+    Both queries are run --iterations times for random country names and must return the
+    same rows.
+
+    Usage (from the repository root, against a migrated database):
+        python -m benchmarks.country_summary [--config database.cfg] [--iterations 5000]
+"""
+import argparse
+import random
+import sys
+import time
+
+import psycopg2
+
+from config import read_config
+
+JOINED_QUERY = """
+    SELECT c.name, c.population,
+           e.country IS NOT NULL AS has_economy, e.gdp,
+           s.language, s.percentage AS language_percentage,
+           r.name AS religion, r.percentage AS religion_percentage
+    FROM country c
+    LEFT JOIN economy e ON e.country = c.code
+    LEFT JOIN LATERAL (
+        SELECT language, percentage
+        FROM spoken
+        WHERE country = c.code
+        ORDER BY percentage DESC, language
+        LIMIT 1
+    ) s ON true
+    LEFT JOIN LATERAL (
+        SELECT name, percentage
+        FROM religion
+        WHERE country = c.code
+        ORDER BY percentage DESC, name
+        LIMIT 1
+    ) r ON true
+    WHERE lower(c.name) = lower(%(name)s)
+    LIMIT 1
+"""
+
+SUMMARY_QUERY = """
+    SELECT cs.name, cs.population, cs.has_economy, cs.gdp,
+           cs.language, cs.language_percentage, cs.religion, cs.religion_percentage
+    FROM country_summary cs
+    WHERE lower(cs.name) = lower(%(name)s)
+    LIMIT 1
+"""
+
+
+def time_query(query_ex, query, names):
+    rows = []
+    started = time.perf_counter()
+    for name in names:
+        query_ex.execute(query, {"name": name})
+        rows.append(query_ex.fetchone())
+    return time.perf_counter() - started, rows
+
+
+def execution_time(query_ex, query, name):
+    query_ex.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, {"name": name})
+    return query_ex.fetchone()[0][0]["Execution Time"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare country_summary lookups with the per-request joins.")
+    parser.add_argument("--config", default="database.cfg", help="database configuration file")
+    parser.add_argument("--iterations", type=int, default=5000, help="lookups per query")
+    parser.add_argument("--seed", type=int, default=352)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    # read-only statements, nothing to keep transactional
+    conn.autocommit = True
+    query_ex = conn.cursor()
+
+    query_ex.execute("SELECT name FROM country")
+    countries = [row[0] for row in query_ex.fetchall()]
+    rng = random.Random(args.seed)
+    names = [rng.choice(countries) for _ in range(args.iterations)]
+
+    # warm both paths up once, then measure
+    time_query(query_ex, JOINED_QUERY, names[:100])
+    time_query(query_ex, SUMMARY_QUERY, names[:100])
+    joined_time, joined_rows = time_query(query_ex, JOINED_QUERY, names)
+    summary_time, summary_rows = time_query(query_ex, SUMMARY_QUERY, names)
+
+    # server side cost, without the round trip both queries pay
+    sample = names[:200]
+    joined_server = sum(execution_time(query_ex, JOINED_QUERY, name) for name in sample) / len(sample)
+    summary_server = sum(execution_time(query_ex, SUMMARY_QUERY, name) for name in sample) / len(sample)
+
+    conn.close()
+
+    print(f"{len(countries)} countries, {args.iterations} lookups per query")
+    print(f"{'QUERY':<10}{'TOTAL_MS':>12}{'PER_LOOKUP_US':>16}{'SERVER_US':>12}")
+    print(f"{'joins':<10}{joined_time * 1000:>12.1f}{joined_time / args.iterations * 1e6:>16.1f}{joined_server * 1000:>12.1f}")
+    print(f"{'summary':<10}{summary_time * 1000:>12.1f}{summary_time / args.iterations * 1e6:>16.1f}{summary_server * 1000:>12.1f}")
+    print(f"summary lookups are {joined_time / summary_time:.2f}x faster end to end, "
+          f"{joined_server / summary_server:.2f}x on the server")
+
+    if joined_rows != summary_rows:
+        print("RESULTS DIFFER")
+        sys.exit(1)
+    print("same results")
+
+
+if __name__ == '__main__':
+    main()
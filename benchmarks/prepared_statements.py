@@ -0,0 +1,118 @@
+"""
+    Measures what server-side prepared statements save on the statements of the hot commands.
+
+    For every read-only statement in mp2.STATEMENTS it reports the planning time postgres
+    reports for it (EXPLAIN (SUMMARY)) and the mean wall time per execution, once sent as
+    plain SQL text and once EXECUTEd from a statement prepared on the same connection.
+
+    Usage (from the repository root, against a loaded database):
+        python -m benchmarks.prepared_statements [--config database.cfg] [--iterations 2000]
+"""
+import argparse
+import re
+import time
+
+import psycopg2
+
+from config import read_config
+from mp2 import STATEMENTS, PREPARED_STATEMENTS
+
+
+"""
+    Picks real names from the database so every statement finds its rows.
+"""
+def sample_params(query_ex):
+    query_ex.execute("""
+        SELECT c.name, co.name
+        FROM city c
+        JOIN country co ON c.country = co.code
+        WHERE lower(c.name) = lower(co.capital)
+        ORDER BY co.population DESC NULLS LAST
+        LIMIT 1
+    """)
+    city, country = query_ex.fetchone()
+
+    query_ex.execute("SELECT admin_id, password FROM administrators LIMIT 1")
+    admin = query_ex.fetchone() or ("nobody", "")
+
+    return [
+        ("get_statistics", "get_statistics (country)", {"user_id": None, "query_count": 1, "name": country, "country_name": None}),
+        ("get_statistics", "get_statistics (city)", {"user_id": None, "query_count": 1, "name": city, "country_name": None}),
+        ("get_statistics", "get_statistics (city, country)", {"user_id": None, "query_count": 1, "name": city, "country_name": country}),
+        ("admin_by_id", "admin_by_id", {"admin_id": admin[0]}),
+        ("admin_sessions", "admin_sessions", {"admin_id": admin[0], "password": admin[1]}),
+        ("level_by_id", "level_by_id", {"level_id": 1}),
+    ]
+
+
+def planning_time(query_ex, name, params):
+    query_ex.execute("EXPLAIN (SUMMARY) " + STATEMENTS[name], params)
+    for (line,) in query_ex.fetchall():
+        match = re.match(r"\s*Planning Time: ([\d.]+) ms", line)
+        if match:
+            return float(match.group(1))
+    return float("nan")
+
+
+def time_plain(query_ex, name, params, iterations):
+    statement = STATEMENTS[name]
+    started = time.perf_counter()
+    for _ in range(iterations):
+        query_ex.execute(statement, params)
+        query_ex.fetchall()
+    return (time.perf_counter() - started) / iterations
+
+
+def time_prepared(query_ex, name, params, iterations):
+    positional_statement, param_names = PREPARED_STATEMENTS[name]
+    prepared_name = "bench_" + name
+    query_ex.execute("DEALLOCATE ALL")
+    query_ex.execute("PREPARE {} AS {}".format(prepared_name, positional_statement.replace("%", "%%")))
+
+    execute = "EXECUTE {} ({})".format(prepared_name, ", ".join(["%s"] * len(param_names)))
+    args = [params[param_name] for param_name in param_names]
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        query_ex.execute(execute, args)
+        query_ex.fetchall()
+    return (time.perf_counter() - started) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare plain and prepared execution of the hot statements.")
+    parser.add_argument("--config", default="database.cfg", help="database configuration file")
+    parser.add_argument("--iterations", type=int, default=2000, help="executions per statement and mode")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    # read-only statements, nothing to keep transactional
+    conn.autocommit = True
+    query_ex = conn.cursor()
+
+    print(f"{'STATEMENT':<32}{'PLAN_MS':>10}{'PLAIN_US':>12}{'PREPARED_US':>14}{'SAVED_US':>12}{'SAVED_%':>9}")
+
+    total_plain = total_prepared = 0.0
+    for name, label, params in sample_params(query_ex):
+        plan_ms = planning_time(query_ex, name, params)
+
+        # warm both paths up once, then measure
+        time_plain(query_ex, name, params, 10)
+        plain = time_plain(query_ex, name, params, args.iterations)
+        prepared = time_prepared(query_ex, name, params, args.iterations)
+
+        total_plain += plain
+        total_prepared += prepared
+        saved = plain - prepared
+        print(f"{label:<32}{plan_ms:>10.3f}{plain * 1e6:>12.1f}{prepared * 1e6:>14.1f}"
+              f"{saved * 1e6:>12.1f}{saved / plain * 100:>8.1f}%")
+
+    saved = total_plain - total_prepared
+    print(f"{'total':<32}{'':>10}{total_plain * 1e6:>12.1f}{total_prepared * 1e6:>14.1f}"
+          f"{saved * 1e6:>12.1f}{saved / total_plain * 100:>8.1f}%")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+    Load test of server.py: opens --clients concurrent connections, each sending --commands
+    get_statistics commands with up to --pipeline of them in flight, and reports the total
+    commands/s and the latency percentiles seen by the clients.
+
+    Usage (from the repository root, with the server running against a loaded database):
+        python server.py &
+        python -m benchmarks.server [--config database.cfg] [--host 127.0.0.1] [--port 3520]
+                                    [--clients 200] [--commands 200] [--pipeline 8]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import psycopg2
+
+from benchmarks.commands import percentile
+from config import read_config
+from server import DEFAULT_HOST, DEFAULT_PORT, RESPONSE_END
+
+
+def sample_commands(config_filename, count, seed=352):
+    conn = psycopg2.connect(**read_config(filename=config_filename, section="postgresql"))
+    query_ex = conn.cursor()
+    query_ex.execute("""
+        (SELECT name FROM country ORDER BY random() LIMIT 200)
+        UNION ALL (SELECT name FROM continent)
+        UNION ALL (SELECT name FROM city ORDER BY random() LIMIT 800)
+    """)
+    names = [row[0] for row in query_ex.fetchall()]
+    conn.close()
+
+    rng = random.Random(seed)
+    return ['get_statistics "%s"' % rng.choice(names) for _ in range(count)]
+
+
+"""
+    Runs the commands of one client; returns the latency of each command.
+"""
+async def run_client(host, port, commands, pipeline):
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies = []
+    sent_at = []
+    end_line = (RESPONSE_END + "\n").encode()
+    # keeps at most pipeline commands in flight
+    in_flight = asyncio.Semaphore(pipeline)
+
+    async def read_responses():
+        while len(latencies) < len(commands):
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("server closed the connection")
+            if line == end_line:
+                latencies.append(time.perf_counter() - sent_at[len(latencies)])
+                in_flight.release()
+
+    receiver = asyncio.ensure_future(read_responses())
+    for command in commands:
+        await in_flight.acquire()
+        sent_at.append(time.perf_counter())
+        writer.write((command + "\n").encode("utf-8"))
+        await writer.drain()
+    await receiver
+
+    writer.write(b"quit\n")
+    await writer.drain()
+    await reader.read()
+    writer.close()
+    return latencies
+
+
+async def run(args, commands):
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        run_client(args.host, args.port, commands[i::args.clients], args.pipeline) for i in range(args.clients)
+    ))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for result in results for latency in result)
+    print(f"{len(latencies)} commands from {args.clients} clients in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:,.0f} commands/s)")
+    print(f"latency p50 {percentile(latencies, 0.50) * 1000:.2f}ms  p95 {percentile(latencies, 0.95) * 1000:.2f}ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the command server.")
+    parser.add_argument("--config", default="database.cfg", help="database configuration file, to pick names")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--clients", type=int, default=200, help="concurrent connections")
+    parser.add_argument("--commands", type=int, default=200, help="commands per client")
+    parser.add_argument("--pipeline", type=int, default=8, help="commands in flight per client")
+    args = parser.parse_args()
+
+    commands = sample_commands(args.config, args.clients * args.commands)
+    asyncio.run(run(args, commands))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+    Concurrency stress test of update_religion: runs --transfers random percentage transfers
+    between the religions of a scratch country, up to --concurrency of them at the same time,
+    and checks that the percentages still add up to 100 afterwards with none out of 0-100.
+
+    The scratch country is created for the run and removed afterwards. With --unlocked the
+    transfers call update_religion_v1, which does not lock the rows it changes, to show the
+    lost updates the locked version prevents.
+
+    Usage (from the repository root, against a migrated database):
+        python -m benchmarks.stress_religion [--config database.cfg] [--transfers 5000]
+                                             [--concurrency 32] [--religions 8] [--unlocked]
+"""
+import argparse
+import asyncio
+import collections
+import random
+import sys
+import time
+from decimal import Decimal
+
+from admin import Administrator
+from async_mp2 import AsyncMp2Client, create_pool
+from messages import *
+from mp2 import STATUS_MESSAGES
+
+COUNTRY_CODE = "ZZST"
+COUNTRY_NAME = "Religion Stress Test"
+
+
+async def create_country(pool, religions):
+    # one decimal per religion, the last one gets the remainder so the total is exactly 100
+    shares = [round(Decimal(100) / religions, 1)] * (religions - 1)
+    shares.append(100 - sum(shares))
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await drop_country(conn)
+            await conn.execute("INSERT INTO country (name, code) VALUES ($1, $2)", COUNTRY_NAME, COUNTRY_CODE)
+            await conn.executemany(
+                "INSERT INTO religion (country, name, percentage) VALUES ($1, $2, $3)",
+                [(COUNTRY_CODE, "Religion %d" % number, share) for number, share in enumerate(shares, 1)])
+
+
+async def drop_country(conn):
+    await conn.execute("DELETE FROM religion WHERE country = $1", COUNTRY_CODE)
+    await conn.execute("DELETE FROM country WHERE code = $1", COUNTRY_CODE)
+
+
+async def run(args):
+    pool = await create_pool(args.config, maxconn=args.concurrency)
+    client = AsyncMp2Client(pool, out=lambda line: None)
+    admin = Administrator("stress", 1)
+    rng = random.Random(args.seed)
+
+    names = ["Religion %d" % number for number in range(1, args.religions + 1)]
+    transfers = []
+    for _ in range(args.transfers):
+        religion_name1, religion_name2 = rng.sample(names, 2)
+        transfers.append((religion_name1, religion_name2, "%.1f" % rng.uniform(0.1, 5.0)))
+
+    outcomes = collections.Counter()
+    in_flight = asyncio.Semaphore(args.concurrency)
+
+    async def transfer(religion_name1, religion_name2, percentage):
+        async with in_flight:
+            if args.unlocked:
+                try:
+                    status = await pool.fetchval("SELECT status FROM update_religion_v1($1, $2, $3, $4)",
+                                                 COUNTRY_NAME, religion_name1, religion_name2, percentage)
+                    outcomes[STATUS_MESSAGES[status]] += 1
+                except Exception:
+                    outcomes[CMD_EXECUTION_FAILED] += 1
+            else:
+                _, message = await client.update_religion(admin, COUNTRY_NAME, religion_name1, religion_name2, percentage)
+                outcomes[message] += 1
+
+    try:
+        await create_country(pool, args.religions)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(transfer(*arguments) for arguments in transfers))
+        elapsed = time.perf_counter() - started
+
+        total, lowest, highest, count = await pool.fetchrow(
+            "SELECT sum(percentage), min(percentage), max(percentage), count(*) FROM religion WHERE country = $1",
+            COUNTRY_CODE)
+
+    finally:
+        async with pool.acquire() as conn:
+            await drop_country(conn)
+        await pool.close()
+
+    print(f"{args.transfers} transfers in {elapsed:.2f}s ({args.transfers / elapsed:.0f} transfers/s), "
+          f"{args.concurrency} concurrent, {client.retry_count} retried")
+    for message, times in outcomes.most_common():
+        print(f"{times:>8}  {message}")
+    print(f"{count} religions left, total {total}% (expected 100), lowest {lowest}%, highest {highest}%")
+
+    conserved = total == 100 and lowest >= 0 and highest <= 100
+    print("percentages conserved" if conserved else "PERCENTAGES NOT CONSERVED")
+    return conserved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run concurrent update_religion transfers and check the percentages.")
+    parser.add_argument("--config", default="database.cfg", help="database configuration file")
+    parser.add_argument("--transfers", type=int, default=5000, help="transfers to run")
+    parser.add_argument("--concurrency", type=int, default=32, help="transfers running at the same time")
+    parser.add_argument("--religions", type=int, default=8, help="religions of the scratch country")
+    parser.add_argument("--seed", type=int, default=352)
+    parser.add_argument("--unlocked", action="store_true", help="call update_religion_v1, without row locks")
+    args = parser.parse_args()
+
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+import json
+import time
+
+import psycopg2
+
+from config import read_config, read_flag
+from metrics import Histogram
+
+# channel the triggers of migrations/007_change_notifications.sql publish on
+CHANGE_CHANNEL = "mp2_changes"
+
+
+"""
+    Change event published by the triggers, see migrations/007_change_notifications.sql.
+    names is None when the statement changed too many rows to list them.
+"""
+class ChangeEvent:
+    def __init__(self, table, op, names):
+        self.table = table
+        self.op = op
+        self.names = names
+
+    def __repr__(self):
+        return "ChangeEvent(%r, %r, %r)" % (self.table, self.op, self.names)
+
+
+"""
+    Listens on the change channel on a connection of its own, outside of any transaction.
+    - poll() reads the notifications that arrived since the last call without blocking and
+      returns them as ChangeEvents; the client calls it before every command, so no command
+      reads a cache entry older than a change that was delivered before the command started.
+    - The time from a change to its poll is recorded in lag (a Histogram of microseconds),
+      measured with the database clock of the change, so hosts must share a clock.
+    - When the connection is lost, notifications may be lost with it: the next poll reconnects
+      and returns one event for every table (names None), and the caches are cleared.
+"""
+class ChangeListener:
+    def __init__(self, conn_params):
+        self.conn_params = conn_params
+        self.conn = None
+        self.connected_before = False
+
+        self.notifications = 0
+        self.reconnects = 0
+        self.lag = Histogram()
+
+    def listen(self):
+        self.conn = psycopg2.connect(**self.conn_params)
+        self.conn.autocommit = True
+        self.conn.cursor().execute("LISTEN " + CHANGE_CHANNEL)
+
+    def poll(self):
+        events = []
+
+        try:
+            if self.conn is None or self.conn.closed:
+                self.listen()
+                if self.connected_before:
+                    self.reconnects += 1
+                    events.append(ChangeEvent(None, None, None))
+                self.connected_before = True
+
+            self.conn.poll()
+        except psycopg2.Error:
+            self.close()
+            # nothing is known until the next poll reconnects, the caches only keep their ttl
+            return [ChangeEvent(None, None, None)]
+
+        now = time.time()
+        while self.conn.notifies:
+            notify = self.conn.notifies.pop(0)
+            try:
+                payload = json.loads(notify.payload)
+            except ValueError:
+                continue
+
+            self.notifications += 1
+            self.lag.record(max(0, int((now - float(payload.get("at", now))) * 1000000)))
+            events.append(ChangeEvent(payload.get("table"), payload.get("op"), payload.get("names")))
+
+        return events
+
+    def close(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+
+
+"""
+    True when the optional [change_notifications] section enables listening for changes of
+    other processes (the default is off, the caches then only keep their ttl).
+"""
+def read_change_notifications_config(config_filename):
+    notification_params = read_config(filename=config_filename, section="change_notifications", required=False)
+
+    return read_flag(notification_params, "enabled")
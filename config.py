@@ -1,7 +1,7 @@
 from configparser import ConfigParser
 
 
-def read_config(filename="database.cfg", section="postgresql"):
+def read_config(filename="database.cfg", section="postgresql", required=True):
     # create a parser
     parser = ConfigParser()
     # read config file
@@ -13,7 +13,15 @@ def read_config(filename="database.cfg", section="postgresql"):
         params = parser.items(section)
         for param in params:
             db[param[0]] = param[1]
-    else:
+    elif required:
         raise Exception('Section {0} not found in the {1} file'.format(section, filename))
 
     return db
+
+
+# reads an on/off setting of a section returned by read_config, anything but true/yes/on/1 is off
+def read_flag(params, key, default=False):
+    value = params.get(key)
+    if value is None:
+        return default
+    return value.strip().lower() in ("true", "yes", "on", "1")
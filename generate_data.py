@@ -0,0 +1,254 @@
+import argparse
+import csv
+import math
+import os
+import random
+import zlib
+
+import psycopg2
+
+from config import read_config
+from load_data import TABLES, fix_encoding, load_data
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# synthetic country codes: 4 characters starting with a digit, never clash with the real (alphabetic) codes
+CODE_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+SYNTHETIC_CODE_COUNT = 10 * 36 ** 3
+
+# share of city names that are kept as is in every copy, so they exist in many countries
+AMBIGUOUS_CITY_SHARE = 10
+
+
+"""
+    The bundled datasets, read once. Generated tables are derived from these rows.
+"""
+class BaseData:
+    def __init__(self, data_dir=BASE_DIR):
+        def read(table):
+            file_name = next(file_name for name, file_name, _ in TABLES if name == table)
+            with open(os.path.join(data_dir, file_name), newline="", encoding="utf-8") as csv_file:
+                reader = csv.reader(csv_file)
+                next(reader)
+                return [[fix_encoding(value) for value in row] for row in reader]
+
+        self.continents = read("continent")
+        self.countries = read("country")
+        self.economies = {row[0]: row for row in read("economy")}
+        self.encompasses = read("encompasses")
+        self.access_levels = read("accesslevels")
+
+        self.cities = {}
+        for row in read("city"):
+            self.cities.setdefault(row[1], []).append(row)
+
+        self.religions = {}
+        for row in read("religion"):
+            self.religions.setdefault(row[0], []).append(row)
+
+        self.languages = {}
+        for row in read("spoken"):
+            self.languages.setdefault(row[0], []).append(row)
+
+
+def copy_code(copy, index, country_count):
+    # copy 0 keeps the real codes, later copies get 4-character codes starting with a digit
+    if copy == 0:
+        return None
+    number = (copy - 1) * country_count + index
+    chars = []
+    for _ in range(3):
+        number, remainder = divmod(number, 36)
+        chars.append(CODE_ALPHABET[remainder])
+    return CODE_ALPHABET[number] + "".join(reversed(chars))
+
+
+def copy_name(name, copy, max_length=50):
+    if copy == 0:
+        return name
+    suffix = " %d" % copy
+    return name[:max_length - len(suffix)] + suffix
+
+
+def copy_city_name(name, copy):
+    # a fixed share of the names (same ones in every copy) stay unchanged and become ambiguous
+    if copy == 0 or zlib.crc32(name.encode("utf-8")) % AMBIGUOUS_CITY_SHARE == 0:
+        return name
+    return copy_name(name, copy)
+
+
+def jitter(value, rng, low=0.5, high=1.5):
+    if value in ("", None):
+        return value
+    number = float(value)
+    scaled = number * rng.uniform(low, high)
+    return str(int(scaled)) if number == int(number) else "%.1f" % scaled
+
+
+"""
+    Spreads part of the percentages of rows over extra synthetic entries.
+    rows are [country, name, percentage] lists, returns the new list of rows.
+"""
+def with_extra_entries(rows, code, extra_count, prefix, pool_size, rng):
+    if extra_count == 0 or not rows:
+        return [[code] + row[1:] for row in rows]
+
+    share = 0.2
+    result = []
+    taken = 0.0
+    for row in rows:
+        percentage = float(row[2]) if row[2] else 0.0
+        kept = round(percentage * (1 - share), 1)
+        taken += percentage - kept
+        result.append([code, row[1], ("%g" % kept) if row[2] else row[2]])
+
+    existing = {row[1] for row in rows}
+    names = [name for name in ("%s %d" % (prefix, number) for number in rng.sample(range(pool_size), extra_count))
+             if name not in existing]
+    for name in names:
+        # round down so the total never grows
+        result.append([code, name, "%g" % (math.floor(taken / len(names) * 10) / 10)])
+    return result
+
+
+"""
+    Returns a dict mapping each table to a lazy iterator of rows (in the column order of
+    load_data.TABLES) for a dataset scale times the size of the bundled one.
+    - Copy 0 is the bundled data, copies 1..scale-1 get renamed countries with new codes.
+    - A tenth of the city names are shared by every copy, so ambiguous city names exist.
+    - Copies get extra religions and languages, more of them at larger scales.
+    - Every foreign key and capital refers to a generated row.
+"""
+def generate_tables(scale, seed=352, data_dir=BASE_DIR):
+    base = BaseData(data_dir)
+    country_count = len(base.countries)
+
+    max_scale = 1 + SYNTHETIC_CODE_COUNT // country_count
+    if not 1 <= scale <= max_scale:
+        raise ValueError("scale must be between 1 and %d" % max_scale)
+
+    extra_max = int(math.log10(scale) * 5) if scale > 1 else 0
+
+    def code_for(copy, index, code):
+        return copy_code(copy, index, country_count) or code
+
+    def copies():
+        for copy in range(scale):
+            for index, country in enumerate(base.countries):
+                yield copy, index, country
+
+    def continents():
+        for row in base.continents:
+            yield row
+
+    def countries():
+        rng = random.Random(seed)
+        for copy, index, (name, code, capital, area, population) in copies():
+            yield [copy_name(name, copy), code_for(copy, index, code),
+                   copy_city_name(capital, copy) if capital else capital,
+                   area, population if copy == 0 else jitter(population, rng)]
+
+    def cities():
+        rng = random.Random(seed + 1)
+        for copy, index, country in copies():
+            code = code_for(copy, index, country[1])
+            for name, _, population, elevation in base.cities.get(country[1], []):
+                yield [copy_city_name(name, copy), code,
+                       population if copy == 0 else jitter(population, rng), elevation]
+
+    def economies():
+        rng = random.Random(seed + 2)
+        for copy, index, country in copies():
+            row = base.economies.get(country[1])
+            if row is None:
+                continue
+            gdp = row[1] if copy == 0 else jitter(row[1], rng)
+            yield [code_for(copy, index, country[1]), gdp] + row[2:]
+
+    def religions():
+        rng = random.Random(seed + 3)
+        for copy, index, country in copies():
+            extra = rng.randint(0, extra_max) if copy else 0
+            rows = [[row[0], row[1], row[2]] for row in base.religions.get(country[1], [])]
+            for row in with_extra_entries(rows, code_for(copy, index, country[1]), extra, "Religion", 1000, rng):
+                yield row
+
+    def languages():
+        rng = random.Random(seed + 4)
+        for copy, index, country in copies():
+            extra = rng.randint(0, extra_max) if copy else 0
+            rows = [[row[0], row[1], row[2]] for row in base.languages.get(country[1], [])]
+            for row in with_extra_entries(rows, code_for(copy, index, country[1]), extra, "Language", 5000, rng):
+                yield row
+
+    def encompasses():
+        codes = {}
+        for copy in range(scale):
+            for index, country in enumerate(base.countries):
+                codes[country[1]] = code_for(copy, index, country[1])
+            for code, continent, percentage in base.encompasses:
+                if code in codes:
+                    yield [codes[code], continent, percentage]
+
+    def access_levels():
+        for row in base.access_levels:
+            yield row
+
+    return {
+        "continent": continents(),
+        "country": countries(),
+        "city": cities(),
+        "economy": economies(),
+        "religion": religions(),
+        "spoken": languages(),
+        "encompasses": encompasses(),
+        "accesslevels": access_levels(),
+    }
+
+
+"""
+    Writes the generated tables as csv files with the same names and headers as the bundled ones.
+"""
+def write_csv(tables, output_dir, data_dir=BASE_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+
+    for table, file_name, _ in TABLES:
+        with open(os.path.join(data_dir, file_name), newline="", encoding="utf-8") as base_file:
+            header = next(csv.reader(base_file))
+
+        count = 0
+        with open(os.path.join(output_dir, file_name), "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file, lineterminator="\n")
+            writer.writerow(header)
+            for row in tables[table]:
+                writer.writerow(row)
+                count += 1
+        print(f"{file_name:<16} {count:>10} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a scaled, consistent copy of the geography datasets.")
+    parser.add_argument("--scale", type=int, default=10, help="size relative to the bundled datasets")
+    parser.add_argument("--seed", type=int, default=352, help="random seed")
+    parser.add_argument("--output-dir", help="write csv files to this directory")
+    parser.add_argument("--load", action="store_true", help="stream the data straight into the database instead")
+    parser.add_argument("--config", default="database.cfg", help="database configuration file used with --load")
+    args = parser.parse_args()
+
+    if bool(args.output_dir) == args.load:
+        parser.error("give exactly one of --output-dir and --load")
+
+    tables = generate_tables(args.scale, seed=args.seed)
+
+    if args.output_dir:
+        write_csv(tables, args.output_dir)
+    else:
+        conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+        try:
+            load_data(conn, sources=tables, reset=True, repair_encoding=False)
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+import argparse
+import csv
+import io
+import os
+import re
+import time
+
+import psycopg2
+
+from config import read_config
+from migrate import apply_migrations
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "construct_db.sql")
+
+# (table, csv file, table columns in the order they appear in the csv file)
+# tables are listed parents first so foreign keys can be validated in this order
+TABLES = [
+    ("continent", "continent.csv", ("name", "area")),
+    ("country", "country.csv", ("name", "code", "capital", "area", "population")),
+    ("city", "city.csv", ("name", "country", "population", "elevation")),
+    ("economy", "economy.csv", ("country", "gdp", "agriculture", "service", "industry", "inflation", "unemployment")),
+    ("religion", "religion.csv", ("country", "name", "percentage")),
+    ("spoken", "spoken.csv", ("country", "language", "percentage")),
+    ("encompasses", "encompasses.csv", ("country", "continent", "percentage")),
+    ("accesslevels", "accesslevel.csv", ("level_id", "name", "max_parallel_sessions")),
+]
+
+# every table created by construct_db.sql, children first so they can be dropped in this order
+SCHEMA_TABLES = ["continent_summary", "continent_summary_member", "country_summary", "users", "administrators",
+                 "accesslevels", "encompasses", "spoken", "religion", "economy", "city", "continent", "country"]
+
+
+# a UTF-8 lead byte followed by a space, the no-break space 0xa0 of e.g. 'Š' (c5 a0) was
+# turned into a plain space somewhere on its way into the csv files ('Å achty')
+LOST_NO_BREAK_SPACE_PATTERN = re.compile(rb"([\xc2-\xdf]) (?=[a-z\xc2-\xf4])")
+# what mis-encoded text still contains: a UTF-8 lead byte followed by a continuation byte,
+# or by the space of a lost no-break space
+MIS_ENCODED_PATTERN = re.compile(rb"[\xc2-\xf4][\x80-\xbf]|" + LOST_NO_BREAK_SPACE_PATTERN.pattern)
+
+
+"""
+    Returns the bytes value was decoded from as cp1252/latin-1, None when a character has no byte.
+"""
+def cp1252_bytes(value):
+    raw = bytearray()
+    for char in value:
+        code_point = ord(char)
+        # latin-1 maps the bytes cp1252 leaves undefined (0x81, 0x8d, 0x8f, 0x90, 0x9d)
+        if code_point < 256:
+            raw.append(code_point)
+        else:
+            try:
+                raw += char.encode("cp1252")
+            except UnicodeError:
+                return None
+    return bytes(raw)
+
+
+"""
+    Repairs text that was UTF-8 encoded, decoded as cp1252/latin-1 and encoded as UTF-8 again,
+    e.g. 'ShkodÃ«r' -> 'Shkodër'. Text that went through this more than once is repaired until
+    it stops changing. Values that are not mis-encoded are returned unchanged.
+"""
+def fix_encoding(value):
+    while not value.isascii():
+        raw = cp1252_bytes(value)
+        if raw is None or MIS_ENCODED_PATTERN.search(raw) is None:
+            break
+
+        try:
+            value = raw.decode("utf-8")
+        except UnicodeError:
+            try:
+                value = LOST_NO_BREAK_SPACE_PATTERN.sub(lambda match: match.group(1) + b"\xa0", raw).decode("utf-8")
+            except UnicodeError:
+                break
+
+    return value
+
+
+"""
+    True when value still looks mis-encoded, i.e. fix_encoding could not repair it.
+"""
+def is_mis_encoded(value):
+    if value.isascii():
+        return False
+    raw = cp1252_bytes(value)
+    return raw is not None and MIS_ENCODED_PATTERN.search(raw) is not None
+
+
+"""
+    Read-only file-like object over an iterable of rows, producing CSV text for COPY FROM STDIN.
+    Rows are converted in batches so memory use does not depend on the number of rows.
+"""
+class CsvRowStream:
+    def __init__(self, rows, repair_encoding=True, batch_size=5000):
+        self.rows = iter(rows)
+        self.repair_encoding = repair_encoding
+        self.batch_size = batch_size
+        self.rows_read = 0
+        # values fix_encoding left mis-encoded, reported after the load
+        self.unrepaired = []
+
+        self._buffer = ""
+        self._out = io.StringIO()
+        self._writer = csv.writer(self._out, lineterminator="\n")
+        self._exhausted = False
+
+    def _fill(self):
+        batch = []
+        for row in self.rows:
+            if self.repair_encoding:
+                row = [fix_encoding(value) if isinstance(value, str) else value for value in row]
+                self.unrepaired.extend(value for value in row if isinstance(value, str) and is_mis_encoded(value))
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                break
+
+        if not batch:
+            self._exhausted = True
+            return
+
+        self.rows_read += len(batch)
+        self._out.seek(0)
+        self._out.truncate()
+        self._writer.writerows(batch)
+        self._buffer += self._out.getvalue()
+
+    def read(self, size=-1):
+        while not self._exhausted and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+
+        if size is None or size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while not self._exhausted and "\n" not in self._buffer:
+            self._fill()
+
+        end = self._buffer.find("\n") + 1 or len(self._buffer)
+        if size is not None and 0 <= size < end:
+            end = size
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+
+"""
+    Yields the data rows of a csv file, checking the header has the expected number of columns.
+"""
+def read_csv_rows(path, column_count):
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, None)
+        if header is None or len(header) != column_count:
+            raise ValueError(f"{path}: expected {column_count} columns, found header {header}")
+        for row in reader:
+            yield row
+
+
+"""
+    Streams rows into table with COPY FROM STDIN. Returns the number of rows loaded and the
+    values that were loaded still mis-encoded.
+"""
+def copy_rows(query_ex, table, columns, rows, repair_encoding=True):
+    stream = CsvRowStream(rows, repair_encoding=repair_encoding)
+    query_ex.copy_expert(
+        "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(table, ", ".join(columns)),
+        stream
+    )
+    return stream.rows_read, stream.unrepaired
+
+
+"""
+    Drops primary key, unique and foreign key constraints of the given tables (and foreign keys
+    of other tables referencing them) and returns their definitions so they can be rebuilt
+    after the load (foreign keys last).
+"""
+def drop_constraints(query_ex, tables):
+    query_ex.execute("""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid), contype
+        FROM pg_constraint
+        WHERE (conrelid = ANY(%s::regclass[]) AND contype IN ('p', 'u', 'f'))
+           OR (confrelid = ANY(%s::regclass[]) AND contype = 'f')
+        ORDER BY contype = 'f', conrelid::regclass::text, conname
+    """, (list(tables), list(tables)))
+    constraints = query_ex.fetchall()
+
+    # foreign keys depend on the referenced keys, drop them first
+    for table, name, _, _ in reversed(constraints):
+        query_ex.execute("ALTER TABLE {} DROP CONSTRAINT {}".format(table, name))
+
+    return constraints
+
+
+def restore_constraints(query_ex, constraints):
+    for table, name, definition, _ in constraints:
+        query_ex.execute("ALTER TABLE {} ADD CONSTRAINT {} {}".format(table, name, definition))
+
+
+# unrepaired values printed per table, the others are only counted
+UNREPAIRED_SHOWN = 5
+
+
+def report(label, rows, seconds, unrepaired=()):
+    rate = rows / seconds if seconds > 0 else float("inf")
+    print(f"{label:<14} {rows:>10} rows {seconds:>8.2f}s {rate:>12,.0f} rows/s")
+    if unrepaired:
+        print(f"{'':<14} {len(unrepaired):>10} values left mis-encoded: "
+              + ", ".join(repr(value) for value in unrepaired[:UNREPAIRED_SHOWN])
+              + (", ..." if len(unrepaired) > UNREPAIRED_SHOWN else ""))
+
+
+"""
+    Creates the schema and bulk loads the datasets.
+    - sources maps table name to an iterable of rows in the column order of TABLES,
+      by default the csv files in data_dir are read.
+    - Keys and foreign keys are built after the data is in, then migrations are applied.
+"""
+def load_data(conn, data_dir=".", sources=None, reset=False, repair_encoding=True):
+    query_ex = conn.cursor()
+
+    if sources is None:
+        sources = {
+            table: read_csv_rows(os.path.join(data_dir, file_name), len(columns))
+            for table, file_name, columns in TABLES
+        }
+
+    # bigger sort memory for the index builds, no need to wait for WAL flushes of a bulk load
+    query_ex.execute("SET maintenance_work_mem = '512MB'")
+    query_ex.execute("SET synchronous_commit = off")
+
+    if reset:
+        for table in SCHEMA_TABLES:
+            query_ex.execute("DROP TABLE IF EXISTS {} CASCADE".format(table))
+        query_ex.execute("DROP TABLE IF EXISTS schema_migrations")
+
+    with open(SCHEMA_FILE) as schema_file:
+        query_ex.execute(schema_file.read())
+
+    loaded_tables = [table for table, _, _ in TABLES if table in sources]
+    constraints = drop_constraints(query_ex, loaded_tables)
+
+    total_rows = 0
+    total_started = time.monotonic()
+
+    for table, _, columns in TABLES:
+        if table not in sources:
+            continue
+        started = time.monotonic()
+        rows, unrepaired = copy_rows(query_ex, table, columns, sources[table], repair_encoding=repair_encoding)
+        report(table, rows, time.monotonic() - started, unrepaired)
+        total_rows += rows
+
+    started = time.monotonic()
+    restore_constraints(query_ex, constraints)
+    print(f"{'constraints':<14} {len(constraints):>10} keys {time.monotonic() - started:>8.2f}s")
+
+    # level_id is SERIAL but the csv sets it explicitly
+    query_ex.execute("""
+        SELECT setval(pg_get_serial_sequence('accesslevels', 'level_id'),
+                      COALESCE((SELECT MAX(level_id) FROM accesslevels), 0) + 1, false)
+    """)
+
+    conn.commit()
+
+    started = time.monotonic()
+    applied = apply_migrations(conn)
+    print(f"{'migrations':<14} {len(applied):>10} applied {time.monotonic() - started:>5.2f}s")
+
+    conn.autocommit = True
+    started = time.monotonic()
+    query_ex.execute("ANALYZE")
+    conn.autocommit = False
+    print(f"{'analyze':<14} {'':>10}      {time.monotonic() - started:>8.2f}s")
+
+    report("total", total_rows, time.monotonic() - total_started)
+    return total_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the schema and bulk load the geography datasets.")
+    parser.add_argument("--config", default="database.cfg", help="database configuration file")
+    parser.add_argument("--data-dir", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory containing the csv files")
+    parser.add_argument("--reset", action="store_true", help="drop existing tables first")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    try:
+        load_data(conn, data_dir=args.data_dir, reset=args.reset)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,7 @@
+import argparse
+import sys
+import time
+
 from mp2 import Mp2Client, tokenize_command
 from validators import *
 
@@ -6,6 +10,15 @@ ANON_USER = "GUEST"
 ANON_USER_ID = None
 POSTGRESQL_CONFIG_FILE_NAME = "database.cfg"
 
+# commands that may write to the database (get_statistics and the listings count guest queries)
+WRITE_COMMANDS = {"sign_up", "sign_in", "sign_out", "change_level", "get_statistics",
+                  "update_religion", "transfer_city", "adjust_population", "bulk_adjust_population",
+                  "bulk_transfer_city", "list_cities", "list_countries", "list_religions"}
+
+# every command, others are not recorded by the metrics
+COMMANDS = WRITE_COMMANDS | {"help", "quit", "show_levels", "show_my_level", "export", "check_summaries",
+                             "pool_stats", "stats", "cache_stats"}
+
 def print_success_msg(message):
     print(message)
 
@@ -23,249 +36,464 @@ def print_admin_info(admin):
         print(ANON_USER, end=" > ")
 
 
-def main():
-    global AUTHENTICATED_ADMIN, POSTGRESQL_CONFIG_FILE_NAME, ANON_USER_ID
+"""
+    Executes one tokenized command like dispatch_command and, with metrics enabled,
+    records its wall time under the command name.
+"""
+def execute_command(client, cmd_tokens):
+    cmd = cmd_tokens[0] if len(cmd_tokens) > 0 else ""
+    if cmd not in COMMANDS:
+        cmd = None
 
-    client = Mp2Client(config_filename=POSTGRESQL_CONFIG_FILE_NAME)
-    ANON_USER_ID = client.user.user_id
-    client.help()
+    client.start_command(cmd)
+    if client.metrics is None or cmd is None:
+        return dispatch_command(client, cmd_tokens)
 
-    while True:
-        # print customer information if signed in
-        print_admin_info(admin=AUTHENTICATED_ADMIN)
+    started = time.perf_counter()
+    try:
+        return dispatch_command(client, cmd_tokens)
+    finally:
+        client.metrics.record_command(cmd, time.perf_counter() - started)
 
-        # get new command from user
-        cmd_text = input()
-        cmd_tokens = tokenize_command(cmd_text)
-        cmd = cmd_tokens[0] if len(cmd_tokens) > 0 else ""
 
-        if cmd == "help":
-            client.help()
+"""
+    Validates and executes one tokenized command, printing its result.
+    Returns False when the program should stop (successful quit), True otherwise.
+"""
+def dispatch_command(client, cmd_tokens):
+    global AUTHENTICATED_ADMIN, ANON_USER_ID
 
-        elif cmd == "sign_up":
-            # validate command
-            validation_result, validation_message = sign_up_validator(AUTHENTICATED_ADMIN, cmd_tokens)
+    cmd = cmd_tokens[0] if len(cmd_tokens) > 0 else ""
 
-            if validation_result:
-                client.connect()
-                _, arg_seller_id, arg_password, arg_plan_id = cmd_tokens
+    if cmd == "help":
+        client.help()
 
-                # sign up
-                exec_success, exec_message = client.sign_up(admin_id=arg_seller_id, password=arg_password, level_id=arg_plan_id)
+    elif cmd == "sign_up":
+        # validate command
+        validation_result, validation_message = sign_up_validator(AUTHENTICATED_ADMIN, cmd_tokens)
 
-                client.disconnect()
+        if validation_result:
+            _, arg_seller_id, arg_password, arg_plan_id = cmd_tokens
 
-                # print message
-                if exec_success:
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
+            # sign up
+            exec_success, exec_message = client.sign_up(admin_id=arg_seller_id, password=arg_password, level_id=arg_plan_id)
 
+            # print message
+            if exec_success:
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd == "sign_in":
+        # validate command
+        validation_result, validation_message = sign_in_validator(AUTHENTICATED_ADMIN, cmd_tokens)
 
-        elif cmd == "sign_in":
-            # validate command
-            validation_result, validation_message = sign_in_validator(AUTHENTICATED_ADMIN, cmd_tokens)
+        if validation_result:
+            _, arg_seller_id, arg_password = cmd_tokens
+
+            seller, exec_message = client.sign_in(admin_id=arg_seller_id, password=arg_password)
+
+            if seller:
+                ANON_USER_ID = None
+                AUTHENTICATED_ADMIN = seller
+                print_success_msg(exec_message)
+            else:
+                print_error_msg(exec_message)
 
-            if validation_result:
-                _, arg_seller_id, arg_password = cmd_tokens
+        else:
+            print_error_msg(validation_message)
 
-                client.connect()
-                seller, exec_message = client.sign_in(admin_id=arg_seller_id, password=arg_password)
+    elif cmd == "sign_out":
+        # validate command
+        validation_result, validation_message = basic_validator(AUTHENTICATED_ADMIN, cmd_tokens)
+        if validation_result:
+            exec_success, exec_message = client.sign_out(admin=AUTHENTICATED_ADMIN)
 
-                if seller:
-                    ANON_USER_ID = None
-                    AUTHENTICATED_ADMIN = seller
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
+            if exec_success:
+                ANON_USER_ID = client.user.user_id
+                AUTHENTICATED_ADMIN = None
+                print_success_msg(exec_message)
 
             else:
-                print_error_msg(validation_message)
+                print_error_msg(exec_message)
 
-        elif cmd == "sign_out":
-            # validate command
-            validation_result, validation_message = basic_validator(AUTHENTICATED_ADMIN, cmd_tokens)
-            client.connect()
-            if validation_result:
-                exec_success, exec_message = client.sign_out(admin=AUTHENTICATED_ADMIN)
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd == "quit":
+        # validate command
+        validation_result, validation_message = quit_validator(cmd_tokens)
 
-                if exec_success:
-                    ANON_USER_ID = client.user.user_id
-                    AUTHENTICATED_ADMIN = None
-                    print_success_msg(exec_message)
+        if validation_result:
 
-                else:
-                    print_error_msg(exec_message)
+            exec_success, exec_message = client.quit(admin=AUTHENTICATED_ADMIN)
 
+            if exec_success:
+                return False
             else:
-                print_error_msg(validation_message)
-            client.disconnect()
+                print_error_msg(exec_message)
 
-        elif cmd == "quit":
-            client.connect()
-            # validate command
-            validation_result, validation_message = quit_validator(cmd_tokens)
+        else:
+            print_error_msg(validation_message)
+    
+    elif cmd == "show_levels":
+        # validate command
+        exec_success, exec_message = client.show_levels()
+        if exec_success:
+            print_success_msg(exec_message)
+        else:
+            print_error_msg(exec_message)
+    
+    elif cmd == "show_my_level":
+        # validate command
+        exec_success, exec_message = client.show_my_level(admin=AUTHENTICATED_ADMIN)
+        if exec_success:
+            print_success_msg(exec_message)
+        else:
+            print_error_msg(exec_message)
+
+    elif cmd == "change_level":
+        # validate command
+        validation_result, validation_message = change_level_validator(cmd_tokens)
 
-            if validation_result:
+        if validation_result:
+            _, arg_plan_id = cmd_tokens
 
-                exec_success, exec_message = client.quit(admin=AUTHENTICATED_ADMIN)
+            seller, exec_message = client.change_level(admin=AUTHENTICATED_ADMIN, new_level_id=arg_plan_id)
 
-                if exec_success:
-                    client.disconnect()
-                    break
-                else:
-                    print_error_msg(exec_message)
+            if seller:
+                AUTHENTICATED_ADMIN = seller
+                print_success_msg(exec_message)
 
             else:
-                print_error_msg(validation_message)
-            client.disconnect()
-        
-        elif cmd == "show_levels":
-            # validate command
-            client.connect()
-            exec_success, exec_message = client.show_levels()
-            client.disconnect()
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
+    elif cmd == "get_statistics":
+        # validate command
+        validation_result, validation_message = get_statistics_validator(cmd_tokens)
+
+        if validation_result:
+            if len(cmd_tokens) == 3:
+                _, name, arg_country_name = cmd_tokens
+            elif len(cmd_tokens) == 2:
+                _, name = cmd_tokens
+                arg_country_name = None
+
+            exec_success, exec_message = client.get_statistics(name=name, country_name=arg_country_name)
+
             if exec_success:
                 print_success_msg(exec_message)
             else:
                 print_error_msg(exec_message)
-        
-        elif cmd == "show_my_level":
-            # validate command
-            client.connect()
-            exec_success, exec_message = client.show_my_level(admin=AUTHENTICATED_ADMIN)
-            client.disconnect()
+
+        else:
+            print_error_msg(validation_message)
+    
+    elif cmd == "update_religion":
+        # validate command
+        validation_result, validation_message = update_religion_validator(cmd_tokens)
+
+        if validation_result:
+            _, country_name, religion_name1, religion_name2, percentage = cmd_tokens
+
+            exec_success, exec_message = client.update_religion(
+                admin=AUTHENTICATED_ADMIN,
+                country_name=country_name,
+                religion_name1=religion_name1,
+                religion_name2=religion_name2,
+                percentage=percentage
+            )
+
             if exec_success:
                 print_success_msg(exec_message)
             else:
                 print_error_msg(exec_message)
 
-        elif cmd == "change_level":
-            # validate command
-            client.connect()
-            validation_result, validation_message = change_level_validator(cmd_tokens)
+        else:
+            print_error_msg(validation_message)
+    elif cmd == "transfer_city":
+        # validate command
+        validation_result, validation_message = transfer_city_validator(cmd_tokens)
 
-            if validation_result:
-                _, arg_plan_id = cmd_tokens
+        if validation_result:
+            _, city_name, current_country, new_country = cmd_tokens
 
-                seller, exec_message = client.change_level(admin=AUTHENTICATED_ADMIN, new_level_id=arg_plan_id)
+            exec_success, exec_message = client.transfer_city(
+                admin=AUTHENTICATED_ADMIN,
+                city_name=city_name,
+                current_country=current_country,
+                new_country=new_country
+            )
 
-                if seller:
-                    AUTHENTICATED_ADMIN = seller
-                    print_success_msg(exec_message)
+            if exec_success:
+                print_success_msg(exec_message)
+            else:
+                print_error_msg(exec_message)
 
-                else:
-                    print_error_msg(exec_message)
+        else:
+            print_error_msg(validation_message)
+    
+    elif cmd == "adjust_population":
+        # validate command
+        validation_result, validation_message = adjust_population_validator(cmd_tokens)
+
+        if validation_result:
+            if len(cmd_tokens) == 4:
+                _, name, country_name, new_population = cmd_tokens
+            elif len(cmd_tokens) == 3:
+                _, name, new_population = cmd_tokens
+                country_name = None
+
+            exec_success, exec_message = client.adjust_population(
+                admin=AUTHENTICATED_ADMIN,
+                name=name,
+                country_name=country_name,
+                new_population=new_population
+            )
 
+            if exec_success:
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
-            client.disconnect()
-        elif cmd == "get_statistics":
-            # validate command
-            client.connect()
-            validation_result, validation_message = get_statistics_validator(cmd_tokens)
-
-            if validation_result:
-                if len(cmd_tokens) == 3:
-                    _, name, arg_country_name = cmd_tokens
-                elif len(cmd_tokens) == 2:
-                    _, name = cmd_tokens
-                    arg_country_name = None
-
-                exec_success, exec_message = client.get_statistics(name=name, country_name=arg_country_name)
-
-                if exec_success:
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
 
+    elif cmd == "bulk_adjust_population":
+        # validate command
+        validation_result, validation_message = bulk_adjust_population_validator(cmd_tokens)
+
+        if validation_result:
+            _, file_path = cmd_tokens
+
+            exec_success, exec_message = client.bulk_adjust_population(admin=AUTHENTICATED_ADMIN, file_path=file_path)
+
+            if exec_success:
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
-            client.disconnect()
-        
-        elif cmd == "update_religion":
-            # validate command
-            client.connect()
-            validation_result, validation_message = update_religion_validator(cmd_tokens)
-
-            if validation_result:
-                _, country_name, religion_name1, religion_name2, percentage = cmd_tokens
-
-                exec_success, exec_message = client.update_religion(
-                    admin=AUTHENTICATED_ADMIN,
-                    country_name=country_name,
-                    religion_name1=religion_name1,
-                    religion_name2=religion_name2,
-                    percentage=percentage
-                )
-
-                if exec_success:
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd == "bulk_transfer_city":
+        # validate command
+        validation_result, validation_message = bulk_transfer_city_validator(cmd_tokens)
 
+        if validation_result:
+            _, file_path = cmd_tokens
+
+            exec_success, exec_message = client.bulk_transfer_city(admin=AUTHENTICATED_ADMIN, file_path=file_path)
+
+            if exec_success:
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
-            client.disconnect()
-        elif cmd == "transfer_city":
-            # validate command
-            client.connect()
-            validation_result, validation_message = transfer_city_validator(cmd_tokens)
-
-            if validation_result:
-                _, city_name, current_country, new_country = cmd_tokens
-
-                exec_success, exec_message = client.transfer_city(
-                    admin=AUTHENTICATED_ADMIN,
-                    city_name=city_name,
-                    current_country=current_country,
-                    new_country=new_country
-                )
-
-                if exec_success:
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd == "export":
+        # validate command
+        validation_result, validation_message = export_validator(cmd_tokens)
 
+        if validation_result:
+            source, file_path = cmd_tokens[1:3]
+            export_format = cmd_tokens[3] if len(cmd_tokens) > 3 else "csv"
+
+            exec_success, exec_message = client.export(admin=AUTHENTICATED_ADMIN, source=source,
+                                                       file_path=file_path, export_format=export_format)
+
+            if exec_success:
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
-            client.disconnect()
-        
-        elif cmd == "adjust_population":
-            # validate command
-            client.connect()
-            validation_result, validation_message = adjust_population_validator(cmd_tokens)
-
-            if validation_result:
-                if len(cmd_tokens) == 4:
-                    _, name, country_name, new_population = cmd_tokens
-                elif len(cmd_tokens) == 3:
-                    _, name, new_population = cmd_tokens
-                    country_name = None
-
-                exec_success, exec_message = client.adjust_population(
-                    admin=AUTHENTICATED_ADMIN,
-                    name=name,
-                    country_name=country_name,
-                    new_population=new_population
-                )
-
-                if exec_success:
-                    print_success_msg(exec_message)
-                else:
-                    print_error_msg(exec_message)
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd in ("list_cities", "list_countries", "list_religions"):
+        # validate command
+        validation_result, validation_message = list_validator(cmd_tokens)
+
+        if validation_result:
+            _, name = cmd_tokens
+
+            exec_success, exec_message = getattr(client, cmd)(name)
+
+            if exec_success:
+                print_success_msg(exec_message)
+            else:
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
 
+    elif cmd == "check_summaries":
+        # validate command
+        validation_result, validation_message = check_summaries_validator(cmd_tokens)
+
+        if validation_result:
+            exec_success, exec_message = client.check_summaries(admin=AUTHENTICATED_ADMIN)
+
+            if exec_success:
+                print_success_msg(exec_message)
             else:
-                print_error_msg(validation_message)
-            client.disconnect()
+                print_error_msg(exec_message)
 
-        elif cmd == "":
-            pass
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd == "pool_stats":
+        # validate command
+        validation_result, validation_message = pool_stats_validator(cmd_tokens)
+
+        if validation_result:
+            exec_success, exec_message = client.pool_stats()
+
+            if exec_success:
+                print_success_msg(exec_message)
+            else:
+                print_error_msg(exec_message)
 
         else:
-            print_error_msg(messages.CMD_UNDEFINED)
+            print_error_msg(validation_message)
+
+    elif cmd == "stats":
+        # validate command
+        validation_result, validation_message = stats_validator(cmd_tokens)
+
+        if validation_result:
+            exec_success, exec_message = client.stats()
+
+            if exec_success:
+                print_success_msg(exec_message)
+            else:
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd == "cache_stats":
+        # validate command
+        validation_result, validation_message = cache_stats_validator(cmd_tokens)
+
+        if validation_result:
+            exec_success, exec_message = client.cache_stats()
+
+            if exec_success:
+                print_success_msg(exec_message)
+            else:
+                print_error_msg(exec_message)
+
+        else:
+            print_error_msg(validation_message)
+
+    elif cmd == "":
+        pass
+
+    else:
+        print_error_msg(messages.CMD_UNDEFINED)
+
+
+    return True
+
+
+def run_interactive(client):
+    client.help()
+
+    # also closed when input ends (EOFError) or on ctrl-c, so the quota is flushed and metrics are dumped
+    try:
+        while True:
+            # print customer information if signed in
+            print_admin_info(admin=AUTHENTICATED_ADMIN)
+
+            # get new command from user
+            cmd_text = input()
+            cmd_tokens = tokenize_command(cmd_text)
+
+            if not execute_command(client, cmd_tokens):
+                break
+    finally:
+        client.close()
+
+
+"""
+    Executes the commands of script_file over one long-lived connection.
+    - Every command runs in its own savepoint, so a failing command only rolls back itself.
+    - The transaction is committed after every group_size write commands and at the end.
+    - Reaching the end of the script quits as if the quit command was given.
+    - Total throughput is reported on stderr at the end.
+"""
+def run_batch(client, script_file, group_size=1):
+    command_count = 0
+    pending_writes = 0
+    running = True
+    started = time.monotonic()
+
+    client.begin_batch()
+
+    try:
+        for cmd_text in script_file:
+            cmd_tokens = tokenize_command(cmd_text)
+            if len(cmd_tokens) == 0:
+                continue
+
+            command_count += 1
+            running = execute_command(client, cmd_tokens)
+            client.end_command()
+
+            if cmd_tokens[0] in WRITE_COMMANDS:
+                pending_writes += 1
+                if pending_writes >= group_size:
+                    client.commit_batch()
+                    pending_writes = 0
+
+            if not running:
+                break
+
+        if running:
+            # end of script, sign out and remove the guest user like quit does
+            execute_command(client, ["quit"])
+            client.end_command()
+
+    finally:
+        client.end_batch()
+        client.close()
+
+    elapsed = time.monotonic() - started
+    rate = command_count / elapsed if elapsed > 0 else 0.0
+    print(f"{command_count} commands in {elapsed:.3f}s ({rate:.1f} commands/s)", file=sys.stderr)
+
+
+def main():
+    global POSTGRESQL_CONFIG_FILE_NAME, ANON_USER_ID
+
+    parser = argparse.ArgumentParser(description="Geographic Information System")
+    parser.add_argument("--script", help="execute the commands in this file instead of reading them interactively")
+    parser.add_argument("--group", type=int, default=1,
+                        help="number of write commands committed together in batch mode (default 1)")
+    args = parser.parse_args()
+
+    if args.group < 1:
+        parser.error("--group must be at least 1")
+
+    client = Mp2Client(config_filename=POSTGRESQL_CONFIG_FILE_NAME)
+    ANON_USER_ID = client.user.user_id
+
+    if args.script:
+        with open(args.script) as script_file:
+            run_batch(client, script_file, group_size=args.group)
+    elif not sys.stdin.isatty():
+        # commands piped in
+        run_batch(client, sys.stdin, group_size=args.group)
+    else:
+        run_interactive(client)
 
 
 if __name__ == '__main__':
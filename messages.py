@@ -28,10 +28,23 @@ NO_ENTITY_FOUND = "No geographic entity named with given name found."
 RELIGION_NOT_FOUND = "Given religion name not found in country."
 RELIGION_INSUFFICIENT_PERCENTAGE = "Given religion name has insufficient percentage."
 INVALID_PERCENTAGE = "Percentage must be between 0-100."
+SAME_RELIGION = "Percentage can only be moved between two different religions."
 
 SAME_COUNTRY = "City already belongs to the given country."
 MISSING_OCCUPIER_COUNTRY = "Occupying country with given name does not exist."
+DUPLICATE_TRANSFER = "City is already transferred by an earlier row."
+CITY_NAME_TAKEN = "Occupying country already has a city with given name."
 
 NO_NEGATIVE_POPULATION = "Population must be positive"
+INVALID_POPULATION = "Population must be a whole number."
+
+FILE_NOT_FOUND = "Given file can not be opened."
+EXPORT_UNKNOWN_SOURCE = "No table or view with given name can be exported."
+EXPORT_UNKNOWN_FORMAT = "Export format must be csv or binary."
+SUMMARY_INCONSISTENT = "Stored summaries differ from a full recompute."
+METRICS_DISABLED = "Metrics are disabled in the configuration file."
+CACHE_DISABLED = "Caching is disabled in the configuration file."
+
+POOL_DISABLED = "Connection pooling is disabled in the configuration file."
 
 
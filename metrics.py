@@ -0,0 +1,223 @@
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+from config import read_config, read_flag
+
+# values are recorded in whole microseconds. Up to 2 * SUB_BUCKETS they are counted exactly,
+# above that every power of two is split into SUB_BUCKETS buckets, so a bucket is never wider
+# than 1/SUB_BUCKETS (~1.6%) of its values, like an HdrHistogram with two significant digits.
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# statement text that is not one of the named statements is shown by its first characters
+LABEL_LENGTH = 60
+PREPARED_PATTERN = re.compile(r"^(EXECUTE|PREPARE)\s+(\w+)")
+
+
+"""
+    Histogram of microsecond values with buckets of bounded relative width (see SUB_BUCKETS).
+    Recording is a few integer operations, memory grows with the logarithm of the largest value.
+"""
+class Histogram:
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @staticmethod
+    def bucket_index(value):
+        if value < 2 * SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS - 1
+        return shift * SUB_BUCKETS + (value >> shift)
+
+    """
+        Returns the (lowest, highest) value counted in the bucket with the given index.
+    """
+    @staticmethod
+    def bucket_range(index):
+        if index < 2 * SUB_BUCKETS:
+            return index, index
+        shift = index // SUB_BUCKETS - 1
+        sub_bucket = index - shift * SUB_BUCKETS
+        return sub_bucket << shift, ((sub_bucket + 1) << shift) - 1
+
+    def record(self, value):
+        index = self.bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    """
+        Value at or below which the given percent of the recorded values are, as the highest
+        value of its bucket (never above the largest recorded value).
+    """
+    def percentile(self, percent):
+        if self.count == 0:
+            return 0
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.bucket_range(index)[1], self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def buckets(self):
+        return [(self.bucket_range(index)[1], self.counts[index]) for index in sorted(self.counts)]
+
+
+"""
+    Names statements for the metrics and the slow query log: the name for the known statements
+    (EXECUTE and PREPARE of prepared statements included), the start of the text otherwise.
+    Names are cached by text, the statements of the client are a fixed set of strings.
+"""
+class StatementLabels:
+    def __init__(self, statement_names=None):
+        # statement text -> name, for the statements the client knows by name
+        self.labels = {text: name for name, text in (statement_names or {}).items()}
+
+    def label(self, query):
+        label = self.labels.get(query)
+        if label is not None:
+            return label
+
+        text = query if isinstance(query, str) else str(query)
+        prepared = PREPARED_PATTERN.match(text.lstrip())
+        if prepared is not None:
+            keyword, name = prepared.groups()
+            label = name if keyword == "EXECUTE" else name + " (prepare)"
+        else:
+            label = " ".join(text.split())[:LABEL_LENGTH]
+
+        self.labels[query] = label
+        return label
+
+
+"""
+    Latency histograms of one client, in memory.
+    - command: wall time of every command, by command name.
+    - statement: every statement sent through an Mp2Cursor, by statement name (see StatementLabels),
+      with the rows it returned or changed.
+    - connect: opening a connection or borrowing one from the pool.
+    Thread-safe, the quota flush thread records its statements too.
+"""
+class Metrics:
+    def __init__(self, statement_names=None, dump_file=None):
+        self.labels = StatementLabels(statement_names)
+        self.dump_file = dump_file
+        self.started_at = datetime.now()
+
+        self.histograms = {"command": {}, "statement": {}, "connect": {}}
+        self.rows = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind, name, seconds, rows=None):
+        value = int(seconds * 1000000)
+        with self._lock:
+            histogram = self.histograms[kind].get(name)
+            if histogram is None:
+                histogram = self.histograms[kind][name] = Histogram()
+            histogram.record(value)
+            if rows is not None and rows > 0:
+                self.rows[name] = self.rows.get(name, 0) + rows
+
+    def record_command(self, name, seconds):
+        self.record("command", name, seconds)
+
+    def record_statement(self, query, seconds, rows):
+        self.record("statement", self.labels.label(query), seconds, rows)
+
+    def record_connect(self, name, seconds):
+        self.record("connect", name, seconds)
+
+    """
+        Returns (kind, name, count, rows, mean, p50, p90, p99, max) of every histogram, times in
+        milliseconds, commands first and the slowest first within a kind by total time.
+    """
+    def summary(self):
+        lines = []
+        with self._lock:
+            for kind, histograms in self.histograms.items():
+                for name, histogram in sorted(histograms.items(), key=lambda item: -item[1].total):
+                    lines.append((kind, name, histogram.count,
+                                  self.rows.get(name, 0) if kind == "statement" else None,
+                                  histogram.mean() / 1000,
+                                  histogram.percentile(50) / 1000,
+                                  histogram.percentile(90) / 1000,
+                                  histogram.percentile(99) / 1000,
+                                  histogram.max / 1000))
+        return lines
+
+    """
+        Everything recorded as a JSON serializable dict, including the non-empty buckets as
+        [highest value in ms, count] pairs, so histograms of several runs can be merged.
+    """
+    def to_dict(self):
+        result = {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "written_at": datetime.now().isoformat(timespec="seconds"),
+            "unit": "ms",
+            "sub_bucket_bits": SUB_BUCKET_BITS,
+        }
+        with self._lock:
+            for kind, histograms in self.histograms.items():
+                entries = {}
+                for name, histogram in histograms.items():
+                    entry = {
+                        "count": histogram.count,
+                        "total": histogram.total / 1000,
+                        "mean": histogram.mean() / 1000,
+                        "min": (histogram.min or 0) / 1000,
+                        "max": histogram.max / 1000,
+                    }
+                    for percent in PERCENTILES:
+                        entry["p%g" % percent] = histogram.percentile(percent) / 1000
+                    if kind == "statement":
+                        entry["rows"] = self.rows.get(name, 0)
+                    entry["buckets"] = [[value / 1000, count] for value, count in histogram.buckets()]
+                    entries[name] = entry
+                result[kind] = entries
+        return result
+
+    """
+        Writes to_dict to the dump file, if one is configured. The file is replaced at once,
+        a reader never sees half of it.
+    """
+    def dump(self):
+        if not self.dump_file:
+            return
+
+        temporary_file = self.dump_file + ".tmp"
+        with open(temporary_file, "w") as dump_file:
+            json.dump(self.to_dict(), dump_file, indent=2)
+        os.replace(temporary_file, self.dump_file)
+
+
+"""
+    Returns the Metrics arguments given in the optional [metrics] section, or None when metrics
+    are disabled (the default).
+"""
+def read_metrics_config(config_filename):
+    metrics_params = read_config(filename=config_filename, section="metrics", required=False)
+
+    if not read_flag(metrics_params, "enabled"):
+        return None
+
+    return {
+        "dump_file": metrics_params.get("dump_file") or None,
+    }
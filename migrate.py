@@ -0,0 +1,78 @@
+import os
+import sys
+
+import psycopg2
+
+from config import read_config
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+"""
+    Returns (version, path) of every migration file, in the order they must be applied.
+    Versions are the file names without the .sql extension, e.g. 001_case_insensitive_name_indexes.
+"""
+def list_migrations(directory=MIGRATIONS_DIR):
+    migrations = []
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith(".sql"):
+            migrations.append((file_name[:-len(".sql")], os.path.join(directory, file_name)))
+    return migrations
+
+
+"""
+    Applies every migration that is not yet recorded in the schema_migrations table.
+    Each migration runs in its own transaction together with its bookkeeping row.
+    Returns the list of applied versions.
+"""
+def apply_migrations(conn, directory=MIGRATIONS_DIR):
+    query_ex = conn.cursor()
+
+    query_ex.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(100) PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+    conn.commit()
+
+    query_ex.execute("SELECT version FROM schema_migrations")
+    applied = {row[0] for row in query_ex.fetchall()}
+
+    newly_applied = []
+    for version, path in list_migrations(directory):
+        if version in applied:
+            continue
+
+        try:
+            with open(path) as migration_file:
+                query_ex.execute(migration_file.read())
+            query_ex.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+        newly_applied.append(version)
+
+    return newly_applied
+
+
+def main():
+    config_filename = sys.argv[1] if len(sys.argv) > 1 else "database.cfg"
+
+    conn = psycopg2.connect(**read_config(filename=config_filename, section="postgresql"))
+    try:
+        applied = apply_migrations(conn)
+    finally:
+        conn.close()
+
+    if applied:
+        for version in applied:
+            print(f"applied {version}")
+    else:
+        print("schema is up to date")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+-- Name lookups in mp2.py compare lower(name) = lower(%s), which can not use the
+-- plain btree indexes on name. These expression indexes turn them into index scans.
+
+CREATE INDEX IF NOT EXISTS country_lower_name_idx ON Country (lower(Name));
+
+CREATE INDEX IF NOT EXISTS continent_lower_name_idx ON Continent (lower(Name));
+
+-- leading lower(name) so a city lookup without a country is an index scan as well
+CREATE INDEX IF NOT EXISTS city_lower_name_idx ON City (lower(Name), Country);
+
+-- per-country religion lookups (top religion, update_religion); the primary key leads with Name
+CREATE INDEX IF NOT EXISTS religion_country_idx ON Religion (Country, lower(Name));
+
+-- continent country counts; the primary key leads with Country
+CREATE INDEX IF NOT EXISTS encompasses_continent_idx ON encompasses (Continent);
@@ -0,0 +1,21 @@
+-- Guest rows in Users only live as long as a client session, so they do not need to
+-- survive a server crash: an unlogged table skips the WAL write of every quota update.
+ALTER TABLE Users SET UNLOGGED;
+
+-- last activity of the guest, updated with its query count
+ALTER TABLE Users ADD COLUMN IF NOT EXISTS last_seen TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS users_last_seen_idx ON Users (last_seen);
+
+-- removes guest rows left behind by clients that crashed or never quit,
+-- returns the number of removed rows
+CREATE OR REPLACE FUNCTION sweep_guest_users(max_idle INTERVAL DEFAULT INTERVAL '1 day')
+RETURNS INTEGER AS $$
+DECLARE
+    removed INTEGER;
+BEGIN
+    DELETE FROM Users WHERE last_seen < now() - max_idle;
+    GET DIAGNOSTICS removed = ROW_COUNT;
+    RETURN removed;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,158 @@
+-- Server-side versions of the multi-statement admin commands, so each one is a single
+-- round trip and its locks are only held while the function runs.
+-- Every function returns a status, the name of the messages.py constant the client shows
+-- (mp2.STATUS_MESSAGES). A changed behaviour gets a new function version (_v2, ...) so
+-- clients of the old version keep working until they are upgraded.
+
+-- transfer_city finds the new capital and the remaining cities of a country by its code
+CREATE INDEX IF NOT EXISTS city_country_idx ON City (Country, Name);
+
+-- moves percentage points from religion_name2 to religion_name1 of a country,
+-- returns the new percentages of both religions on success
+CREATE OR REPLACE FUNCTION update_religion_v1(
+    country_name TEXT, religion_name1 TEXT, religion_name2 TEXT, amount NUMERIC,
+    OUT status TEXT, OUT new_percentage1 NUMERIC, OUT new_percentage2 NUMERIC
+) AS $$
+DECLARE
+    country_code Country.Code%TYPE;
+    current_percentage1 NUMERIC;
+    current_percentage2 NUMERIC;
+BEGIN
+    SELECT code INTO country_code FROM country WHERE lower(name) = lower(country_name);
+    IF NOT FOUND THEN
+        status := 'NO_ENTITY_FOUND';
+        RETURN;
+    END IF;
+
+    SELECT percentage INTO current_percentage2
+    FROM religion
+    WHERE country = country_code AND lower(name) = lower(religion_name2);
+    IF NOT FOUND THEN
+        status := 'RELIGION_NOT_FOUND';
+        RETURN;
+    END IF;
+
+    IF current_percentage2 < amount THEN
+        status := 'RELIGION_INSUFFICIENT_PERCENTAGE';
+        RETURN;
+    END IF;
+
+    SELECT percentage INTO current_percentage1
+    FROM religion
+    WHERE country = country_code AND lower(name) = lower(religion_name1);
+
+    IF NOT FOUND THEN
+        new_percentage1 := amount;
+        INSERT INTO religion (country, name, percentage) VALUES (country_code, religion_name1, new_percentage1);
+    ELSE
+        new_percentage1 := current_percentage1 + amount;
+        IF new_percentage1 > 100 THEN
+            status := 'INVALID_PERCENTAGE';
+            RETURN;
+        END IF;
+
+        UPDATE religion
+        SET percentage = new_percentage1
+        WHERE country = country_code AND lower(name) = lower(religion_name1);
+    END IF;
+
+    -- a religion left with no percentage is removed
+    new_percentage2 := current_percentage2 - amount;
+    IF new_percentage2 = 0 THEN
+        DELETE FROM religion WHERE country = country_code AND lower(name) = lower(religion_name2);
+    ELSE
+        UPDATE religion
+        SET percentage = new_percentage2
+        WHERE country = country_code AND lower(name) = lower(religion_name2);
+    END IF;
+
+    status := 'CMD_EXECUTION_SUCCESS';
+END;
+$$ LANGUAGE plpgsql;
+
+-- moves a city to another country; a moved capital is replaced by the first remaining city
+-- by name and a country left without cities is removed, its name is returned as removed_country
+CREATE OR REPLACE FUNCTION transfer_city_v1(
+    city_name TEXT, current_country TEXT, new_country TEXT,
+    OUT status TEXT, OUT removed_country TEXT
+) AS $$
+DECLARE
+    current_code Country.Code%TYPE;
+    current_name Country.Name%TYPE;
+    current_capital Country.Capital%TYPE;
+    new_code Country.Code%TYPE;
+BEGIN
+    SELECT code, name, capital INTO current_code, current_name, current_capital
+    FROM country
+    WHERE lower(name) = lower(current_country);
+    IF NOT FOUND THEN
+        status := 'NO_ENTITY_FOUND';
+        RETURN;
+    END IF;
+
+    SELECT code INTO new_code FROM country WHERE lower(name) = lower(new_country);
+    IF NOT FOUND THEN
+        status := 'MISSING_OCCUPIER_COUNTRY';
+        RETURN;
+    END IF;
+
+    UPDATE city SET country = new_code WHERE lower(name) = lower(city_name) AND country = current_code;
+    IF NOT FOUND THEN
+        status := 'NO_ENTITY_FOUND';
+        RETURN;
+    END IF;
+
+    IF lower(current_capital) = lower(city_name) THEN
+        UPDATE country
+        SET capital = (SELECT name FROM city WHERE country = current_code ORDER BY name LIMIT 1)
+        WHERE code = current_code;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM city WHERE country = current_code) THEN
+        DELETE FROM encompasses WHERE country = current_code;
+        DELETE FROM economy WHERE country = current_code;
+        DELETE FROM religion WHERE country = current_code;
+        DELETE FROM spoken WHERE country = current_code;
+        DELETE FROM country WHERE code = current_code;
+        removed_country := current_name;
+    END IF;
+
+    status := 'CMD_EXECUTION_SUCCESS';
+END;
+$$ LANGUAGE plpgsql;
+
+-- sets the population of a country, or of a city given by name (unique) or by name and country
+CREATE OR REPLACE FUNCTION adjust_population_v1(entity_name TEXT, country_name TEXT, new_population NUMERIC)
+RETURNS TEXT AS $$
+DECLARE
+    country_code Country.Code%TYPE;
+    city_count INTEGER;
+BEGIN
+    SELECT code INTO country_code FROM country WHERE lower(name) = lower(entity_name);
+    IF FOUND THEN
+        UPDATE country SET population = new_population WHERE code = country_code;
+        RETURN 'CMD_EXECUTION_SUCCESS';
+    END IF;
+
+    IF country_name IS NULL THEN
+        SELECT COUNT(*) INTO city_count FROM city WHERE lower(name) = lower(entity_name);
+        IF city_count > 1 THEN
+            RETURN 'AMBIGUOUS_CITY';
+        ELSIF city_count = 0 THEN
+            RETURN 'NO_ENTITY_FOUND';
+        END IF;
+
+        UPDATE city SET population = new_population WHERE lower(name) = lower(entity_name);
+    ELSE
+        UPDATE city
+        SET population = new_population
+        WHERE lower(name) = lower(entity_name)
+          AND country IN (SELECT code FROM country WHERE lower(name) = lower(country_name));
+        IF NOT FOUND THEN
+            RETURN 'NO_ENTITY_FOUND';
+        END IF;
+    END IF;
+
+    RETURN 'CMD_EXECUTION_SUCCESS';
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,88 @@
+-- update_religion_v1 reads both percentages without locking them, so two admins moving
+-- percentage points of the same country at once can overwrite each other's result.
+-- v2 locks the rows it changes before reading them; clients call v2 from now on.
+CREATE OR REPLACE FUNCTION update_religion_v2(
+    country_name TEXT, religion_name1 TEXT, religion_name2 TEXT, amount NUMERIC,
+    OUT status TEXT, OUT new_percentage1 NUMERIC, OUT new_percentage2 NUMERIC
+) AS $$
+DECLARE
+    country_code Country.Code%TYPE;
+    locked RECORD;
+    current_percentage1 NUMERIC;
+    current_percentage2 NUMERIC;
+    found1 BOOLEAN := false;
+    found2 BOOLEAN := false;
+BEGIN
+    SELECT code INTO country_code FROM country WHERE lower(name) = lower(country_name);
+    IF NOT FOUND THEN
+        status := 'NO_ENTITY_FOUND';
+        RETURN;
+    END IF;
+
+    -- both rows are locked by one statement in name order, so transfers between the same
+    -- religions in opposite directions wait for each other instead of deadlocking, and
+    -- the percentages are read again after the wait
+    FOR locked IN
+        SELECT name, percentage
+        FROM religion
+        WHERE country = country_code AND lower(name) IN (lower(religion_name1), lower(religion_name2))
+        ORDER BY name
+        FOR UPDATE
+    LOOP
+        IF lower(locked.name) = lower(religion_name1) THEN
+            current_percentage1 := locked.percentage;
+            found1 := true;
+        END IF;
+        IF lower(locked.name) = lower(religion_name2) THEN
+            current_percentage2 := locked.percentage;
+            found2 := true;
+        END IF;
+    END LOOP;
+
+    IF NOT found2 THEN
+        status := 'RELIGION_NOT_FOUND';
+        RETURN;
+    END IF;
+
+    IF current_percentage2 < amount THEN
+        status := 'RELIGION_INSUFFICIENT_PERCENTAGE';
+        RETURN;
+    END IF;
+
+    IF found1 THEN
+        new_percentage1 := current_percentage1 + amount;
+        IF new_percentage1 > 100 THEN
+            status := 'INVALID_PERCENTAGE';
+            RETURN;
+        END IF;
+
+        UPDATE religion
+        SET percentage = new_percentage1
+        WHERE country = country_code AND lower(name) = lower(religion_name1);
+    ELSE
+        -- a concurrent transfer may insert the same religion first, the amount is then added to its row
+        INSERT INTO religion (country, name, percentage) VALUES (country_code, religion_name1, amount)
+        ON CONFLICT (name, country) DO UPDATE
+        SET percentage = religion.percentage + EXCLUDED.percentage
+        WHERE religion.percentage + EXCLUDED.percentage <= 100
+        RETURNING percentage INTO new_percentage1;
+
+        IF NOT FOUND THEN
+            status := 'INVALID_PERCENTAGE';
+            RETURN;
+        END IF;
+    END IF;
+
+    -- a religion left with no percentage is removed
+    new_percentage2 := current_percentage2 - amount;
+    IF new_percentage2 = 0 THEN
+        DELETE FROM religion WHERE country = country_code AND lower(name) = lower(religion_name2);
+    ELSE
+        UPDATE religion
+        SET percentage = new_percentage2
+        WHERE country = country_code AND lower(name) = lower(religion_name2);
+    END IF;
+
+    status := 'CMD_EXECUTION_SUCCESS';
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,210 @@
+-- Continent statistics kept in a table, so get_statistics reads one row by primary key
+-- instead of counting the encompasses rows of the continent on every request.
+-- Members of a continent are the countries more than 50% in it; population and GDP are
+-- the totals of its members.
+CREATE TABLE IF NOT EXISTS continent_summary (
+    continent VARCHAR(20) PRIMARY KEY REFERENCES Continent(Name) ON DELETE CASCADE,
+    country_count INTEGER NOT NULL,
+    population DECIMAL NOT NULL,
+    gdp DECIMAL NOT NULL
+);
+
+-- What every member adds to its continent's totals. A change removes exactly the values
+-- the member added before, even when the country, its economy and its encompasses rows
+-- are deleted by one statement (the cascade delete of transfer_city).
+CREATE TABLE IF NOT EXISTS continent_summary_member (
+    country VARCHAR(4) NOT NULL,
+    continent VARCHAR(20) NOT NULL,
+    population DECIMAL NOT NULL,
+    gdp DECIMAL NOT NULL,
+    PRIMARY KEY (country, continent)
+);
+
+-- the summary computed from scratch, used for the first fill and by check_summaries
+CREATE OR REPLACE VIEW continent_summary_recomputed AS
+SELECT cn.name AS continent,
+       COUNT(en.country)::INTEGER AS country_count,
+       COALESCE(SUM(c.population), 0) AS population,
+       COALESCE(SUM(e.gdp), 0) AS gdp
+FROM continent cn
+LEFT JOIN encompasses en ON en.continent = cn.name AND en.percentage > 50
+LEFT JOIN country c ON c.code = en.country
+LEFT JOIN economy e ON e.country = en.country
+GROUP BY cn.name;
+
+TRUNCATE continent_summary, continent_summary_member;
+
+INSERT INTO continent_summary_member (country, continent, population, gdp)
+SELECT en.country, en.continent, COALESCE(c.population, 0), COALESCE(e.gdp, 0)
+FROM encompasses en
+LEFT JOIN country c ON c.code = en.country
+LEFT JOIN economy e ON e.country = en.country
+WHERE en.percentage > 50;
+
+INSERT INTO continent_summary (continent, country_count, population, gdp)
+SELECT continent, country_count, population, gdp FROM continent_summary_recomputed;
+
+-- The triggers are statement level with transition tables, so a statement changing many
+-- rows (bulk_adjust_population, bulk_transfer_city) updates each summary row once.
+-- Summary rows only get deltas added, concurrent transactions do not overwrite each other.
+-- A trigger with transition tables can only have one event, hence one trigger per event.
+
+-- encompasses rows changed: members are removed and added by key
+CREATE OR REPLACE FUNCTION continent_summary_encompasses_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM continent_summary_member m
+        USING old_rows o
+        WHERE m.country = o.country AND m.continent = o.continent;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO continent_summary_member (country, continent, population, gdp)
+        SELECT n.country, n.continent, COALESCE(c.population, 0), COALESCE(e.gdp, 0)
+        FROM new_rows n
+        LEFT JOIN country c ON c.code = n.country
+        LEFT JOIN economy e ON e.country = n.country
+        WHERE n.percentage > 50;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- population of countries changed: the members of the countries take the new population
+CREATE OR REPLACE FUNCTION continent_summary_country_changed() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE continent_summary_member m
+    SET population = COALESCE(n.population, 0)
+    FROM new_rows n
+    JOIN old_rows o ON o.code = n.code
+    WHERE m.country = n.code AND n.population IS DISTINCT FROM o.population;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- economy rows changed: the members of the countries take the new GDP, 0 without economy
+CREATE OR REPLACE FUNCTION continent_summary_economy_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE continent_summary_member m
+        SET gdp = 0
+        FROM old_rows o
+        WHERE m.country = o.country AND m.gdp <> 0;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE continent_summary_member m
+        SET gdp = COALESCE(n.gdp, 0)
+        FROM new_rows n
+        WHERE m.country = n.country;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- adds the change of members to the continent totals, in continent order so concurrent
+-- statements lock the summary rows in the same order
+CREATE OR REPLACE FUNCTION add_continent_summary_delta(delta continent_summary[]) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO continent_summary AS s (continent, country_count, population, gdp)
+    SELECT continent, SUM(country_count)::INTEGER, SUM(population), SUM(gdp)
+    FROM unnest(delta)
+    GROUP BY continent
+    ORDER BY continent
+    ON CONFLICT (continent) DO UPDATE
+    SET country_count = s.country_count + EXCLUDED.country_count,
+        population = s.population + EXCLUDED.population,
+        gdp = s.gdp + EXCLUDED.gdp;
+END;
+$$ LANGUAGE plpgsql;
+
+-- members changed: their values are added to and removed from the continent totals
+CREATE OR REPLACE FUNCTION continent_summary_member_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM add_continent_summary_delta(ARRAY(
+            SELECT ROW(continent, 1, population, gdp)::continent_summary FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM add_continent_summary_delta(ARRAY(
+            SELECT ROW(continent, -1, -population, -gdp)::continent_summary FROM old_rows));
+    ELSE
+        PERFORM add_continent_summary_delta(ARRAY(
+            SELECT ROW(continent, 1, population, gdp)::continent_summary FROM new_rows
+            UNION ALL
+            SELECT ROW(continent, -1, -population, -gdp)::continent_summary FROM old_rows));
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- new continents get their (empty) row
+CREATE OR REPLACE FUNCTION continent_summary_continent_inserted() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO continent_summary (continent, country_count, population, gdp)
+    SELECT name, 0, 0, 0 FROM new_rows
+    ON CONFLICT (continent) DO NOTHING;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS continent_summary_continent_insert ON continent;
+CREATE TRIGGER continent_summary_continent_insert AFTER INSERT ON continent
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_continent_inserted();
+
+DROP TRIGGER IF EXISTS continent_summary_encompasses_insert ON encompasses;
+CREATE TRIGGER continent_summary_encompasses_insert AFTER INSERT ON encompasses
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_encompasses_changed();
+
+DROP TRIGGER IF EXISTS continent_summary_encompasses_update ON encompasses;
+CREATE TRIGGER continent_summary_encompasses_update AFTER UPDATE ON encompasses
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_encompasses_changed();
+
+DROP TRIGGER IF EXISTS continent_summary_encompasses_delete ON encompasses;
+CREATE TRIGGER continent_summary_encompasses_delete AFTER DELETE ON encompasses
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_encompasses_changed();
+
+-- a country is only a member through its encompasses rows, so inserts and deletes of
+-- countries are covered by the encompasses triggers
+DROP TRIGGER IF EXISTS continent_summary_country_update ON country;
+CREATE TRIGGER continent_summary_country_update AFTER UPDATE ON country
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_country_changed();
+
+DROP TRIGGER IF EXISTS continent_summary_economy_insert ON economy;
+CREATE TRIGGER continent_summary_economy_insert AFTER INSERT ON economy
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_economy_changed();
+
+DROP TRIGGER IF EXISTS continent_summary_economy_update ON economy;
+CREATE TRIGGER continent_summary_economy_update AFTER UPDATE ON economy
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_economy_changed();
+
+DROP TRIGGER IF EXISTS continent_summary_economy_delete ON economy;
+CREATE TRIGGER continent_summary_economy_delete AFTER DELETE ON economy
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_economy_changed();
+
+DROP TRIGGER IF EXISTS continent_summary_member_insert ON continent_summary_member;
+CREATE TRIGGER continent_summary_member_insert AFTER INSERT ON continent_summary_member
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_member_changed();
+
+DROP TRIGGER IF EXISTS continent_summary_member_update ON continent_summary_member;
+CREATE TRIGGER continent_summary_member_update AFTER UPDATE ON continent_summary_member
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_member_changed();
+
+DROP TRIGGER IF EXISTS continent_summary_member_delete ON continent_summary_member;
+CREATE TRIGGER continent_summary_member_delete AFTER DELETE ON continent_summary_member
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION continent_summary_member_changed();
@@ -0,0 +1,161 @@
+-- Country statistics kept in one row per country, so get_statistics finds a country and
+-- everything it shows with one index lookup instead of joining economy and picking the top
+-- rows of spoken and religion on every request. Ties for the top row go to the first name.
+CREATE TABLE IF NOT EXISTS country_summary (
+    country VARCHAR(4) PRIMARY KEY REFERENCES Country(Code) ON DELETE CASCADE,
+    name VARCHAR(50) NOT NULL,
+    population DECIMAL,
+    has_economy BOOLEAN NOT NULL,
+    gdp DECIMAL,
+    language VARCHAR(50),
+    language_percentage DECIMAL,
+    religion VARCHAR(50),
+    religion_percentage DECIMAL
+);
+
+CREATE INDEX IF NOT EXISTS country_summary_lower_name_idx ON country_summary (lower(name));
+
+-- the summary computed from scratch, used to refresh rows and by check_summaries
+CREATE OR REPLACE VIEW country_summary_recomputed AS
+SELECT c.code AS country, c.name, c.population,
+       e.country IS NOT NULL AS has_economy, e.gdp,
+       s.language, s.percentage AS language_percentage,
+       r.name AS religion, r.percentage AS religion_percentage
+FROM country c
+LEFT JOIN economy e ON e.country = c.code
+LEFT JOIN LATERAL (
+    SELECT language, percentage
+    FROM spoken
+    WHERE country = c.code
+    ORDER BY percentage DESC, language
+    LIMIT 1
+) s ON true
+LEFT JOIN LATERAL (
+    SELECT name, percentage
+    FROM religion
+    WHERE country = c.code
+    ORDER BY percentage DESC, name
+    LIMIT 1
+) r ON true;
+
+-- recomputes the rows of the given countries, a country has only a few spoken and religion
+-- rows so this is cheap. Rows of deleted countries are removed by the foreign key.
+CREATE OR REPLACE FUNCTION refresh_country_summary(countries TEXT[]) RETURNS VOID AS $$
+BEGIN
+    -- two transactions changing the religions of one country (update_religion) would each
+    -- write a top religion missing the other's change. The rows are locked first, in code
+    -- order against deadlocks, and the recompute below then reads with a new snapshot,
+    -- after the other transaction committed.
+    PERFORM 1 FROM country_summary WHERE country = ANY (countries) ORDER BY country FOR UPDATE;
+
+    INSERT INTO country_summary (country, name, population, has_economy, gdp,
+                                 language, language_percentage, religion, religion_percentage)
+    SELECT country, name, population, has_economy, gdp,
+           language, language_percentage, religion, religion_percentage
+    FROM country_summary_recomputed
+    WHERE country = ANY (countries)
+    ORDER BY country
+    ON CONFLICT (country) DO UPDATE
+    SET name = EXCLUDED.name,
+        population = EXCLUDED.population,
+        has_economy = EXCLUDED.has_economy,
+        gdp = EXCLUDED.gdp,
+        language = EXCLUDED.language,
+        language_percentage = EXCLUDED.language_percentage,
+        religion = EXCLUDED.religion,
+        religion_percentage = EXCLUDED.religion_percentage;
+END;
+$$ LANGUAGE plpgsql;
+
+TRUNCATE country_summary;
+SELECT refresh_country_summary(ARRAY(SELECT code FROM country));
+
+-- The triggers are statement level with transition tables, so a statement changing many
+-- rows (bulk_adjust_population, bulk_transfer_city) refreshes each country it touches once.
+-- A trigger with transition tables can only have one event, hence one trigger per event.
+
+-- countries inserted or updated (name, population)
+CREATE OR REPLACE FUNCTION country_summary_country_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_country_summary(ARRAY(SELECT code FROM new_rows));
+    ELSE
+        PERFORM refresh_country_summary(ARRAY(
+            SELECT n.code
+            FROM new_rows n
+            JOIN old_rows o ON o.code = n.code
+            WHERE (n.name, n.population) IS DISTINCT FROM (o.name, o.population)));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- economy, spoken or religion rows changed: the countries of the old and the new rows
+CREATE OR REPLACE FUNCTION country_summary_detail_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_country_summary(ARRAY(SELECT DISTINCT country FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_country_summary(ARRAY(SELECT DISTINCT country FROM old_rows));
+    ELSE
+        PERFORM refresh_country_summary(ARRAY(
+            SELECT country FROM old_rows UNION SELECT country FROM new_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS country_summary_country_insert ON country;
+CREATE TRIGGER country_summary_country_insert AFTER INSERT ON country
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_country_changed();
+
+DROP TRIGGER IF EXISTS country_summary_country_update ON country;
+CREATE TRIGGER country_summary_country_update AFTER UPDATE ON country
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_country_changed();
+
+DROP TRIGGER IF EXISTS country_summary_economy_insert ON economy;
+CREATE TRIGGER country_summary_economy_insert AFTER INSERT ON economy
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_detail_changed();
+
+DROP TRIGGER IF EXISTS country_summary_economy_update ON economy;
+CREATE TRIGGER country_summary_economy_update AFTER UPDATE ON economy
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_detail_changed();
+
+DROP TRIGGER IF EXISTS country_summary_economy_delete ON economy;
+CREATE TRIGGER country_summary_economy_delete AFTER DELETE ON economy
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_detail_changed();
+
+DROP TRIGGER IF EXISTS country_summary_spoken_insert ON spoken;
+CREATE TRIGGER country_summary_spoken_insert AFTER INSERT ON spoken
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_detail_changed();
+
+DROP TRIGGER IF EXISTS country_summary_spoken_update ON spoken;
+CREATE TRIGGER country_summary_spoken_update AFTER UPDATE ON spoken
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_detail_changed();
+
+DROP TRIGGER IF EXISTS country_summary_spoken_delete ON spoken;
+CREATE TRIGGER country_summary_spoken_delete AFTER DELETE ON spoken
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_detail_changed();
+
+DROP TRIGGER IF EXISTS country_summary_religion_insert ON religion;
+CREATE TRIGGER country_summary_religion_insert AFTER INSERT ON religion
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_detail_changed();
+
+DROP TRIGGER IF EXISTS country_summary_religion_update ON religion;
+CREATE TRIGGER country_summary_religion_update AFTER UPDATE ON religion
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_detail_changed();
+
+DROP TRIGGER IF EXISTS country_summary_religion_delete ON religion;
+CREATE TRIGGER country_summary_religion_delete AFTER DELETE ON religion
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION country_summary_detail_changed();
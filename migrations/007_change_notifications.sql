@@ -0,0 +1,153 @@
+-- Changes of the tables the clients cache (get_statistics results, country names) are
+-- published on the mp2_changes channel, so every client evicts what another process changed.
+-- Events are delivered when the writing transaction commits. A payload is one JSON object:
+--   {"table": "city", "op": "UPDATE", "names": ["tirana"], "at": 1718000000.123}
+-- names are the lowercased names of the changed cities and countries (the countries of the
+-- changed religion, spoken, economy and encompasses rows), null when too many to list;
+-- at is the time of the change, used by the clients to measure how stale they were.
+CREATE OR REPLACE FUNCTION publish_change(table_name TEXT, op TEXT, names TEXT[]) RETURNS VOID AS $$
+DECLARE
+    payload TEXT;
+BEGIN
+    IF cardinality(names) = 0 THEN
+        RETURN;
+    END IF;
+
+    payload := json_build_object('table', table_name, 'op', op, 'names', names,
+                                 'at', extract(epoch FROM clock_timestamp()))::text;
+    -- a payload must stay below 8000 bytes, bulk statements send "everything changed"
+    IF octet_length(payload) > 7500 THEN
+        payload := json_build_object('table', table_name, 'op', op, 'names', NULL,
+                                     'at', extract(epoch FROM clock_timestamp()))::text;
+    END IF;
+
+    PERFORM pg_notify('mp2_changes', payload);
+END;
+$$ LANGUAGE plpgsql;
+
+-- The triggers are statement level with transition tables, one event per statement and table.
+-- A trigger with transition tables can only have one event, hence one trigger per event.
+
+-- city and country rows: their own names
+CREATE OR REPLACE FUNCTION publish_name_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM publish_change(TG_TABLE_NAME, TG_OP, ARRAY(SELECT DISTINCT lower(name) FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM publish_change(TG_TABLE_NAME, TG_OP, ARRAY(SELECT DISTINCT lower(name) FROM old_rows));
+    ELSE
+        PERFORM publish_change(TG_TABLE_NAME, TG_OP, ARRAY(
+            SELECT lower(name) FROM old_rows UNION SELECT lower(name) FROM new_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- religion, spoken, economy and encompasses rows: the names of their countries. Rows deleted
+-- together with their country are covered by the event of the country.
+CREATE OR REPLACE FUNCTION publish_country_detail_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM publish_change(TG_TABLE_NAME, TG_OP, ARRAY(
+            SELECT lower(c.name) FROM country c WHERE c.code IN (SELECT country FROM new_rows)));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM publish_change(TG_TABLE_NAME, TG_OP, ARRAY(
+            SELECT lower(c.name) FROM country c WHERE c.code IN (SELECT country FROM old_rows)));
+    ELSE
+        PERFORM publish_change(TG_TABLE_NAME, TG_OP, ARRAY(
+            SELECT lower(c.name) FROM country c
+            WHERE c.code IN (SELECT country FROM old_rows UNION SELECT country FROM new_rows)));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS publish_city_insert ON city;
+CREATE TRIGGER publish_city_insert AFTER INSERT ON city
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_name_change();
+
+DROP TRIGGER IF EXISTS publish_city_update ON city;
+CREATE TRIGGER publish_city_update AFTER UPDATE ON city
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_name_change();
+
+DROP TRIGGER IF EXISTS publish_city_delete ON city;
+CREATE TRIGGER publish_city_delete AFTER DELETE ON city
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_name_change();
+
+DROP TRIGGER IF EXISTS publish_country_insert ON country;
+CREATE TRIGGER publish_country_insert AFTER INSERT ON country
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_name_change();
+
+DROP TRIGGER IF EXISTS publish_country_update ON country;
+CREATE TRIGGER publish_country_update AFTER UPDATE ON country
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_name_change();
+
+DROP TRIGGER IF EXISTS publish_country_delete ON country;
+CREATE TRIGGER publish_country_delete AFTER DELETE ON country
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_name_change();
+
+DROP TRIGGER IF EXISTS publish_religion_insert ON religion;
+CREATE TRIGGER publish_religion_insert AFTER INSERT ON religion
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_religion_update ON religion;
+CREATE TRIGGER publish_religion_update AFTER UPDATE ON religion
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_religion_delete ON religion;
+CREATE TRIGGER publish_religion_delete AFTER DELETE ON religion
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_spoken_insert ON spoken;
+CREATE TRIGGER publish_spoken_insert AFTER INSERT ON spoken
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_spoken_update ON spoken;
+CREATE TRIGGER publish_spoken_update AFTER UPDATE ON spoken
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_spoken_delete ON spoken;
+CREATE TRIGGER publish_spoken_delete AFTER DELETE ON spoken
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_economy_insert ON economy;
+CREATE TRIGGER publish_economy_insert AFTER INSERT ON economy
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_economy_update ON economy;
+CREATE TRIGGER publish_economy_update AFTER UPDATE ON economy
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_economy_delete ON economy;
+CREATE TRIGGER publish_economy_delete AFTER DELETE ON economy
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_encompasses_insert ON encompasses;
+CREATE TRIGGER publish_encompasses_insert AFTER INSERT ON encompasses
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_encompasses_update ON encompasses;
+CREATE TRIGGER publish_encompasses_update AFTER UPDATE ON encompasses
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
+
+DROP TRIGGER IF EXISTS publish_encompasses_delete ON encompasses;
+CREATE TRIGGER publish_encompasses_delete AFTER DELETE ON encompasses
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_country_detail_change();
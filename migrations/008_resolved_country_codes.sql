@@ -0,0 +1,250 @@
+-- Versions of the admin command functions taking the country codes the client resolved with
+-- its reference cache (reference_cache.py), so a cached name is not resolved again by the
+-- server. The name-taking versions resolve the names and call them, behaving as before.
+-- A code that no longer exists (the cache of the client is stale) gets the status a name
+-- that no longer exists gets.
+
+-- update_religion_v2 with the code of the country; the country is only looked up when
+-- religion_name2 is not found, to tell an unknown country from an unknown religion
+CREATE OR REPLACE FUNCTION update_religion_v3(
+    country_code TEXT, religion_name1 TEXT, religion_name2 TEXT, amount NUMERIC,
+    OUT status TEXT, OUT new_percentage1 NUMERIC, OUT new_percentage2 NUMERIC
+) AS $$
+DECLARE
+    locked RECORD;
+    current_percentage1 NUMERIC;
+    current_percentage2 NUMERIC;
+    found1 BOOLEAN := false;
+    found2 BOOLEAN := false;
+BEGIN
+    -- both rows are locked by one statement in name order, see update_religion_v2
+    FOR locked IN
+        SELECT name, percentage
+        FROM religion
+        WHERE country = country_code AND lower(name) IN (lower(religion_name1), lower(religion_name2))
+        ORDER BY name
+        FOR UPDATE
+    LOOP
+        IF lower(locked.name) = lower(religion_name1) THEN
+            current_percentage1 := locked.percentage;
+            found1 := true;
+        END IF;
+        IF lower(locked.name) = lower(religion_name2) THEN
+            current_percentage2 := locked.percentage;
+            found2 := true;
+        END IF;
+    END LOOP;
+
+    IF NOT found2 THEN
+        IF NOT EXISTS (SELECT 1 FROM country WHERE code = country_code) THEN
+            status := 'NO_ENTITY_FOUND';
+        ELSE
+            status := 'RELIGION_NOT_FOUND';
+        END IF;
+        RETURN;
+    END IF;
+
+    IF current_percentage2 < amount THEN
+        status := 'RELIGION_INSUFFICIENT_PERCENTAGE';
+        RETURN;
+    END IF;
+
+    IF found1 THEN
+        new_percentage1 := current_percentage1 + amount;
+        IF new_percentage1 > 100 THEN
+            status := 'INVALID_PERCENTAGE';
+            RETURN;
+        END IF;
+
+        UPDATE religion
+        SET percentage = new_percentage1
+        WHERE country = country_code AND lower(name) = lower(religion_name1);
+    ELSE
+        -- a concurrent transfer may insert the same religion first, the amount is then added to its row
+        INSERT INTO religion (country, name, percentage) VALUES (country_code, religion_name1, amount)
+        ON CONFLICT (name, country) DO UPDATE
+        SET percentage = religion.percentage + EXCLUDED.percentage
+        WHERE religion.percentage + EXCLUDED.percentage <= 100
+        RETURNING percentage INTO new_percentage1;
+
+        IF NOT FOUND THEN
+            status := 'INVALID_PERCENTAGE';
+            RETURN;
+        END IF;
+    END IF;
+
+    -- a religion left with no percentage is removed
+    new_percentage2 := current_percentage2 - amount;
+    IF new_percentage2 = 0 THEN
+        DELETE FROM religion WHERE country = country_code AND lower(name) = lower(religion_name2);
+    ELSE
+        UPDATE religion
+        SET percentage = new_percentage2
+        WHERE country = country_code AND lower(name) = lower(religion_name2);
+    END IF;
+
+    status := 'CMD_EXECUTION_SUCCESS';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_religion_v2(
+    country_name TEXT, religion_name1 TEXT, religion_name2 TEXT, amount NUMERIC,
+    OUT status TEXT, OUT new_percentage1 NUMERIC, OUT new_percentage2 NUMERIC
+) AS $$
+DECLARE
+    country_code Country.Code%TYPE;
+BEGIN
+    SELECT code INTO country_code FROM country WHERE lower(name) = lower(country_name);
+    IF NOT FOUND THEN
+        status := 'NO_ENTITY_FOUND';
+        RETURN;
+    END IF;
+
+    SELECT r.status, r.new_percentage1, r.new_percentage2 INTO status, new_percentage1, new_percentage2
+    FROM update_religion_v3(country_code, religion_name1, religion_name2, amount) r;
+END;
+$$ LANGUAGE plpgsql;
+
+-- transfer_city_v1 with the codes of both countries
+CREATE OR REPLACE FUNCTION transfer_city_v2(
+    city_name TEXT, current_code TEXT, new_code TEXT,
+    OUT status TEXT, OUT removed_country TEXT
+) AS $$
+DECLARE
+    current_name Country.Name%TYPE;
+    current_capital Country.Capital%TYPE;
+BEGIN
+    SELECT name, capital INTO current_name, current_capital FROM country WHERE code = current_code;
+    IF NOT FOUND THEN
+        status := 'NO_ENTITY_FOUND';
+        RETURN;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM country WHERE code = new_code) THEN
+        status := 'MISSING_OCCUPIER_COUNTRY';
+        RETURN;
+    END IF;
+
+    UPDATE city SET country = new_code WHERE lower(name) = lower(city_name) AND country = current_code;
+    IF NOT FOUND THEN
+        status := 'NO_ENTITY_FOUND';
+        RETURN;
+    END IF;
+
+    IF lower(current_capital) = lower(city_name) THEN
+        UPDATE country
+        SET capital = (SELECT name FROM city WHERE country = current_code ORDER BY name LIMIT 1)
+        WHERE code = current_code;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM city WHERE country = current_code) THEN
+        DELETE FROM encompasses WHERE country = current_code;
+        DELETE FROM economy WHERE country = current_code;
+        DELETE FROM religion WHERE country = current_code;
+        DELETE FROM spoken WHERE country = current_code;
+        DELETE FROM country WHERE code = current_code;
+        removed_country := current_name;
+    END IF;
+
+    status := 'CMD_EXECUTION_SUCCESS';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transfer_city_v1(
+    city_name TEXT, current_country TEXT, new_country TEXT,
+    OUT status TEXT, OUT removed_country TEXT
+) AS $$
+DECLARE
+    current_code Country.Code%TYPE;
+    new_code Country.Code%TYPE;
+BEGIN
+    SELECT code INTO current_code FROM country WHERE lower(name) = lower(current_country);
+    IF NOT FOUND THEN
+        status := 'NO_ENTITY_FOUND';
+        RETURN;
+    END IF;
+
+    SELECT code INTO new_code FROM country WHERE lower(name) = lower(new_country);
+    IF NOT FOUND THEN
+        status := 'MISSING_OCCUPIER_COUNTRY';
+        RETURN;
+    END IF;
+
+    SELECT r.status, r.removed_country INTO status, removed_country
+    FROM transfer_city_v2(city_name, current_code, new_code) r;
+END;
+$$ LANGUAGE plpgsql;
+
+-- adjust_population_v1 with the names resolved: entity_code is the code of the country named
+-- entity_name, NULL when it names no country; city_country_code is the code of the country of
+-- the city, NULL when the city is given by name only
+CREATE OR REPLACE FUNCTION adjust_population_v2(
+    entity_name TEXT, entity_code TEXT, city_country_code TEXT, new_population NUMERIC
+) RETURNS TEXT AS $$
+DECLARE
+    city_count INTEGER;
+BEGIN
+    IF entity_code IS NOT NULL THEN
+        UPDATE country SET population = new_population WHERE code = entity_code;
+        IF NOT FOUND THEN
+            RETURN 'NO_ENTITY_FOUND';
+        END IF;
+        RETURN 'CMD_EXECUTION_SUCCESS';
+    END IF;
+
+    IF city_country_code IS NULL THEN
+        SELECT COUNT(*) INTO city_count FROM city WHERE lower(name) = lower(entity_name);
+        IF city_count > 1 THEN
+            RETURN 'AMBIGUOUS_CITY';
+        ELSIF city_count = 0 THEN
+            RETURN 'NO_ENTITY_FOUND';
+        END IF;
+
+        UPDATE city SET population = new_population WHERE lower(name) = lower(entity_name);
+    ELSE
+        UPDATE city
+        SET population = new_population
+        WHERE lower(name) = lower(entity_name) AND country = city_country_code;
+        IF NOT FOUND THEN
+            RETURN 'NO_ENTITY_FOUND';
+        END IF;
+    END IF;
+
+    RETURN 'CMD_EXECUTION_SUCCESS';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION adjust_population_v1(entity_name TEXT, country_name TEXT, new_population NUMERIC)
+RETURNS TEXT AS $$
+DECLARE
+    entity_code Country.Code%TYPE;
+    city_country_code Country.Code%TYPE;
+BEGIN
+    SELECT code INTO entity_code FROM country WHERE lower(name) = lower(entity_name);
+
+    IF entity_code IS NULL AND country_name IS NOT NULL THEN
+        SELECT code INTO city_country_code FROM country WHERE lower(name) = lower(country_name);
+        IF NOT FOUND THEN
+            RETURN 'NO_ENTITY_FOUND';
+        END IF;
+    END IF;
+
+    RETURN adjust_population_v2(entity_name, entity_code, city_country_code, new_population);
+END;
+$$ LANGUAGE plpgsql;
+
+-- the clients cache the continent names too, see 007_change_notifications.sql
+DROP TRIGGER IF EXISTS publish_continent_insert ON continent;
+CREATE TRIGGER publish_continent_insert AFTER INSERT ON continent
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_name_change();
+
+DROP TRIGGER IF EXISTS publish_continent_update ON continent;
+CREATE TRIGGER publish_continent_update AFTER UPDATE ON continent
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_name_change();
+
+DROP TRIGGER IF EXISTS publish_continent_delete ON continent;
+CREATE TRIGGER publish_continent_delete AFTER DELETE ON continent
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION publish_name_change();
@@ -0,0 +1,92 @@
+-- update_religion_v3 (and update_religion_v2, which calls it) moved percentage points from
+-- a religion to itself when both names were the same religion: the amount was added to its
+-- row and then subtracted from it, so the country lost the amount. Such a transfer is now
+-- rejected with the SAME_RELIGION status. update_religion_v1 is kept as it was, only the
+-- unlocked stress test of benchmarks/stress_religion.py calls it.
+
+CREATE OR REPLACE FUNCTION update_religion_v3(
+    country_code TEXT, religion_name1 TEXT, religion_name2 TEXT, amount NUMERIC,
+    OUT status TEXT, OUT new_percentage1 NUMERIC, OUT new_percentage2 NUMERIC
+) AS $$
+DECLARE
+    locked RECORD;
+    current_percentage1 NUMERIC;
+    current_percentage2 NUMERIC;
+    found1 BOOLEAN := false;
+    found2 BOOLEAN := false;
+BEGIN
+    -- one row matching both names would lose the amount, see above
+    IF lower(religion_name1) = lower(religion_name2) THEN
+        status := 'SAME_RELIGION';
+        RETURN;
+    END IF;
+
+    -- both rows are locked by one statement in name order, see update_religion_v2
+    FOR locked IN
+        SELECT name, percentage
+        FROM religion
+        WHERE country = country_code AND lower(name) IN (lower(religion_name1), lower(religion_name2))
+        ORDER BY name
+        FOR UPDATE
+    LOOP
+        IF lower(locked.name) = lower(religion_name1) THEN
+            current_percentage1 := locked.percentage;
+            found1 := true;
+        END IF;
+        IF lower(locked.name) = lower(religion_name2) THEN
+            current_percentage2 := locked.percentage;
+            found2 := true;
+        END IF;
+    END LOOP;
+
+    IF NOT found2 THEN
+        IF NOT EXISTS (SELECT 1 FROM country WHERE code = country_code) THEN
+            status := 'NO_ENTITY_FOUND';
+        ELSE
+            status := 'RELIGION_NOT_FOUND';
+        END IF;
+        RETURN;
+    END IF;
+
+    IF current_percentage2 < amount THEN
+        status := 'RELIGION_INSUFFICIENT_PERCENTAGE';
+        RETURN;
+    END IF;
+
+    IF found1 THEN
+        new_percentage1 := current_percentage1 + amount;
+        IF new_percentage1 > 100 THEN
+            status := 'INVALID_PERCENTAGE';
+            RETURN;
+        END IF;
+
+        UPDATE religion
+        SET percentage = new_percentage1
+        WHERE country = country_code AND lower(name) = lower(religion_name1);
+    ELSE
+        -- a concurrent transfer may insert the same religion first, the amount is then added to its row
+        INSERT INTO religion (country, name, percentage) VALUES (country_code, religion_name1, amount)
+        ON CONFLICT (name, country) DO UPDATE
+        SET percentage = religion.percentage + EXCLUDED.percentage
+        WHERE religion.percentage + EXCLUDED.percentage <= 100
+        RETURNING percentage INTO new_percentage1;
+
+        IF NOT FOUND THEN
+            status := 'INVALID_PERCENTAGE';
+            RETURN;
+        END IF;
+    END IF;
+
+    -- a religion left with no percentage is removed
+    new_percentage2 := current_percentage2 - amount;
+    IF new_percentage2 = 0 THEN
+        DELETE FROM religion WHERE country = country_code AND lower(name) = lower(religion_name2);
+    ELSE
+        UPDATE religion
+        SET percentage = new_percentage2
+        WHERE country = country_code AND lower(name) = lower(religion_name2);
+    END IF;
+
+    status := 'CMD_EXECUTION_SUCCESS';
+END;
+$$ LANGUAGE plpgsql;
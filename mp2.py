@@ -1,10 +1,22 @@
+import os
 import psycopg2
+import random
+import re
+import threading
+import time
 import uuid
 from datetime import datetime
 
-from config import read_config
+from change_notifications import ChangeListener, read_change_notifications_config
+from config import read_config, read_flag
 from messages import *
 from admin import Administrator, User
+from metrics import Metrics, read_metrics_config
+from pool import ConnectionPool, Mp2Connection
+from quota import QuotaBuffer, read_quota_config
+from reference_cache import ReferenceCache, read_reference_cache_config
+from statistics_cache import StatisticsCache, read_statistics_cache_config
+from slow_query_log import SlowQueryLog, read_slow_query_config
 
 """
     Splits given command string by spaces and trims each token.
@@ -32,49 +44,878 @@ def tokenize_command(command):
     return merged_tokens
 
 
+"""
+    Formats a value of a listed row with the format spec and the unit appended, N/A when NULL.
+"""
+def format_value(value, spec="", unit=""):
+    if value is None:
+        return "N/A"
+    return format(value, spec) + unit
+
+
+# statements executed by the hot commands, with named parameters.
+# when prepared statements are enabled (they need the pool: [pool] enabled=true and
+# prepared_statements=true) each one is PREPAREd once per pooled connection
+# and EXECUTEd afterwards, so postgres does not parse and plan the same text every time.
+STATEMENTS = {
+    # one round trip: the guest query count increment, continent/country/city
+    # resolution and the whole summary of the matched entity are fetched together.
+    # each lateral only runs when the entity types before it did not match.
+    # query_count is 1, or the buffered count being flushed (see quota.py).
+    "get_statistics": """
+        WITH quota AS (
+            UPDATE users 
+            SET current_query_count = current_query_count + %(query_count)s, last_seen = now() 
+            WHERE user_id = %(user_id)s
+        )
+        SELECT ct.name, ct.country_count,
+               co.name, co.population, co.has_economy, co.gdp,
+               co.language, co.language_percentage, co.religion, co.religion_percentage,
+               ci.city_count, ci.name, ci.population, ci.elevation, ci.country_name
+        FROM (SELECT 1) AS probe
+        LEFT JOIN LATERAL (
+            SELECT cn.name, COALESCE(cs.country_count, 0) AS country_count
+            FROM continent cn
+            LEFT JOIN continent_summary cs ON cs.continent = cn.name
+            WHERE lower(cn.name) = lower(%(name)s)
+            LIMIT 1
+        ) ct ON true
+        LEFT JOIN LATERAL (
+            SELECT cs.name, cs.population, cs.has_economy, cs.gdp,
+                   cs.language, cs.language_percentage, cs.religion, cs.religion_percentage
+            FROM country_summary cs
+            WHERE ct.name IS NULL AND lower(cs.name) = lower(%(name)s)
+            LIMIT 1
+        ) co ON true
+        LEFT JOIN LATERAL (
+            SELECT COUNT(*) OVER () AS city_count,
+                   c.name, c.population, c.elevation, co2.name AS country_name
+            FROM city c
+            LEFT JOIN country co2 ON c.country = co2.code
+            WHERE ct.name IS NULL AND co.name IS NULL
+              AND lower(c.name) = lower(%(name)s)
+              AND (%(country_name)s::text IS NULL OR lower(co2.name) = lower(%(country_name)s))
+            LIMIT 1
+        ) ci ON true
+    """,
+
+    "admin_by_id": "SELECT admin_id, password, level_id FROM administrators WHERE admin_id = %(admin_id)s",
+    "level_by_id": "SELECT * FROM accesslevels WHERE level_id = %(level_id)s",
+    "admin_sessions": """
+        SELECT a.admin_id, a.level_id, a.session_count, l.max_parallel_sessions 
+        FROM administrators a
+        JOIN accesslevels l ON a.level_id = l.level_id
+        WHERE a.admin_id = %(admin_id)s AND a.password = %(password)s
+    """,
+    "admin_increment_sessions": """
+        UPDATE administrators 
+        SET session_count = session_count + 1 
+        WHERE admin_id = %(admin_id)s
+    """,
+    "create_guest": """
+        INSERT INTO users (current_query_count, max_query_limit) 
+        VALUES (0, 10000) 
+        RETURNING user_id, max_query_limit
+    """,
+    "delete_guest": "DELETE FROM users WHERE user_id = %(user_id)s",
+    "flush_quota": """
+        UPDATE users 
+        SET current_query_count = current_query_count + %(query_count)s, last_seen = now() 
+        WHERE user_id = %(user_id)s
+    """,
+
+    # the admin commands run as one call of their function (migrations/003_write_command_functions.sql,
+    # update_religion_v2 in 004_atomic_update_religion.sql locks the rows it changes)
+    "update_religion": """
+        SELECT status, new_percentage1, new_percentage2 
+        FROM update_religion_v2(%(country_name)s, %(religion_name1)s, %(religion_name2)s, %(percentage)s)
+    """,
+    "transfer_city": """
+        SELECT status, removed_country 
+        FROM transfer_city_v1(%(city_name)s, %(current_country)s, %(new_country)s)
+    """,
+    "adjust_population": "SELECT adjust_population_v1(%(name)s, %(country_name)s, %(population)s)",
+
+    # the same with the country codes the client took from its reference cache
+    # (migrations/008_resolved_country_codes.sql), the server does not resolve the names again
+    "update_religion_by_code": """
+        SELECT status, new_percentage1, new_percentage2 
+        FROM update_religion_v3(%(country_code)s, %(religion_name1)s, %(religion_name2)s, %(percentage)s)
+    """,
+    "transfer_city_by_code": """
+        SELECT status, removed_country 
+        FROM transfer_city_v2(%(city_name)s, %(current_code)s, %(new_code)s)
+    """,
+    "adjust_population_by_code": """
+        SELECT adjust_population_v2(%(name)s, %(entity_code)s, %(city_country_code)s, %(population)s)
+    """,
+}
+
+
+"""
+    Rewrites a statement with named %(name)s parameters into the $1, $2, ... form PREPARE expects.
+    Returns the rewritten statement and the parameter names in positional order.
+    A literal %% of the psycopg2 format is sent as %, PREPARE is executed without parameters.
+"""
+def to_positional(statement):
+    param_names = []
+
+    def replace(match):
+        if match.group(1) is None:
+            return "%"
+        if match.group(1) not in param_names:
+            param_names.append(match.group(1))
+        return "$%d" % (param_names.index(match.group(1)) + 1)
+
+    return re.sub(r"%\((\w+)\)s|%%", replace, statement), param_names
+
+
+PREPARED_STATEMENTS = {name: to_positional(statement) for name, statement in STATEMENTS.items()}
+
+
+# statuses returned by the database functions of the admin commands
+STATUS_MESSAGES = {
+    "CMD_EXECUTION_SUCCESS": CMD_EXECUTION_SUCCESS,
+    "NO_ENTITY_FOUND": NO_ENTITY_FOUND,
+    "AMBIGUOUS_CITY": AMBIGUOUS_CITY,
+    "RELIGION_NOT_FOUND": RELIGION_NOT_FOUND,
+    "RELIGION_INSUFFICIENT_PERCENTAGE": RELIGION_INSUFFICIENT_PERCENTAGE,
+    "INVALID_PERCENTAGE": INVALID_PERCENTAGE,
+    "SAME_RELIGION": SAME_RELIGION,
+    "MISSING_OCCUPIER_COUNTRY": MISSING_OCCUPIER_COUNTRY,
+    "NO_NEGATIVE_POPULATION": NO_NEGATIVE_POPULATION,
+    "INVALID_POPULATION": INVALID_POPULATION,
+    "SAME_COUNTRY": SAME_COUNTRY,
+    "DUPLICATE_TRANSFER": DUPLICATE_TRANSFER,
+    "CITY_NAME_TAKEN": CITY_NAME_TAKEN,
+}
+
+# work_mem of the statements of the bulk commands, for their sorts and hash joins
+BULK_WORK_MEM = "64MB"
+
+# bulk_adjust_population: the csv file (name,country_name,population with a header line, an empty
+# country_name for none) is copied into population_import, every row is resolved the way
+# adjust_population resolves its arguments into population_resolved, and the resolved rows
+# are applied together. status is the messages.py constant of a skipped row, or country/city
+# for a row to apply.
+POPULATION_IMPORT_TABLE = """
+    DROP TABLE IF EXISTS pg_temp.population_import, pg_temp.population_resolved;
+    CREATE TEMP TABLE population_import (
+        line_no SERIAL,
+        name TEXT,
+        country_name TEXT,
+        population TEXT
+    ) ON COMMIT DROP
+"""
+POPULATION_IMPORT_COLUMNS = ("name", "country_name", "population")
+# the city lookups only read the cities named in the file, by index for a small file
+POPULATION_IMPORT_RESOLVE = """
+    ANALYZE population_import;
+    CREATE TEMP TABLE population_resolved ON COMMIT DROP AS
+    SELECT i.line_no, i.name, i.country_name, i.population,
+           CASE
+               WHEN i.population IS NULL OR i.population !~ '^[[:space:]]*[+-]?[0-9]+[[:space:]]*$' THEN 'INVALID_POPULATION'
+               WHEN i.population::numeric < 0 THEN 'NO_NEGATIVE_POPULATION'
+               WHEN co.code IS NOT NULL THEN 'country'
+               WHEN i.country_name IS NULL AND cc.city_count > 1 THEN 'AMBIGUOUS_CITY'
+               WHEN i.country_name IS NULL AND cc.city_count = 1 THEN 'city'
+               WHEN i.country_name IS NOT NULL AND nc.code IS NOT NULL THEN 'city'
+               ELSE 'NO_ENTITY_FOUND'
+           END AS status,
+           COALESCE(co.code, CASE WHEN i.country_name IS NULL THEN cc.city_country ELSE nc.code END) AS country_code
+    FROM population_import i
+    LEFT JOIN country co ON lower(co.name) = lower(i.name)
+    LEFT JOIN (
+        SELECT lower(name) AS name_key, COUNT(*) AS city_count, min(country) AS city_country
+        FROM city
+        WHERE lower(name) IN (SELECT lower(name) FROM population_import WHERE country_name IS NULL)
+        GROUP BY lower(name)
+    ) cc ON cc.name_key = lower(i.name)
+    LEFT JOIN (
+        SELECT DISTINCT lower(c.name) AS name_key, lower(co2.name) AS country_key, co2.code
+        FROM city c
+        JOIN country co2 ON c.country = co2.code
+        WHERE lower(c.name) IN (SELECT lower(name) FROM population_import WHERE country_name IS NOT NULL)
+    ) nc ON nc.name_key = lower(i.name) AND nc.country_key = lower(i.country_name)
+"""
+POPULATION_IMPORT_SKIPPED = """
+    SELECT line_no, name, country_name, status 
+    FROM population_resolved 
+    WHERE status NOT IN ('country', 'city') 
+    ORDER BY line_no
+"""
+# a country or city given more than once gets the population of its last row,
+# as if the rows were adjusted one after another
+POPULATION_IMPORT_APPLY = """
+    WITH latest AS (
+        SELECT DISTINCT ON (status, country_code, lower(name)) status, country_code, name, population::numeric AS population
+        FROM population_resolved
+        WHERE status IN ('country', 'city')
+        ORDER BY status, country_code, lower(name), line_no DESC
+    ), countries AS (
+        UPDATE country co
+        SET population = l.population
+        FROM latest l
+        WHERE l.status = 'country' AND co.code = l.country_code
+        RETURNING 1
+    ), cities AS (
+        UPDATE city c
+        SET population = l.population
+        FROM latest l
+        WHERE l.status = 'city' AND c.country = l.country_code AND lower(c.name) = lower(l.name)
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM countries), (SELECT COUNT(*) FROM cities)
+"""
+
+# bulk_transfer_city: the csv file (city_name,current_country,new_country with a header line) is
+# copied into transfer_import and every row is resolved against the database as it is before
+# the batch, the way transfer_city resolves its arguments. A city can be moved by one row only.
+# All moves are applied with one UPDATE; the capital reassignment and the removal of emptied
+# countries then run once per affected country.
+TRANSFER_IMPORT_TABLE = """
+    DROP TABLE IF EXISTS pg_temp.transfer_import, pg_temp.transfer_resolved;
+    CREATE TEMP TABLE transfer_import (
+        line_no SERIAL,
+        city_name TEXT,
+        current_country TEXT,
+        new_country TEXT
+    ) ON COMMIT DROP
+"""
+TRANSFER_IMPORT_COLUMNS = ("city_name", "current_country", "new_country")
+TRANSFER_IMPORT_RESOLVE = """
+    ANALYZE transfer_import;
+    CREATE TEMP TABLE transfer_resolved ON COMMIT DROP AS
+    SELECT r.line_no, r.city_name, r.current_country, r.new_country, r.city, r.current_code, r.new_code,
+           CASE
+               WHEN r.status <> 'transfer' THEN r.status
+               WHEN row_number() OVER (PARTITION BY r.status, r.current_code, r.city ORDER BY r.line_no) > 1
+                   THEN 'DUPLICATE_TRANSFER'
+               WHEN row_number() OVER (PARTITION BY r.status, r.new_code, r.city ORDER BY r.line_no) > 1
+                   THEN 'CITY_NAME_TAKEN'
+               ELSE r.status
+           END AS status
+    FROM (
+        SELECT i.line_no, i.city_name, i.current_country, i.new_country,
+               ci.name AS city, cur.code AS current_code, dst.code AS new_code,
+               CASE
+                   WHEN lower(i.current_country) = lower(i.new_country) THEN 'SAME_COUNTRY'
+                   WHEN cur.code IS NULL THEN 'NO_ENTITY_FOUND'
+                   WHEN dst.code IS NULL THEN 'MISSING_OCCUPIER_COUNTRY'
+                   WHEN ci.name IS NULL THEN 'NO_ENTITY_FOUND'
+                   WHEN taken.name IS NOT NULL THEN 'CITY_NAME_TAKEN'
+                   ELSE 'transfer'
+               END AS status
+        FROM transfer_import i
+        LEFT JOIN country cur ON lower(cur.name) = lower(i.current_country)
+        LEFT JOIN country dst ON lower(dst.name) = lower(i.new_country)
+        LEFT JOIN city ci ON lower(ci.name) = lower(i.city_name) AND ci.country = cur.code
+        LEFT JOIN city taken ON taken.name = ci.name AND taken.country = dst.code
+    ) r
+"""
+TRANSFER_IMPORT_SKIPPED = """
+    SELECT line_no, city_name, current_country, new_country, status 
+    FROM transfer_resolved 
+    WHERE status <> 'transfer' 
+    ORDER BY line_no
+"""
+TRANSFER_IMPORT_MOVE = """
+    WITH moved AS (
+        UPDATE city c
+        SET country = t.new_code
+        FROM transfer_resolved t
+        WHERE t.status = 'transfer' AND c.name = t.city AND c.country = t.current_code
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM moved
+"""
+# after all moves, the capitals transfer_city would have left when called for the rows in file
+# order: when a capital leaves at a line, the country gets the first city by name it has at that
+# line, which may leave at a later line in turn (chain). A country emptied on the way (transfer_city
+# would have removed it) gets the first city by name it is left with.
+TRANSFER_IMPORT_CAPITALS = """
+    WITH RECURSIVE capital_moves AS (
+        SELECT t.current_code AS code, t.line_no
+        FROM transfer_resolved t
+        JOIN country co ON co.code = t.current_code AND lower(co.capital) = lower(t.city)
+        WHERE t.status = 'transfer'
+    ), members AS (
+        -- the cities these countries have during the batch, with the line they arrive at (0 when
+        -- there before) and leave at (NULL when they stay); a city arriving can not leave again
+        SELECT c.country AS code, c.name, COALESCE(a.line_no, 0) AS arrived, NULL::integer AS departed
+        FROM city c
+        LEFT JOIN transfer_resolved a ON a.status = 'transfer' AND a.new_code = c.country AND a.city = c.name
+        WHERE c.country IN (SELECT code FROM capital_moves)
+        UNION ALL
+        SELECT t.current_code, t.city, 0, t.line_no
+        FROM transfer_resolved t
+        WHERE t.status = 'transfer' AND t.current_code IN (SELECT code FROM capital_moves)
+    ), chain AS (
+        SELECT m.code, m.line_no, 1 AS step,
+               (SELECT name FROM members
+                WHERE code = m.code AND arrived < m.line_no AND (departed IS NULL OR departed > m.line_no)
+                ORDER BY name LIMIT 1) AS capital
+        FROM capital_moves m
+        UNION ALL
+        SELECT ch.code, d.departed, ch.step + 1,
+               (SELECT name FROM members
+                WHERE code = ch.code AND arrived < d.departed AND (departed IS NULL OR departed > d.departed)
+                ORDER BY name LIMIT 1)
+        FROM chain ch
+        JOIN members d ON d.code = ch.code AND d.name = ch.capital AND d.departed IS NOT NULL
+    )
+    UPDATE country co
+    SET capital = COALESCE(last.capital, (SELECT name FROM city WHERE country = co.code ORDER BY name LIMIT 1))
+    FROM (SELECT DISTINCT ON (code) code, capital FROM chain ORDER BY code, step DESC) last
+    WHERE co.code = last.code
+"""
+TRANSFER_IMPORT_CLEANUP = """
+    WITH emptied AS (
+        SELECT co.code 
+        FROM country co
+        WHERE co.code IN (SELECT current_code FROM transfer_resolved WHERE status = 'transfer')
+          AND NOT EXISTS (SELECT 1 FROM city WHERE country = co.code)
+    ), encompasses_removed AS (
+        DELETE FROM encompasses WHERE country IN (SELECT code FROM emptied)
+    ), economy_removed AS (
+        DELETE FROM economy WHERE country IN (SELECT code FROM emptied)
+    ), religion_removed AS (
+        DELETE FROM religion WHERE country IN (SELECT code FROM emptied)
+    ), spoken_removed AS (
+        DELETE FROM spoken WHERE country IN (SELECT code FROM emptied)
+    ), countries_removed AS (
+        DELETE FROM country WHERE code IN (SELECT code FROM emptied) RETURNING name
+    )
+    SELECT name FROM countries_removed ORDER BY name
+"""
+
+# check_summaries: every trigger maintained summary table (see migrations) compared to a full
+# recompute, each query returns the rows that differ as (key, stored, recomputed)
+SUMMARY_CHECKS = {
+    "continent_summary": """
+        SELECT COALESCE(s.continent, r.continent),
+               concat_ws('/', s.country_count, s.population, s.gdp),
+               concat_ws('/', r.country_count, r.population, r.gdp)
+        FROM continent_summary s
+        FULL JOIN continent_summary_recomputed r ON r.continent = s.continent
+        WHERE (s.country_count, s.population, s.gdp) IS DISTINCT FROM (r.country_count, r.population, r.gdp)
+        ORDER BY 1
+    """,
+    "country_summary": """
+        SELECT COALESCE(s.country, r.country),
+               concat_ws('/', s.name, s.population, s.has_economy, s.gdp,
+                         s.language, s.language_percentage, s.religion, s.religion_percentage),
+               concat_ws('/', r.name, r.population, r.has_economy, r.gdp,
+                         r.language, r.language_percentage, r.religion, r.religion_percentage)
+        FROM country_summary s
+        FULL JOIN country_summary_recomputed r ON r.country = s.country
+        WHERE (s.name, s.population, s.has_economy, s.gdp,
+               s.language, s.language_percentage, s.religion, s.religion_percentage)
+              IS DISTINCT FROM
+              (r.name, r.population, r.has_economy, r.gdp,
+               r.language, r.language_percentage, r.religion, r.religion_percentage)
+        ORDER BY 1
+    """,
+}
+
+# export: what can be exported, by name, as the source of COPY ... TO STDOUT. The geography
+# tables as they are, and views with country names instead of codes. Views are unordered,
+# sorting would make the server buffer the whole result before the first row is sent.
+EXPORT_SOURCES = {
+    "continent": "continent",
+    "country": "country",
+    "city": "city",
+    "economy": "economy",
+    "religion": "religion",
+    "spoken": "spoken",
+    "encompasses": "encompasses",
+    "cities": """(
+        SELECT c.name, co.name AS country, c.population, c.elevation
+        FROM city c
+        JOIN country co ON co.code = c.country
+    )""",
+    "countries": """(
+        SELECT co.name, co.code, co.capital, co.area, co.population,
+               e.gdp, e.agriculture, e.industry, e.service, e.inflation, e.unemployment
+        FROM country co
+        LEFT JOIN economy e ON e.country = co.code
+    )""",
+}
+EXPORT_FORMATS = {
+    "csv": "FORMAT csv, HEADER true",
+    "binary": "FORMAT binary",
+}
+# exported data is written to the file in blocks of this many bytes
+EXPORT_BUFFER_SIZE = 1048576
+
+# listing commands: the reference table and the query resolving the named country or continent
+# to its key (the first column of its cached row), the header and the query of the listed rows,
+# which is read through a named server-side cursor
+LIST_QUERIES = {
+    "list_cities": (
+        "country",
+        "SELECT code FROM country WHERE lower(name) = lower(%(name)s)",
+        "NAME|POPULATION|ELEVATION",
+        # city_country_idx returns the cities in name order, rows arrive without a sort
+        "SELECT name, population, elevation FROM city WHERE country = %(key)s ORDER BY country, name",
+    ),
+    "list_countries": (
+        "continent",
+        "SELECT name FROM continent WHERE lower(name) = lower(%(name)s)",
+        "NAME|POPULATION|PERCENTAGE",
+        """
+            SELECT co.name, co.population, en.percentage
+            FROM encompasses en
+            JOIN country co ON co.code = en.country
+            WHERE en.continent = %(key)s
+            ORDER BY co.name
+        """,
+    ),
+    "list_religions": (
+        "country",
+        "SELECT code FROM country WHERE lower(name) = lower(%(name)s)",
+        "NAME|PERCENTAGE",
+        "SELECT name, percentage FROM religion WHERE country = %(key)s ORDER BY percentage DESC, name",
+    ),
+}
+# rows fetched from the server-side cursor and printed at a time
+LIST_PAGE_SIZE = 500
+
+# transactions aborted because of a concurrent one (serialization_failure, deadlock_detected)
+# are run again by the write commands, at most MAX_RETRIES times after a random delay
+# of up to RETRY_DELAY seconds that doubles with every attempt
+RETRY_SQLSTATES = ("40001", "40P01")
+MAX_RETRIES = 5
+RETRY_DELAY = 0.01
+
+# names the stats command shows for the statements of the client, others are shown by their text
+STATEMENT_NAMES = dict(
+    STATEMENTS,
+    population_import_table=POPULATION_IMPORT_TABLE,
+    population_import_resolve=POPULATION_IMPORT_RESOLVE,
+    population_import_skipped=POPULATION_IMPORT_SKIPPED,
+    population_import_apply=POPULATION_IMPORT_APPLY,
+    transfer_import_table=TRANSFER_IMPORT_TABLE,
+    transfer_import_resolve=TRANSFER_IMPORT_RESOLVE,
+    transfer_import_skipped=TRANSFER_IMPORT_SKIPPED,
+    transfer_import_move=TRANSFER_IMPORT_MOVE,
+    transfer_import_capitals=TRANSFER_IMPORT_CAPITALS,
+    transfer_import_cleanup=TRANSFER_IMPORT_CLEANUP,
+    **{"check_" + summary: query for summary, query in SUMMARY_CHECKS.items()}
+)
+
+
+"""
+    Connection wrapper used in batch mode, where many commands share one transaction.
+    - The first cursor a command opens starts a savepoint for that command.
+    - commit() and rollback() called by a command only release or roll back its savepoint.
+    - The real transaction is committed with commit_transaction().
+"""
+class BatchConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.in_savepoint = False
+
+    def cursor(self, *args, **kwargs):
+        if not self.in_savepoint:
+            self.conn.cursor().execute("SAVEPOINT batch_command")
+            self.in_savepoint = True
+        return self.conn.cursor(*args, **kwargs)
+
+    def commit(self):
+        if self.in_savepoint:
+            self.conn.cursor().execute("RELEASE SAVEPOINT batch_command")
+            self.in_savepoint = False
+
+    def rollback(self):
+        if self.in_savepoint:
+            self.conn.cursor().execute("ROLLBACK TO SAVEPOINT batch_command; RELEASE SAVEPOINT batch_command")
+            self.in_savepoint = False
+
+    def end_command(self):
+        # work left neither committed nor rolled back is discarded, like returning the connection would
+        self.rollback()
+
+    def commit_transaction(self):
+        self.end_command()
+        self.conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+"""
+    Binary file wrapper counting the bytes written through it, used by export.
+"""
+class CountingWriter:
+    def __init__(self, file):
+        self.file = file
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.file.write(data)
+
+
 class Mp2Client:
     user = None
     def __init__(self, config_filename):
         self.db_conn_params = read_config(filename=config_filename, section="postgresql")
         self.conn = None
-        # TODO: Implement this function(bind guest user)
+        self.batch_conn = None
+
+        # statements sent to the server by this client, see disconnect
+        self.statement_count = 0
+        self.statement_mark = 0
+
+        # transactions run again after a serialization failure or deadlock, see fetch_with_retry
+        self.retry_count = 0
+
+        # pooled connection mode, commands borrow and return connections instead of reconnecting
+        self.pool = None
+        pool_params = read_config(filename=config_filename, section="pool", required=False)
+        if read_flag(pool_params, "enabled"):
+            timeout = pool_params.get("timeout")
+            self.pool = ConnectionPool(
+                self.db_conn_params,
+                minconn=int(pool_params.get("minconn", 1)),
+                maxconn=int(pool_params.get("maxconn", 5)),
+                timeout=float(timeout) if timeout else None
+            )
 
-        # creating guest user in beginning
-        self.connect()
+        # server-side prepared statements for the hot commands, only worth it when connections are reused
+        self.use_prepared = self.pool is not None and \
+            read_flag(pool_params, "prepared_statements", default=True)
+
+        # buffered quota mode, guest queries are counted in memory and written in batches
+        self.quota = None
+        self.quota_stop = None
+        quota_settings = read_quota_config(config_filename)
+        if quota_settings is not None:
+            self.quota = QuotaBuffer(**quota_settings)
+            self.start_quota_timer()
+
+        # latency histograms of commands, statements and connects, shown by the stats command
+        self.metrics = None
+        metrics_settings = read_metrics_config(config_filename)
+        if metrics_settings is not None:
+            self.metrics = Metrics(statement_names=STATEMENT_NAMES, **metrics_settings)
+
+        # statements slower than the configured threshold are logged, some with their plan
+        self.slow_query_log = None
+        slow_query_settings = read_slow_query_config(config_filename)
+        if slow_query_settings is not None:
+            self.slow_query_log = SlowQueryLog(
+                self.db_conn_params,
+                statement_names=STATEMENT_NAMES,
+                prepared_statements={name: (STATEMENTS[name], param_names)
+                                     for name, (_, param_names) in PREPARED_STATEMENTS.items()},
+                **slow_query_settings
+            )
 
-        try:
-            query_ex = self.conn.cursor()
+        # country and continent names and access levels served from memory, see reference_cache.py
+        self.reference_cache = None
+        reference_cache_settings = read_reference_cache_config(config_filename)
+        if reference_cache_settings is not None:
+            self.reference_cache = ReferenceCache(**reference_cache_settings)
 
-            # inserting new guest user into the users table
-            query_ex.execute("INSERT INTO users (current_query_count, max_query_limit) VALUES (0, 10000) RETURNING user_id")
-            
-            user_id = query_ex.fetchone()[0]
-            self.conn.commit()
+        # get_statistics results of frequently asked names, see statistics_cache.py
+        self.statistics_cache = None
+        statistics_cache_settings = read_statistics_cache_config(config_filename)
+        if statistics_cache_settings is not None:
+            self.statistics_cache = StatisticsCache(**statistics_cache_settings)
 
-            # creating user object
-            self.user = User(user_id=str(user_id), current_query_count=0, max_query_limit=10000)
-            
-            #debug 
-            #print(f"guest user created with id: {user_id}")
-            self.disconnect()
+        # changes made by other processes evict cache entries, see change_notifications.py
+        self.change_listener = None
+        if (self.reference_cache is not None or self.statistics_cache is not None) and \
+                read_change_notifications_config(config_filename):
+            self.change_listener = ChangeListener(self.db_conn_params)
+
+        # guest user, its users row is only created by its first quota-counted command,
+        # so starting the client needs no database round trip
+        self.user = User(user_id=None, current_query_count=0, max_query_limit=10000)
 
-        except:
-            self.conn.rollback()
-            self.disconnect()
-        
         
+    """
+        Prepares the next command: names it for the slow query log and evicts the cache
+        entries changed since the last command.
+    """
+    def start_command(self, name):
+        if self.slow_query_log is not None:
+            self.slow_query_log.command = name
+        if self.change_listener is not None:
+            self.apply_changes(self.change_listener.poll())
+
+    """
+        Evicts what the change events of the database made stale, the events of the own
+        writes of the client included.
+    """
+    def apply_changes(self, events):
+        for event in events:
+            if self.reference_cache is not None:
+                for table in ("country", "continent"):
+                    if event.table not in (None, table):
+                        continue
+                    # a new or renamed row is only found by loading the table again
+                    if event.op == "DELETE" and event.names is not None:
+                        self.reference_cache.drop(table, event.names)
+                    else:
+                        self.reference_cache.drop(table)
+
+            if self.statistics_cache is None:
+                continue
+            if event.names is None:
+                self.statistics_cache.clear()
+                continue
+
+            # continents show the count of their countries
+            if event.table == "encompasses" or (event.table == "country" and event.op != "UPDATE"):
+                self.statistics_cache.invalidate_kind("continent")
+            if event.table != "encompasses":
+                self.statistics_cache.invalidate_names(event.names)
+
+    """
+        Returns a cursor of the connection of the running command, connecting first when the
+        command has not. The reference cache loads its tables with it.
+    """
+    def reference_cursor(self):
+        if self.conn is None:
+            self.connect()
+        return self.conn.cursor()
+
     """
         Connects to PostgreSQL database and returns connection object.
+        In pooled mode the connection is borrowed from the pool.
     """
     def connect(self):
-        self.conn = psycopg2.connect(**self.db_conn_params)
-        self.conn.autocommit = False
+        if self.batch_conn is not None:
+            self.conn = self.batch_conn
+            self.statement_mark = self.conn.statement_count
+            return self.conn
+
+        started = time.perf_counter()
+        if self.pool is not None:
+            self.conn = self.pool.getconn()
+        else:
+            self.conn = psycopg2.connect(**self.db_conn_params, connection_factory=Mp2Connection)
+            self.conn.autocommit = False
+
+        if self.metrics is not None:
+            self.metrics.record_connect("pool checkout" if self.pool is not None else "connect",
+                                        time.perf_counter() - started)
+        # before the connection is observed, a new one has neither set
+        if self.slow_query_log is not None:
+            self.slow_query_log.prepare_connection(self.conn)
+        self.conn.metrics = self.metrics
+        self.conn.slow_query_log = self.slow_query_log
+
+        self.statement_mark = self.conn.statement_count
+        return self.conn
 
     """
         Disconnects from PostgreSQL database.
+        In pooled mode the connection is returned to the pool instead of being closed.
     """
     def disconnect(self):
-        self.conn.close()
+        if self.conn is None:
+            return
+
+        self.statement_count += self.conn.statement_count - self.statement_mark
+        self.statement_mark = self.conn.statement_count
+
+        if self.batch_conn is not None:
+            return
+
+        if self.pool is not None:
+            self.pool.putconn(self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
+
+    """
+        Executes one of STATEMENTS on the cursor with a dict of named parameters.
+        With prepared statements enabled, the statement is prepared on first use on each
+        connection and executed by name afterwards. Without the pool they are never used,
+        a connection opened for one command would prepare every statement again.
+    """
+    def execute_statement(self, query_ex, name, params):
+        if not self.use_prepared:
+            query_ex.execute(STATEMENTS[name], params)
+            return
+
+        positional_statement, param_names = PREPARED_STATEMENTS[name]
+        execute = "EXECUTE {} ({})".format(name, ", ".join(["%s"] * len(param_names))) if param_names else "EXECUTE " + name
+        args = [params[param_name] for param_name in param_names]
+
+        conn = query_ex.connection
+        if name not in conn.prepared:
+            # on its own: a rollback does not undo PREPARE, so a failed first execution sent
+            # together with it would leave the statement prepared but not recorded
+            query_ex.execute("PREPARE {} AS {}".format(name, positional_statement))
+            conn.prepared.add(name)
+        query_ex.execute(execute, args)
+
+    """
+        Executes one of STATEMENTS like execute_statement and returns its first row.
+        When the transaction is aborted by a serialization failure or a deadlock, it is rolled back
+        and the statement is executed again, so it must be the only work of the transaction.
+    """
+    def fetch_with_retry(self, name, params):
+        for attempt in range(MAX_RETRIES + 1):
+            query_ex = self.conn.cursor()
+            try:
+                self.execute_statement(query_ex, name, params)
+                return query_ex.fetchone()
+            except psycopg2.Error as error:
+                if error.pgcode not in RETRY_SQLSTATES or attempt == MAX_RETRIES:
+                    raise
+                self.conn.rollback()
+                self.retry_count += 1
+                time.sleep(RETRY_DELAY * 2 ** attempt * random.random())
+
+    """
+        Drops what a committed write made stale from the caches: the get_statistics results of the
+        given names (all of them when names is None) and the removed countries, whose continents
+        show a different country count.
+    """
+    def invalidate_caches(self, names=None, removed_countries=()):
+        if self.reference_cache is not None and removed_countries:
+            self.reference_cache.drop("country", removed_countries)
+
+        if self.statistics_cache is not None:
+            if names is None:
+                self.statistics_cache.clear()
+                return
+            self.statistics_cache.invalidate_names(list(names) + list(removed_countries))
+            if removed_countries:
+                self.statistics_cache.invalidate_kind("continent")
+
+    """
+        Starts the thread flushing buffered guest queries that are older than the flush interval,
+        so counts of an idle client still reach the users table.
+    """
+    def start_quota_timer(self):
+        self.quota_stop = threading.Event()
+        thread = threading.Thread(target=self.quota_timer, name="quota-flush", daemon=True)
+        thread.start()
+
+    def quota_timer(self):
+        while not self.quota_stop.wait(self.quota.flush_interval / 2):
+            # only while no command runs, a command may be creating the guest row in its transaction
+            if self.conn is None and self.quota.due():
+                self.flush_quota()
+
+    """
+        Writes the buffered guest query count on its own connection; a failed flush is retried later.
+    """
+    def flush_quota(self):
+        user = self.user
+        if user is None or user.user_id is None:
+            return
+
+        count = self.quota.take()
+        if count == 0:
+            return
+
+        if self.pool is not None:
+            conn = self.pool.getconn()
+        else:
+            conn = psycopg2.connect(**self.db_conn_params, connection_factory=Mp2Connection)
+        conn.metrics = self.metrics
+        conn.slow_query_log = self.slow_query_log
+
+        try:
+            query_ex = conn.cursor()
+            query_ex.execute(STATEMENTS["flush_quota"], {"query_count": count, "user_id": user.user_id})
+            conn.commit()
+        except:
+            conn.rollback()
+            self.quota.add(count)
+        finally:
+            if self.pool is not None:
+                self.pool.putconn(conn)
+            else:
+                conn.close()
+
+    """
+        Creates the users row of the guest in the current transaction if it has none yet.
+        Returns True when the row was created by this call.
+    """
+    def create_guest_row(self, query_ex):
+        if self.user is None or self.user.user_id is not None:
+            return False
+
+        query_ex.execute(STATEMENTS["create_guest"])
+        user_id, max_query_limit = query_ex.fetchone()
+        self.user.user_id = str(user_id)
+        self.user.max_query_limit = max_query_limit
+        return True
+
+    """
+        Sets work_mem for the rest of the command and returns the value it replaced, which the
+        command sets back when its statements are done. SET LOCAL alone would last until the
+        end of the transaction, in batch mode the end of the batch; a rollback restores it.
+    """
+    def set_work_mem(self, query_ex, work_mem):
+        query_ex.execute("SELECT current_setting('work_mem')")
+        previous = query_ex.fetchone()[0]
+        query_ex.execute("SELECT set_config('work_mem', %s, true)", (work_mem,))
+        return previous
+
+    """
+        Starts batch mode: all following commands share one connection and transaction
+        until end_batch. Each command runs in its own savepoint.
+    """
+    def begin_batch(self):
+        self.connect()
+        self.batch_conn = BatchConnection(self.conn)
+        self.conn = self.batch_conn
+
+    """
+        Finishes the current command of a batch; uncommitted work of the command is rolled back.
+    """
+    def end_command(self):
+        self.batch_conn.end_command()
+
+    """
+        Commits the commands executed in the batch so far.
+    """
+    def commit_batch(self):
+        self.batch_conn.commit_transaction()
+
+    """
+        Commits the remaining commands and leaves batch mode.
+    """
+    def end_batch(self):
+        if self.batch_conn is None:
+            return
+
+        batch_conn = self.batch_conn
+        try:
+            batch_conn.commit_transaction()
+        finally:
+            self.batch_conn = None
+            self.conn = batch_conn.conn
+            self.disconnect()
+
+    """
+        Closes every pooled connection and the change listener, writes the metrics dump and the
+        rest of the slow query log.
+        Called once when the program exits.
+    """
+    def close(self):
+        if self.quota_stop is not None:
+            self.quota_stop.set()
+            self.flush_quota()
+        self.disconnect()
+        if self.pool is not None:
+            self.pool.closeall()
+        if self.metrics is not None:
+            self.metrics.dump()
+        if self.slow_query_log is not None:
+            self.slow_query_log.close()
+        if self.change_listener is not None:
+            self.change_listener.close()
 
     """
         Prints list of available commands of the software.
@@ -92,6 +933,16 @@ class Mp2Client:
         print("> update_religion <country_name> <religion_name1> <religion_name2> <percentage>")
         print("> transfer_city <city_name> <current_country> <new_country>")
         print("> adjust_population <name> [<country_name>] <new_population>")
+        print("> bulk_adjust_population <file.csv>")
+        print("> bulk_transfer_city <file.csv>")
+        print("> export <table|view> <file> [csv|binary]")
+        print("> list_cities <country_name>")
+        print("> list_countries <continent_name>")
+        print("> list_religions <country_name>")
+        print("> check_summaries")
+        print("> pool_stats")
+        print("> stats")
+        print("> cache_stats")
         print("> quit")
 
     
@@ -103,20 +954,21 @@ class Mp2Client:
         - If any exception occurs; rollback, do nothing on the database and return tuple (False, CMD_EXECUTION_FAILED).
     """
 
-    #todo
     def sign_up(self, admin_id, password, level_id):
-        # TODO: Implement this function
-
         self.connect()
 
         try:
             query_ex = self.conn.cursor()
 
             # checking if level exist
-            query_ex.execute("SELECT level_id FROM accesslevels WHERE level_id = %s", (level_id,))
+            if self.reference_cache is not None:
+                level_row = self.reference_cache.get("accesslevels", int(level_id), self.reference_cursor)
+            else:
+                query_ex.execute("SELECT level_id FROM accesslevels WHERE level_id = %s", (level_id,))
+                level_row = query_ex.fetchone()
 
             # if level does not exist, return False
-            if query_ex.fetchone() is None:
+            if level_row is None:
                 self.disconnect()
                 return False, CMD_EXECUTION_FAILED
             
@@ -157,8 +1009,6 @@ class Mp2Client:
     """
 
     def sign_in(self, admin_id, password):
-        # TODO: Implement this function
-
         self.connect()
 
         try:
@@ -166,7 +1016,7 @@ class Mp2Client:
             
 
             # if admin_id exists
-            query_ex.execute("SELECT admin_id, password, level_id FROM administrators WHERE admin_id = %s", (admin_id,))
+            self.execute_statement(query_ex, "admin_by_id", {"admin_id": admin_id})
             
             admin_row = query_ex.fetchone()
             
@@ -181,22 +1031,18 @@ class Mp2Client:
                 return None, USER_SIGNIN_FAILED
             
             # if level exists
-            query_ex.execute("SELECT * FROM accesslevels WHERE level_id = %s", (admin_row[2],))
-
-            level_row = query_ex.fetchone()
+            if self.reference_cache is not None:
+                level_row = self.reference_cache.get("accesslevels", admin_row[2], self.reference_cursor)
+            else:
+                self.execute_statement(query_ex, "level_by_id", {"level_id": admin_row[2]})
+                level_row = query_ex.fetchone()
             
             if level_row is None:
                 self.disconnect()
                 return None, USER_SIGNIN_FAILED
             
             # select admin data, session count and max parallel sessions
-            query = """
-                SELECT a.admin_id, a.level_id, a.session_count, l.max_parallel_sessions 
-                FROM administrators a
-                JOIN accesslevels l ON a.level_id = l.level_id
-                WHERE a.admin_id = %s AND a.password = %s
-            """
-            query_ex.execute(query, (admin_id, password))
+            self.execute_statement(query_ex, "admin_sessions", {"admin_id": admin_id, "password": password})
             admin_data = query_ex.fetchone()
             
             # if no admin data found, return none
@@ -213,17 +1059,17 @@ class Mp2Client:
                 return None, USER_ALL_SESSIONS_ARE_USED
             
             # increment session count atomically
-            query_ex.execute("""
-                UPDATE administrators 
-                SET session_count = session_count + 1 
-                WHERE admin_id = %s
-            """, (admin_id,))
+            self.execute_statement(query_ex, "admin_increment_sessions", {"admin_id": admin_id})
             
-            # removing guest user if exists
+            # removing guest user if exists (it has a row once it made a query)
             if self.user is not None:
-                user_id = self.user.user_id
-                query_ex.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+                if self.user.user_id is not None:
+                    self.execute_statement(query_ex, "delete_guest", {"user_id": self.user.user_id})
                 self.user = None
+
+                # buffered queries of the deleted guest row are not written anymore
+                if self.quota is not None:
+                    self.quota.discard()
     
             # create Administrator object
             admin = Administrator(admin_id, level_id)
@@ -251,8 +1097,6 @@ class Mp2Client:
         - Do not forget to recreate a guest user.
     """
     def sign_out(self, admin):
-        # TODO: Implement this function
-
         self.connect()
 
         try:
@@ -271,12 +1115,8 @@ class Mp2Client:
                 WHERE admin_id = %s
             """, (admin.admin_id,))
             
-            # create new guest user
-            query_ex.execute("INSERT INTO users (current_query_count, max_query_limit) VALUES (0, 10000) RETURNING user_id")
-            user_id = query_ex.fetchone()[0]
-            
-            # create User object
-            self.user = User(user_id=str(user_id), current_query_count=0, max_query_limit=10000)
+            # new guest user, its row is created by its first query
+            self.user = User(user_id=None, current_query_count=0, max_query_limit=10000)
             
             self.conn.commit()
             self.disconnect()
@@ -298,7 +1138,10 @@ class Mp2Client:
     """
 
     def quit(self, admin):
-        # TODO: Implement this function
+        # a guest that never queried has no row to remove
+        if admin is None and (self.user is None or self.user.user_id is None):
+            self.user = None
+            return True, CMD_EXECUTION_SUCCESS
 
         self.connect()
 
@@ -314,10 +1157,14 @@ class Mp2Client:
                     WHERE admin_id = %s
                 """, (admin.admin_id,))
             
-            # remove guest user if exists
+            # remove guest user if exists, buffered queries are dropped with its row
             if self.user is not None:
-                query_ex.execute("DELETE FROM users WHERE user_id = %s", (self.user.user_id,))
+                if self.user.user_id is not None:
+                    query_ex.execute("DELETE FROM users WHERE user_id = %s", (self.user.user_id,))
                 self.user = None
+
+                if self.quota is not None:
+                    self.quota.discard()
                 
             self.conn.commit()
             self.disconnect()
@@ -345,17 +1192,16 @@ class Mp2Client:
 
     # pdf and the commented output style is different, i use the pdf style output as stated in forum
     def show_levels(self):
-        # TODO: Implement this function
-
-        self.connect()
-
         try:
 
-            query_ex = self.conn.cursor()
-
-            # show all access levels
-            query_ex.execute("SELECT * FROM accesslevels")
-            levels = query_ex.fetchall()
+            # show all access levels, a cached list needs no connection
+            if self.reference_cache is not None:
+                levels = list(self.reference_cache.rows("accesslevels", self.reference_cursor).values())
+            else:
+                self.connect()
+                query_ex = self.conn.cursor()
+                query_ex.execute("SELECT * FROM accesslevels")
+                levels = query_ex.fetchall()
             
             print("ID|Level Name|Max Sessions")
             for level in levels:
@@ -383,8 +1229,6 @@ class Mp2Client:
     """
 
     def show_my_level(self, admin):
-        # TODO: Implement this function
-
         # if an admin is not signed in, return False
         if admin is None:
             return False, USER_NOT_AUTHORIZED
@@ -434,8 +1278,6 @@ class Mp2Client:
     """
 
     def change_level(self, admin, new_level_id):
-        # TODO: Implement this function
-
         # if an admin is not signed in, return None
         if admin is None:
             return None, USER_NOT_AUTHORIZED
@@ -447,8 +1289,13 @@ class Mp2Client:
             query_ex = self.conn.cursor()
             
             # check if new_level_id exists
-            query_ex.execute("SELECT level_id, max_parallel_sessions FROM accesslevels WHERE level_id = %s", (new_level_id,))
-            new_level = query_ex.fetchone()
+            if self.reference_cache is not None:
+                new_level = self.reference_cache.get("accesslevels", int(new_level_id), self.reference_cursor)
+                if new_level is not None:
+                    new_level = (new_level[0], new_level[2])
+            else:
+                query_ex.execute("SELECT level_id, max_parallel_sessions FROM accesslevels WHERE level_id = %s", (new_level_id,))
+                new_level = query_ex.fetchone()
             
             # if new_level_id does not exist, return None
             if new_level is None:
@@ -520,7 +1367,17 @@ class Mp2Client:
     """
 
     def get_statistics(self, name, country_name=None):
-        # TODO: Implement this function
+        # frequent names are answered from the result cache, still counted for the guest
+        cache_key = None
+        if self.statistics_cache is not None:
+            cache_key = StatisticsCache.key(name, country_name)
+            cached = self.statistics_cache.get(cache_key)
+            if cached is not None:
+                return self.cached_statistics(*cached)
+
+        query_count = 1
+        counted = False
+        created_guest = False
 
         self.connect()
 
@@ -529,164 +1386,148 @@ class Mp2Client:
             
             # guest user session active
             # admin is not signed in, so user is None
+            guest_user_id = None
             if self.user is not None:
 
-                # check query limit
-                if self.user.current_query_count > 10000:
-                    print("10000 query limit reached.")
+                # check query limit, the count kept here includes the buffered queries
+                if self.user.current_query_count >= self.user.max_query_limit:
+                    print(f"{self.user.max_query_limit} query limit reached.")
                     self.conn.commit()
                     self.disconnect()
                     return False, CMD_EXECUTION_FAILED
                 
-                # increment user query count
-                query_ex.execute("""
-                    UPDATE users 
-                    SET current_query_count = current_query_count + 1 
-                    WHERE user_id = %s
-                """, (self.user.user_id,))
+                created_guest = self.create_guest_row(query_ex)
+                guest_user_id = self.user.user_id
+
+                # buffered mode writes the count only when a flush is due
+                if self.quota is not None:
+                    query_count = self.quota.take_due()
+                    if query_count == 0:
+                        guest_user_id = None
+
+            # one round trip: the guest query count increment, continent/country/city
+            # resolution and the whole summary of the matched entity are fetched together.
+            # each lateral only runs when the entity types before it did not match.
+            self.execute_statement(query_ex, "get_statistics",
+                                   {"user_id": guest_user_id, "query_count": query_count, "name": name, "country_name": country_name})
+
+            (continent_name, continent_country_count,
+             country_name_found, population, has_economy, gdp,
+             top_language, top_language_percentage, top_religion, top_religion_percentage,
+             city_count, city_name, city_population, city_elevation, city_country_name) = query_ex.fetchone()
+
+            if self.user is not None:
                 self.user.current_query_count += 1
+                counted = True
+                if self.quota is not None and query_count == 0:
+                    self.quota.add()
             
-            # checking if name is a continent
-            query_ex.execute("SELECT name, area FROM continent WHERE name ILIKE %s", (name,))
-            continent_result = query_ex.fetchone()
-            
-            if continent_result:
-                # Displays: Name, Country Count (≤50% encompassed)
-                query_ex.execute("""
-                    SELECT COUNT(*) 
-                    FROM encompasses 
-                    WHERE continent ILIKE %s AND percentage > 50
-                """, (name,))
-                country_count = query_ex.fetchone()[0]
-                
-                print("TYPE|NAME|COUNTRIES")
-                print(f"Continent|{continent_result[0]}|{country_count}")
-                
-                self.conn.commit()
-                self.disconnect()
-                return True, CMD_EXECUTION_SUCCESS
-            
+            # the matched entity kind and the printed lines, kept by the result cache
+            kind, lines = None, []
+            success, message = False, NO_ENTITY_FOUND
 
+            if continent_name is not None:
+                # Displays: Name, Country Count (≤50% encompassed)
+                kind = "continent"
+                lines = ["TYPE|NAME|COUNTRIES",
+                         f"Continent|{continent_name}|{continent_country_count}"]
+                success, message = True, CMD_EXECUTION_SUCCESS
 
-            # checking if the name is a country
-            query_ex.execute("SELECT name, population FROM country WHERE name ILIKE %s", (name,))
-            country_result = query_ex.fetchone()
-            
-            if country_result:
-                country_name_found = country_result[0]
-                population = country_result[1]
-
+            elif country_name_found is not None:
                 # Displays: Name, Population, GDP, Top Language, Top Religion
-                
-                # gdp
-                query_ex.execute("""
-                    SELECT gdp
-                    FROM economy 
-                    WHERE country = (SELECT code FROM country WHERE name ILIKE %s)
-                """, (name,))
-                economy_data = query_ex.fetchone()
-                
-                gdp = economy_data[0] if economy_data else "N/A"
-                
-
-                # top language
-                query_ex.execute("""
-                    SELECT language, percentage 
-                    FROM spoken 
-                    WHERE country = (SELECT code FROM country WHERE name ILIKE %s)
-                    ORDER BY percentage DESC 
-                    LIMIT 1
-                """, (name,))
-                top_language = query_ex.fetchone()
-                top_lang_str = f"{top_language[0]} ({top_language[1]}%)" if top_language else "N/A"
-                
+                if not has_economy:
+                    gdp = "N/A"
+                top_lang_str = f"{top_language} ({top_language_percentage}%)" if top_language is not None else "N/A"
+                top_rel_str = f"{top_religion} ({top_religion_percentage}%)" if top_religion is not None else "N/A"
 
-                # top religion
-                query_ex.execute("""
-                    SELECT name, percentage 
-                    FROM religion 
-                    WHERE country = (SELECT code FROM country WHERE name ILIKE %s)
-                    ORDER BY percentage DESC 
-                    LIMIT 1
-                """, (name,))
-                top_religion = query_ex.fetchone()
-                top_rel_str = f"{top_religion[0]} ({top_religion[1]}%)" if top_religion else "N/A"
-                
-                print("TYPE|NAME|POPULATION|GDP|TOP_LANGUAGE|TOP_RELIGION")
-                print(f"Country|{country_name_found}|{population:,}|${gdp}|{top_lang_str}|{top_rel_str}")
-                
-                self.conn.commit()
-                self.disconnect()
-                return True, CMD_EXECUTION_SUCCESS
-            
+                kind = "country"
+                lines = ["TYPE|NAME|POPULATION|GDP|TOP_LANGUAGE|TOP_RELIGION",
+                         f"Country|{country_name_found}|{population:,}|${gdp}|{top_lang_str}|{top_rel_str}"]
+                success, message = True, CMD_EXECUTION_SUCCESS
 
             # checking if name is a city
-            if country_name is None:
+            elif country_name is None:
 
                 #Displays: Name, Population, Elevation
 
                 # check city without country
-                query_ex.execute("SELECT COUNT(*) FROM city WHERE name ILIKE %s", (name,))
-                city_count = query_ex.fetchone()[0]
-                
-                if city_count > 1:
-                    self.conn.commit()
-                    self.disconnect()
-                    return False, AMBIGUOUS_CITY
-                elif city_count == 0:
-                    self.conn.commit()
-                    self.disconnect()
-                    return False, NO_ENTITY_FOUND
-                
+                if city_count is not None and city_count > 1:
+                    message = AMBIGUOUS_CITY
+
                 # unique city found
-                query_ex.execute("""
-                    SELECT c.name, c.population, c.elevation, co.name as country_name
-                    FROM city c
-                    JOIN country co ON c.country = co.code
-                    WHERE c.name ILIKE %s
-                """, (name,))
-                city_result = query_ex.fetchone()
-                
-                if city_result:
-                    print("TYPE|NAME|POPULATION|ELEVATION")
-                    print(f"City|{city_result[0]}|{city_result[1]:,}|{city_result[2]}m")
-                    
-                    self.conn.commit()
-                    self.disconnect()
-                    return True, CMD_EXECUTION_SUCCESS
-                
-            else:
-                # check city with country
-                query_ex.execute("""
-                    SELECT c.name, c.population, c.elevation, co.name as country_name
-                    FROM city c
-                    JOIN country co ON c.country = co.code
-                    WHERE c.name ILIKE %s AND co.name ILIKE %s
-                """, (name, country_name))
-                city_result = query_ex.fetchone()
-                
-                if city_result:
-                    print("TYPE|NAME|COUNTRY|POPULATION|ELEVATION")
-                    print(f"City|{city_result[0]}|{city_result[3]}|{city_result[1]:,}|{city_result[2]}m")
-                    
-                    self.conn.commit()
-                    self.disconnect()
-                    return True, CMD_EXECUTION_SUCCESS
-                else:
-                    self.conn.commit()
-                    self.disconnect()
-                    return False, NO_ENTITY_FOUND
-            
-            # if no entity found
+                elif city_count == 1 and city_country_name is not None:
+                    kind = "city"
+                    lines = ["TYPE|NAME|POPULATION|ELEVATION",
+                             f"City|{city_name}|{city_population:,}|{city_elevation}m"]
+                    success, message = True, CMD_EXECUTION_SUCCESS
+
+            # check city with country
+            elif city_name is not None:
+                kind = "city"
+                lines = ["TYPE|NAME|COUNTRY|POPULATION|ELEVATION",
+                         f"City|{city_name}|{city_country_name}|{city_population:,}|{city_elevation}m"]
+                success, message = True, CMD_EXECUTION_SUCCESS
+
             self.conn.commit()
             self.disconnect()
-            return False, NO_ENTITY_FOUND
-            
+
         except:
             self.conn.rollback()
             self.disconnect()
+
+            # the guest row and the flushed count were rolled back
+            if created_guest:
+                self.user.user_id = None
+            if self.quota is not None and query_count > 0:
+                self.quota.add(query_count - 1 + counted)
             return False, CMD_EXECUTION_FAILED
 
+        if cache_key is not None:
+            self.statistics_cache.put(cache_key, kind, lines, success, message)
+
+        for line in lines:
+            print(line)
+        return success, message
+
+
+
+    """
+        Prints a get_statistics result taken from the result cache. The guest query is counted
+        like an executed one: in memory in buffered quota mode once the guest has a users row,
+        with the quota statement otherwise.
+    """
+    def cached_statistics(self, lines, success, message):
+        if self.user is not None:
+            if self.user.current_query_count >= self.user.max_query_limit:
+                print(f"{self.user.max_query_limit} query limit reached.")
+                return False, CMD_EXECUTION_FAILED
+
+            if self.quota is not None and self.user.user_id is not None:
+                self.quota.add()
+                # a batch may hold the guest row uncommitted, the timer flushes after it
+                if self.batch_conn is None and self.quota.due():
+                    self.flush_quota()
+            else:
+                created_guest = False
+                self.connect()
+                try:
+                    query_ex = self.conn.cursor()
+                    created_guest = self.create_guest_row(query_ex)
+                    self.execute_statement(query_ex, "flush_quota", {"query_count": 1, "user_id": self.user.user_id})
+                    self.conn.commit()
+                    self.disconnect()
+                except:
+                    self.conn.rollback()
+                    self.disconnect()
+                    if created_guest:
+                        self.user.user_id = None
+                    return False, CMD_EXECUTION_FAILED
+
+            self.user.current_query_count += 1
+
+        for line in lines:
+            print(line)
+        return success, message
 
 
     """
@@ -697,111 +1538,57 @@ class Mp2Client:
         - If the religion_name2 is not found, return tuple (False, RELIGION_NOT_FOUND).
         - If the religion_name2 has insufficient percentage, return tuple (False, RELIGION_INSUFFICIENT_PERCENTAGE).
         - If the percentages would be out of 0-100, return tuple (False, INVALID_PERCENTAGE).
+        - If religion_name1 and religion_name2 are the same religion, return tuple (False, SAME_RELIGION).
         - If the admin is not signed in, return tuple (False, USER_NOT_AUTHORIZED).
     """
 
     def update_religion(self, admin, country_name, religion_name1, religion_name2, percentage):
-        # TODO: Implement this function
-        
-
         # check if admin is signed in
         if admin is None:
             return False, USER_NOT_AUTHORIZED
+
+        # moving points from a religion to itself would take them away without adding them back
+        if religion_name1.lower() == religion_name2.lower():
+            return False, SAME_RELIGION
         
         self.connect()
         
         try:
-            query_ex = self.conn.cursor()
-            
             # validate percentage is between 0-100
             percentage = float(percentage)
             if percentage < 0 or percentage > 100:
                 self.disconnect()
                 return False, INVALID_PERCENTAGE
-            
-            # check if country exists and get country code
-            query_ex.execute("SELECT code FROM country WHERE name ILIKE %s", (country_name,))
-            country_result = query_ex.fetchone()
-            
-            # if country does not exist, return False
-            if country_result is None:
-                self.disconnect()
-                return False, NO_ENTITY_FOUND
-            
-            country_code = country_result[0]
-            
-            # check if religion_name2 exists for this country
-            query_ex.execute("""
-                SELECT name, percentage 
-                FROM religion 
-                WHERE country = %s AND name ILIKE %s
-            """, (country_code, religion_name2))
-            religion2_result = query_ex.fetchone()
-            
-            # if religion2 does not exist, return False
-            if religion2_result is None:
-                self.disconnect()
-                return False, RELIGION_NOT_FOUND
-            
-            current_religion2_percentage = float(religion2_result[1])
-            
-            # check if religion2 has sufficient percentage
-            if current_religion2_percentage < percentage:
-                self.disconnect()
-                return False, RELIGION_INSUFFICIENT_PERCENTAGE
-            
-            # check if religion_name1 exists for this country
-            query_ex.execute("""
-                SELECT name, percentage 
-                FROM religion 
-                WHERE country = %s AND name ILIKE %s
-            """, (country_code, religion_name1))
-            religion1_result = query_ex.fetchone()
-            
-            # calculate new percentages
-            new_religion2_percentage = current_religion2_percentage - percentage
-            
-            if religion1_result is None:
-                # religion1 does not exist, create new entry
-                new_religion1_percentage = percentage
-                
-                query_ex.execute("""
-                    INSERT INTO religion (country, name, percentage) 
-                    VALUES (%s, %s, %s)
-                """, (country_code, religion_name1, new_religion1_percentage))
 
-            else:
-                # religion1 exists, update percentage
-                current_religion1_percentage = float(religion1_result[1])
-                new_religion1_percentage = current_religion1_percentage + percentage
-                
-                # validate new percentage is not over 100
-                if new_religion1_percentage > 100:
+            params = {
+                "country_name": country_name,
+                "religion_name1": religion_name1,
+                "religion_name2": religion_name2,
+                "percentage": percentage
+            }
+            statement = "update_religion"
+
+            # the country is resolved from the cache, an unknown one is rejected without a round trip
+            if self.reference_cache is not None:
+                country_row = self.reference_cache.get("country", country_name, self.reference_cursor)
+                if country_row is None:
                     self.disconnect()
-                    return False, INVALID_PERCENTAGE
-                
-                query_ex.execute("""
-                    UPDATE religion 
-                    SET percentage = %s 
-                    WHERE country = %s AND name ILIKE %s
-                """, (new_religion1_percentage, country_code, religion_name1))
-            
-            # update or remove religion2
-            if new_religion2_percentage == 0:
-                # remove religion2 if percentage becomes 0
-                query_ex.execute("""
-                    DELETE FROM religion 
-                    WHERE country = %s AND name ILIKE %s
-                """, (country_code, religion_name2))
+                    return False, NO_ENTITY_FOUND
+                params["country_code"] = country_row[0]
+                statement = "update_religion_by_code"
+
+            # one call: lookups, the arithmetic and the writes all run in update_religion_v2
+            # (v3 by code), which locks both religion rows first
+            status, new_religion1_percentage, new_religion2_percentage = self.fetch_with_retry(statement, params)
+
+            if status != "CMD_EXECUTION_SUCCESS":
+                self.conn.rollback()
+                self.disconnect()
+                return False, STATUS_MESSAGES[status]
+
+            new_religion1_percentage = float(new_religion1_percentage)
+            new_religion2_percentage = float(new_religion2_percentage)
 
-            else:
-                # update religion2 percentage
-                query_ex.execute("""
-                    UPDATE religion 
-                    SET percentage = %s 
-                    WHERE country = %s AND name ILIKE %s
-                """, (new_religion2_percentage, country_code, religion_name2))
-            
             # print success message
             print("RELIGION|PERCENTAGE")
             print(f"{religion_name1}|{new_religion1_percentage}% (+{percentage})")
@@ -814,6 +1601,7 @@ class Mp2Client:
             
             self.conn.commit()
             self.disconnect()
+            self.invalidate_caches([country_name])
             return True, CMD_EXECUTION_SUCCESS
             
         except:
@@ -833,9 +1621,6 @@ class Mp2Client:
     """
 
     def transfer_city(self, admin, city_name, current_country, new_country):  
-        # TODO: Implement this function
-        
-        
         # check if admin is signed in
         if admin is None:
             return False, USER_NOT_AUTHORIZED
@@ -847,82 +1632,37 @@ class Mp2Client:
         self.connect()
         
         try:
-            query_ex = self.conn.cursor()
-            
-            # get current country code
-            query_ex.execute("SELECT code, name FROM country WHERE name ILIKE %s", (current_country,))
-            current_result = query_ex.fetchone()
+            params = {"city_name": city_name, "current_country": current_country, "new_country": new_country}
+            statement = "transfer_city"
 
-            # if current country does not exist, return False
-            if current_result is None:
-                self.disconnect()
-                return False, NO_ENTITY_FOUND
-            
-            current_code, current_name = current_result
-            
-            # get new country code  
-            query_ex.execute("SELECT code FROM country WHERE name ILIKE %s", (new_country,))
-            new_result = query_ex.fetchone()
+            # both countries are resolved from the cache, unknown ones are rejected without a round trip
+            if self.reference_cache is not None:
+                current_row = self.reference_cache.get("country", current_country, self.reference_cursor)
+                if current_row is None:
+                    self.disconnect()
+                    return False, NO_ENTITY_FOUND
+                new_row = self.reference_cache.get("country", new_country, self.reference_cursor)
+                if new_row is None:
+                    self.disconnect()
+                    return False, MISSING_OCCUPIER_COUNTRY
+                params["current_code"], params["new_code"] = current_row[0], new_row[0]
+                statement = "transfer_city_by_code"
 
-            # if new country does not exist, return False
-            if new_result is None:
-                self.disconnect()
-                return False, MISSING_OCCUPIER_COUNTRY
-            
-            new_code = new_result[0]
-            
-            # check if city exists in current country
-            query_ex.execute("SELECT name FROM city WHERE name ILIKE %s AND country = %s", 
-                        (city_name, current_code))
-            
-            city_result = query_ex.fetchone()
+            # one call: the move, the capital handling and the removal of an emptied
+            # country all run in transfer_city_v1 (v2 by code)
+            status, removed_country = self.fetch_with_retry(statement, params)
 
-            # if city does not exist in current country, return False
-            if city_result is None:
+            if status != "CMD_EXECUTION_SUCCESS":
+                self.conn.rollback()
                 self.disconnect()
-                return False, NO_ENTITY_FOUND
-            
-            # check if city is capital
-            query_ex.execute("SELECT capital FROM country WHERE code = %s", (current_code,))
-            capital_result = query_ex.fetchone()
+                return False, STATUS_MESSAGES[status]
 
-            is_capital = capital_result and capital_result[0] and capital_result[0].lower() == city_name.lower()
-            
-            # transfer city
-            query_ex.execute("UPDATE city SET country = %s WHERE name ILIKE %s AND country = %s", 
-                           (new_code, city_name, current_code))
-            
-            # capital handling
-            if is_capital:
-                query_ex.execute("SELECT name FROM city WHERE country = %s ORDER BY name LIMIT 1", 
-                            (current_code,))
-                
-                new_capital = query_ex.fetchone()
-
-                # if there are no cities left in the current country, set capital to NULL
-                if new_capital:
-                    query_ex.execute("UPDATE country SET capital = %s WHERE code = %s", 
-                                (new_capital[0], current_code))
-                    
-                else:
-                    query_ex.execute("UPDATE country SET capital = NULL WHERE code = %s", 
-                                (current_code,))
-            
-            # check if country should be removed
-            query_ex.execute("SELECT COUNT(*) FROM city WHERE country = %s", (current_code,))
-            remaining_cities = query_ex.fetchone()[0]
-            
-            if remaining_cities == 0:
-                # remove from all existing tables
-                query_ex.execute("DELETE FROM encompasses WHERE country = %s", (current_code,))
-                query_ex.execute("DELETE FROM economy WHERE country = %s", (current_code,))
-                query_ex.execute("DELETE FROM religion WHERE country = %s", (current_code,))
-                query_ex.execute("DELETE FROM spoken WHERE country = %s", (current_code,))
-                query_ex.execute("DELETE FROM country WHERE code = %s", (current_code,))
-                print(f"Notice: Country named {current_name} has been removed.")
+            if removed_country is not None:
+                print(f"Notice: Country named {removed_country} has been removed.")
             
             self.conn.commit()
             self.disconnect()
+            self.invalidate_caches([city_name], [removed_country] if removed_country is not None else [])
             return True, CMD_EXECUTION_SUCCESS
             
         except:
@@ -944,16 +1684,12 @@ class Mp2Client:
     """
 
     def adjust_population(self, admin, name, country_name=None, new_population=None):
-        # TODO: Implement this function
-        
         if admin is None:
             return False, USER_NOT_AUTHORIZED
     
         self.connect()
         
         try:
-            query_ex = self.conn.cursor()
-            
             # convert new_population to integer and validate
             new_population = int(new_population)
 
@@ -962,69 +1698,527 @@ class Mp2Client:
                 self.disconnect()
                 return False, NO_NEGATIVE_POPULATION
             
-            # check if name is a country first
-            query_ex.execute("SELECT code, name FROM country WHERE name ILIKE %s", (name,))
-            country_result = query_ex.fetchone()
+            params = {"name": name, "country_name": country_name, "population": new_population}
+            statement = "adjust_population"
+
+            # the name is a country or the country of the city, resolved from the cache
+            if self.reference_cache is not None:
+                entity_row = self.reference_cache.get("country", name, self.reference_cursor)
+                city_country_row = None
+                if entity_row is None and country_name is not None:
+                    city_country_row = self.reference_cache.get("country", country_name, self.reference_cursor)
+                    if city_country_row is None:
+                        self.disconnect()
+                        return False, NO_ENTITY_FOUND
+                params["entity_code"] = entity_row[0] if entity_row is not None else None
+                params["city_country_code"] = city_country_row[0] if city_country_row is not None else None
+                statement = "adjust_population_by_code"
+
+            # one call: country first, then the city by name or by name and country
+            status = self.fetch_with_retry(statement, params)[0]
+
+            if status != "CMD_EXECUTION_SUCCESS":
+                self.conn.rollback()
+                self.disconnect()
+                return False, STATUS_MESSAGES[status]
             
-            if country_result:
-                # update country population
-                query_ex.execute("UPDATE country SET population = %s WHERE name ILIKE %s", 
-                            (new_population, name))
-                
+            self.conn.commit()
+            self.disconnect()
+            self.invalidate_caches([name])
+            return True, CMD_EXECUTION_SUCCESS
+            
+        except:
+            self.conn.rollback()
+            self.disconnect()
+            return False, CMD_EXECUTION_FAILED
+
+
+    """
+        Adjusts the populations given in a csv file, like one adjust_population per row, in one transaction.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - The file has a header line and name,country_name,population rows; country_name may be empty.
+        - Rows that can not be applied (ambiguous or unknown name, invalid population) are skipped and listed.
+        - If the operation is successful; commit changes, print the report and return tuple (True, CMD_EXECUTION_SUCCESS).
+        - If the file can not be opened, return tuple (False, FILE_NOT_FOUND).
+        - If the admin is not signed in, return tuple (False, USER_NOT_AUTHORIZED).
+        - If any other exception occurs; rollback, do nothing on the database and return tuple (False, CMD_EXECUTION_FAILED).
+
+        Output should be like:
+        ROW|NAME|COUNTRY|ERROR
+        2|Alexandria||Multiple cities with given name exist - specify country.
+        COUNTRIES|CITIES|SKIPPED
+        1|3|1
+    """
+
+    def bulk_adjust_population(self, admin, file_path):
+
+        if admin is None:
+            return False, USER_NOT_AUTHORIZED
+
+        try:
+            csv_file = open(file_path, newline="", encoding="utf-8")
+        except OSError:
+            return False, FILE_NOT_FOUND
+
+        self.connect()
+
+        with csv_file:
+            try:
+                query_ex = self.conn.cursor()
+
+                # the whole file in one COPY, then one statement resolves every row
+                work_mem = self.set_work_mem(query_ex, BULK_WORK_MEM)
+                query_ex.execute(POPULATION_IMPORT_TABLE)
+                query_ex.copy_expert(
+                    "COPY population_import ({}) FROM STDIN WITH (FORMAT csv, HEADER true)".format(
+                        ", ".join(POPULATION_IMPORT_COLUMNS)),
+                    csv_file
+                )
+                query_ex.execute(POPULATION_IMPORT_RESOLVE)
+
+                query_ex.execute(POPULATION_IMPORT_SKIPPED)
+                skipped = query_ex.fetchall()
+
+                query_ex.execute(POPULATION_IMPORT_APPLY)
+                country_count, city_count = query_ex.fetchone()
+                self.set_work_mem(query_ex, work_mem)
+
                 self.conn.commit()
                 self.disconnect()
-                return True, CMD_EXECUTION_SUCCESS
-            
-            # check if name is a city
-            if country_name is None:
-                # check city without country specification
-                query_ex.execute("SELECT COUNT(*) FROM city WHERE name ILIKE %s", (name,))
-                city_count = query_ex.fetchone()[0]
-                
-                # if city_count > 1, ambiguous city
-                if city_count > 1:
-                    self.disconnect()
-                    return False, AMBIGUOUS_CITY
-                
-                # if city_count == 0, no entity found
-                elif city_count == 0:
+                self.invalidate_caches()
+
+            except:
+                self.conn.rollback()
+                self.disconnect()
+                return False, CMD_EXECUTION_FAILED
+
+        if skipped:
+            print("ROW|NAME|COUNTRY|ERROR")
+            for line_no, name, country_name, status in skipped:
+                print(f"{line_no}|{name}|{country_name or ''}|{STATUS_MESSAGES[status]}")
+
+        print("COUNTRIES|CITIES|SKIPPED")
+        print(f"{country_count}|{city_count}|{len(skipped)}")
+
+        return True, CMD_EXECUTION_SUCCESS
+
+
+    """
+        Transfers the cities given in a csv file, like one transfer_city per row, in one transaction.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - The file has a header line and city_name,current_country,new_country rows.
+        - Rows are checked against the database as it was before the command; rows that can not be applied
+          (see transfer_city, a city listed twice or a name already taken in the new country) are skipped and listed.
+        - Capitals are reassigned once, after all cities are moved, to the cities one transfer_city per row
+          would have left in file order; emptied countries are removed once at the end.
+        - If the operation is successful; commit changes, print the report and return tuple (True, CMD_EXECUTION_SUCCESS).
+        - If the file can not be opened, return tuple (False, FILE_NOT_FOUND).
+        - If the admin is not signed in, return tuple (False, USER_NOT_AUTHORIZED).
+        - If any other exception occurs; rollback, do nothing on the database and return tuple (False, CMD_EXECUTION_FAILED).
+
+        Output should be like:
+        ROW|CITY|FROM|TO|ERROR
+        3|Izmir|Greece|Turkey|No geographic entity named with given name found.
+        Notice: Country named Pitcairn has been removed.
+        CITIES|SKIPPED
+        12|1
+    """
+
+    def bulk_transfer_city(self, admin, file_path):
+
+        if admin is None:
+            return False, USER_NOT_AUTHORIZED
+
+        try:
+            csv_file = open(file_path, newline="", encoding="utf-8")
+        except OSError:
+            return False, FILE_NOT_FOUND
+
+        self.connect()
+
+        with csv_file:
+            try:
+                query_ex = self.conn.cursor()
+
+                work_mem = self.set_work_mem(query_ex, BULK_WORK_MEM)
+                query_ex.execute(TRANSFER_IMPORT_TABLE)
+                query_ex.copy_expert(
+                    "COPY transfer_import ({}) FROM STDIN WITH (FORMAT csv, HEADER true)".format(
+                        ", ".join(TRANSFER_IMPORT_COLUMNS)),
+                    csv_file
+                )
+                query_ex.execute(TRANSFER_IMPORT_RESOLVE)
+
+                query_ex.execute(TRANSFER_IMPORT_SKIPPED)
+                skipped = query_ex.fetchall()
+
+                query_ex.execute(TRANSFER_IMPORT_MOVE)
+                moved_count = query_ex.fetchone()[0]
+
+                query_ex.execute(TRANSFER_IMPORT_CAPITALS)
+                query_ex.execute(TRANSFER_IMPORT_CLEANUP)
+                removed_countries = [row[0] for row in query_ex.fetchall()]
+                self.set_work_mem(query_ex, work_mem)
+
+                self.conn.commit()
+                self.disconnect()
+
+            except:
+                self.conn.rollback()
+                self.disconnect()
+                return False, CMD_EXECUTION_FAILED
+
+        self.invalidate_caches(removed_countries=removed_countries)
+
+        if skipped:
+            print("ROW|CITY|FROM|TO|ERROR")
+            for line_no, city_name, current_country, new_country, status in skipped:
+                print(f"{line_no}|{city_name or ''}|{current_country or ''}|{new_country or ''}|{STATUS_MESSAGES[status]}")
+
+        for country_name in removed_countries:
+            print(f"Notice: Country named {country_name} has been removed.")
+
+        print("CITIES|SKIPPED")
+        print(f"{moved_count}|{len(skipped)}")
+
+        return True, CMD_EXECUTION_SUCCESS
+
+
+    """
+        Prints the rows of a listing command (see LIST_QUERIES) for the named country or continent.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - Rows are read from a named server-side cursor LIST_PAGE_SIZE at a time and every page is
+          printed as it arrives, so the first rows show at once and memory does not grow with the list.
+        - A guest pays one query of its quota for the whole list.
+        - If the operation is successful; print the rows and return tuple (True, CMD_EXECUTION_SUCCESS).
+        - If the country or continent is not found, return tuple (False, NO_ENTITY_FOUND).
+        - If any other exception occurs; rollback and return tuple (False, CMD_EXECUTION_FAILED).
+    """
+    def list_rows(self, command, name, format_row):
+        created_guest = False
+
+        self.connect()
+
+        try:
+            query_ex = self.conn.cursor()
+            reference_table, entity_query, header, list_query = LIST_QUERIES[command]
+
+            if self.user is not None:
+                # check query limit, the count kept here includes the buffered queries
+                if self.user.current_query_count >= self.user.max_query_limit:
+                    print(f"{self.user.max_query_limit} query limit reached.")
                     self.disconnect()
-                    return False, NO_ENTITY_FOUND
-                
-                # unique city found, update population
-                query_ex.execute("UPDATE city SET population = %s WHERE name ILIKE %s", 
-                            (new_population, name))
-                
+                    return False, CMD_EXECUTION_FAILED
+
+                created_guest = self.create_guest_row(query_ex)
+                if self.quota is None:
+                    self.execute_statement(query_ex, "flush_quota", {"query_count": 1, "user_id": self.user.user_id})
+
+            if self.reference_cache is not None:
+                entity = self.reference_cache.get(reference_table, name, self.reference_cursor)
             else:
-                # check city with country specification
-                query_ex.execute("""
-                    SELECT c.name 
-                    FROM city c
-                    JOIN country co ON c.country = co.code
-                    WHERE c.name ILIKE %s AND co.name ILIKE %s
-                """, (name, country_name))
+                query_ex.execute(entity_query, {"name": name})
+                entity = query_ex.fetchone()
+
+            if entity is None:
+                self.conn.commit()
+                self.disconnect()
+                self.count_guest_query()
+                return False, NO_ENTITY_FOUND
+
+            # without a name psycopg2 would fetch the whole result into memory at once
+            list_ex = self.conn.cursor(name=command)
+            list_ex.execute(list_query, {"key": entity[0]})
+
+            print(header)
+            while True:
+                rows = list_ex.fetchmany(LIST_PAGE_SIZE)
+                if not rows:
+                    break
+                print("\n".join(format_row(*row) for row in rows), flush=True)
+            list_ex.close()
 
-                city_result = query_ex.fetchone()
-                
-                # if no city found, return False
-                if city_result is None:
-                    self.disconnect()
-                    return False, NO_ENTITY_FOUND
-                
-                # update city population with country specification
-                query_ex.execute("""
-                    UPDATE city 
-                    SET population = %s 
-                    WHERE name ILIKE %s AND country = (
-                        SELECT code FROM country WHERE name ILIKE %s
-                    )
-                """, (new_population, name, country_name))
-            
             self.conn.commit()
             self.disconnect()
-            return True, CMD_EXECUTION_SUCCESS
-            
+
         except:
             self.conn.rollback()
             self.disconnect()
-            return False, CMD_EXECUTION_FAILED
\ No newline at end of file
+
+            # the guest row was rolled back
+            if created_guest:
+                self.user.user_id = None
+            return False, CMD_EXECUTION_FAILED
+
+        self.count_guest_query()
+        return True, CMD_EXECUTION_SUCCESS
+
+    """
+        Counts a query of the guest after it was committed; in buffered quota mode it is only
+        counted in memory here.
+    """
+    def count_guest_query(self):
+        if self.user is None:
+            return
+        self.user.current_query_count += 1
+        if self.quota is not None:
+            self.quota.add()
+            # a batch may hold the guest row uncommitted, the timer flushes after it
+            if self.batch_conn is None and self.quota.due():
+                self.flush_quota()
+
+    """
+        Lists the cities of the given country.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - See list_rows.
+
+        Output should be like:
+        NAME|POPULATION|ELEVATION
+        Durrës|113,249|N/A
+        Tirana|418,495|110m
+    """
+
+    def list_cities(self, country_name):
+        return self.list_rows("list_cities", country_name, lambda name, population, elevation:
+                              f"{name}|{format_value(population, ',')}|{format_value(elevation, unit='m')}")
+
+    """
+        Lists the countries encompassed by the given continent, with the percentage in it.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - See list_rows.
+
+        Output should be like:
+        NAME|POPULATION|PERCENTAGE
+        Albania|2,821,977|100%
+        Russia|143,666,931|20%
+    """
+
+    def list_countries(self, continent_name):
+        return self.list_rows("list_countries", continent_name, lambda name, population, percentage:
+                              f"{name}|{format_value(population, ',')}|{format_value(percentage, unit='%')}")
+
+    """
+        Lists the religions of the given country, the largest first.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - See list_rows.
+
+        Output should be like:
+        NAME|PERCENTAGE
+        Muslim|58.8%
+        Roman Catholic|10%
+    """
+
+    def list_religions(self, country_name):
+        return self.list_rows("list_religions", country_name, lambda name, percentage:
+                              f"{name}|{format_value(percentage, unit='%')}")
+
+
+    """
+        Writes a geography table or view (see EXPORT_SOURCES) to a file with COPY ... TO STDOUT.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - Rows are streamed to the file as they arrive, memory use does not grow with the table.
+        - The file is written under a temporary name and replaces the given file when complete.
+        - If the operation is successful; print the row and byte counts and rates and return tuple (True, CMD_EXECUTION_SUCCESS).
+        - If the table or view is unknown, return tuple (False, EXPORT_UNKNOWN_SOURCE).
+        - If the format is not csv or binary, return tuple (False, EXPORT_UNKNOWN_FORMAT).
+        - If the file can not be written, return tuple (False, FILE_NOT_FOUND).
+        - If the admin is not signed in, return tuple (False, USER_NOT_AUTHORIZED).
+        - If any other exception occurs; return tuple (False, CMD_EXECUTION_FAILED).
+
+        Output should be like:
+        SOURCE|FORMAT|ROWS|BYTES|SECONDS|ROWS_PER_SECOND|MB_PER_SECOND
+        cities|csv|3051|97118|0.011|277364|8.42
+    """
+
+    def export(self, admin, source, file_path, export_format="csv"):
+
+        if admin is None:
+            return False, USER_NOT_AUTHORIZED
+
+        if source not in EXPORT_SOURCES:
+            return False, EXPORT_UNKNOWN_SOURCE
+
+        export_format = export_format.lower()
+        if export_format not in EXPORT_FORMATS:
+            return False, EXPORT_UNKNOWN_FORMAT
+
+        temporary_path = file_path + ".tmp"
+        try:
+            export_file = open(temporary_path, "wb", buffering=EXPORT_BUFFER_SIZE)
+        except OSError:
+            return False, FILE_NOT_FOUND
+
+        self.connect()
+
+        started = time.perf_counter()
+        with export_file:
+            writer = CountingWriter(export_file)
+            try:
+                query_ex = self.conn.cursor()
+                query_ex.copy_expert(
+                    "COPY {} TO STDOUT WITH ({})".format(EXPORT_SOURCES[source], EXPORT_FORMATS[export_format]),
+                    writer
+                )
+                row_count = query_ex.rowcount
+
+                self.conn.commit()
+                self.disconnect()
+
+            except:
+                self.conn.rollback()
+                self.disconnect()
+                export_file.close()
+                os.remove(temporary_path)
+                return False, CMD_EXECUTION_FAILED
+
+        try:
+            os.replace(temporary_path, file_path)
+        except OSError:
+            os.remove(temporary_path)
+            return False, FILE_NOT_FOUND
+        seconds = max(time.perf_counter() - started, 1e-6)
+
+        print("SOURCE|FORMAT|ROWS|BYTES|SECONDS|ROWS_PER_SECOND|MB_PER_SECOND")
+        print(f"{source}|{export_format}|{row_count}|{writer.bytes}|{seconds:.3f}|"
+              f"{row_count / seconds:.0f}|{writer.bytes / seconds / 1048576:.2f}")
+
+        return True, CMD_EXECUTION_SUCCESS
+
+
+    """
+        Compares the trigger maintained summary tables with a full recompute.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - If every summary matches, print the mismatch counts and return tuple (True, CMD_EXECUTION_SUCCESS).
+        - If any row differs, also print the differing rows and return tuple (False, SUMMARY_INCONSISTENT).
+        - If the admin is not signed in, return tuple (False, USER_NOT_AUTHORIZED).
+        - If any other exception occurs; return tuple (False, CMD_EXECUTION_FAILED).
+
+        Output should be like:
+        SUMMARY|MISMATCHES
+        continent_summary|1
+        SUMMARY|KEY|STORED|RECOMPUTED
+        continent_summary|Europe|45/707206426/16981770|46/708206426/16981770
+    """
+
+    def check_summaries(self, admin):
+
+        if admin is None:
+            return False, USER_NOT_AUTHORIZED
+
+        self.connect()
+
+        try:
+            query_ex = self.conn.cursor()
+
+            mismatches = []
+            counts = []
+            for summary, query in SUMMARY_CHECKS.items():
+                query_ex.execute(query)
+                rows = query_ex.fetchall()
+                counts.append((summary, len(rows)))
+                mismatches.extend((summary,) + row for row in rows)
+
+            self.conn.commit()
+            self.disconnect()
+
+        except:
+            self.conn.rollback()
+            self.disconnect()
+            return False, CMD_EXECUTION_FAILED
+
+        print("SUMMARY|MISMATCHES")
+        for summary, count in counts:
+            print(f"{summary}|{count}")
+
+        if mismatches:
+            print("SUMMARY|KEY|STORED|RECOMPUTED")
+            for summary, key, stored, recomputed in mismatches:
+                print(f"{summary}|{key}|{stored}|{recomputed}")
+            return False, SUMMARY_INCONSISTENT
+
+        return True, CMD_EXECUTION_SUCCESS
+
+
+    """
+        Prints statistics of the connection pool.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - If pooled mode is disabled, return tuple (False, POOL_DISABLED).
+        
+        Output should be like:
+        SIZE|IDLE|IN_USE|MAX_SIZE|CHECKOUTS|WAITS|WAIT_TIME
+        1|1|0|5|12|0|0.000s
+    """
+
+    def pool_stats(self):
+
+        if self.pool is None:
+            return False, POOL_DISABLED
+
+        stats = self.pool.stats()
+
+        print("SIZE|IDLE|IN_USE|MAX_SIZE|CHECKOUTS|WAITS|WAIT_TIME")
+        print(f"{stats['size']}|{stats['idle']}|{stats['in_use']}|{stats['max_size']}|{stats['checkouts']}|{stats['waits']}|{stats['wait_time']:.3f}s")
+
+        return True, CMD_EXECUTION_SUCCESS
+
+
+    """
+        Prints the latency histograms of the commands, statements and connects of this client.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - If metrics are disabled, return tuple (False, METRICS_DISABLED).
+
+        Output should be like:
+        KIND|NAME|COUNT|ROWS|MEAN_MS|P50_MS|P90_MS|P99_MS|MAX_MS
+        command|get_statistics|120||0.412|0.380|0.520|1.100|1.340
+        statement|get_statistics|120|120|0.201|0.190|0.250|0.610|0.720
+    """
+
+    def stats(self):
+
+        if self.metrics is None:
+            return False, METRICS_DISABLED
+
+        print("KIND|NAME|COUNT|ROWS|MEAN_MS|P50_MS|P90_MS|P99_MS|MAX_MS")
+        for kind, name, count, rows, mean, p50, p90, p99, maximum in self.metrics.summary():
+            print(f"{kind}|{name}|{count}|{'' if rows is None else rows}|{mean:.3f}|{p50:.3f}|{p90:.3f}|{p99:.3f}|{maximum:.3f}")
+
+        return True, CMD_EXECUTION_SUCCESS
+
+
+    """
+        Prints the size and the hit, miss and invalidation counts of the caches of this client and,
+        when it listens for changes, the notifications it received.
+        - Return type is a tuple, 1st element is a boolean and 2nd element is the response message from messages.py.
+        - If every cache is disabled, return tuple (False, CACHE_DISABLED).
+
+        Output should be like:
+        CACHE|ENTRIES|HITS|MISSES|INVALIDATIONS|EVICTIONS|BYTES
+        country|238|41|1|1|0|
+        accesslevels|3|12|1|0|0|
+        get_statistics|310|5210|402|12|0|121840
+        NOTIFICATIONS|RECONNECTS|LAG_P50_MS|LAG_P99_MS|LAG_MAX_MS
+        14|0|0.412|3.100|3.100
+    """
+
+    def cache_stats(self):
+
+        if self.reference_cache is None and self.statistics_cache is None:
+            return False, CACHE_DISABLED
+
+        print("CACHE|ENTRIES|HITS|MISSES|INVALIDATIONS|EVICTIONS|BYTES")
+        if self.reference_cache is not None:
+            for name, entries, hits, misses, invalidations in self.reference_cache.stats():
+                print(f"{name}|{entries}|{hits}|{misses}|{invalidations}|0|")
+
+        if self.statistics_cache is not None:
+            cache = self.statistics_cache
+            print(f"get_statistics|{len(cache.entries)}|{cache.hits}|{cache.misses}|{cache.invalidations}|{cache.evictions}|{cache.size}")
+
+        # lag: from a change in the database until this client evicted it
+        if self.change_listener is not None:
+            listener = self.change_listener
+            print("NOTIFICATIONS|RECONNECTS|LAG_P50_MS|LAG_P99_MS|LAG_MAX_MS")
+            print(f"{listener.notifications}|{listener.reconnects}|{listener.lag.percentile(50) / 1000:.3f}|"
+                  f"{listener.lag.percentile(99) / 1000:.3f}|{listener.lag.max / 1000:.3f}")
+
+        return True, CMD_EXECUTION_SUCCESS
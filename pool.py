@@ -0,0 +1,235 @@
+import threading
+import time
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection, cursor
+from psycopg2.pool import PoolError
+
+
+"""
+    psycopg2 cursor that counts the statements sent through it on its connection and,
+    when the connection has a Metrics or a SlowQueryLog, times each one for them.
+"""
+class Mp2Cursor(cursor):
+    def execute(self, query, vars=None):
+        conn = self.connection
+        conn.statement_count += 1
+        if conn.metrics is None and conn.slow_query_log is None:
+            return super().execute(query, vars)
+
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.observe(query, vars, time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        conn = self.connection
+        conn.statement_count += 1
+        if conn.metrics is None and conn.slow_query_log is None:
+            return super().copy_expert(sql, file, size)
+
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self.observe(sql, None, time.perf_counter() - started)
+
+    def observe(self, query, vars, seconds):
+        conn = self.connection
+        if conn.metrics is not None:
+            conn.metrics.record_statement(query, seconds, self.rowcount)
+        if conn.slow_query_log is None:
+            return
+
+        # the auto_explain notices of this statement, taken even when it was fast
+        nested_plans = conn.slow_query_log.take_nested_plans(conn) if conn.nested_plans else ()
+        if seconds >= conn.slow_query_log.threshold:
+            conn.slow_query_log.record(query, vars, seconds, nested_plans)
+
+
+"""
+    psycopg2 connection that remembers which statements were prepared on it
+    and how many statements were executed on it.
+    metrics and slow_query_log are set by the client using the connection, None disables them;
+    nested_plans is set once the slow query log loaded auto_explain on it.
+"""
+class Mp2Connection(connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.statement_count = 0
+        self.metrics = None
+        self.slow_query_log = None
+        self.nested_plans = False
+        self.cursor_factory = Mp2Cursor
+
+
+"""
+    Thread-safe pool of PostgreSQL connections.
+    - Opens no connection at creation: the first getconn opens minconn connections and more are
+      opened on demand, up to maxconn at a time; returned connections are kept open for reuse.
+    - Broken connections are dropped when returned and replaced while fewer than minconn are open,
+      so minconn connections are idle between commands.
+    - getconn blocks while all maxconn connections are checked out (up to timeout seconds, forever if None).
+    - putconn rolls back any unfinished transaction and drops broken connections.
+    - Counts checkouts and how many of them had to wait for a free connection.
+"""
+class ConnectionPool:
+    def __init__(self, conn_params, minconn=1, maxconn=5, timeout=None):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise PoolError("invalid pool size: minconn=%d maxconn=%d" % (minconn, maxconn))
+
+        self.conn_params = conn_params
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+        # the minconn connections are opened by the first getconn, so creating the pool
+        # needs no database round trip
+        self._filled = False
+
+    def _open(self):
+        conn = psycopg2.connect(**self.conn_params, connection_factory=Mp2Connection)
+        conn.autocommit = False
+        return conn
+
+    """
+        Opens an idle connection in a slot reserved under the lock.
+        A failed connect only releases the slot, getconn connects on demand.
+    """
+    def _open_idle(self):
+        try:
+            conn = self._open()
+        except psycopg2.Error:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            if self._closed:
+                conn.close()
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    """
+        Borrows a connection from the pool, opening a new one if the pool is below maxconn.
+    """
+    def getconn(self):
+        with self._cond:
+            if self._closed:
+                raise PoolError("connection pool is closed")
+
+            self.checkouts += 1
+
+            if not self._idle and self._size >= self.maxconn:
+                # every connection is in use, wait for one to be returned
+                self.waits += 1
+                started = time.monotonic()
+                deadline = None if self.timeout is None else started + self.timeout
+
+                while not self._idle and self._size >= self.maxconn and not self._closed:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.wait_time += time.monotonic() - started
+                        raise PoolError("timed out waiting for a free connection")
+                    self._cond.wait(remaining)
+
+                self.wait_time += time.monotonic() - started
+
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+
+            if self._idle:
+                return self._idle.pop()
+
+            # reserve the slot before connecting so other threads do not overshoot maxconn
+            self._size += 1
+
+            # the first checkout also opens the rest of the minconn connections
+            fill = 0
+            if not self._filled:
+                self._filled = True
+                fill = max(self.minconn - self._size, 0)
+                self._size += fill
+
+        try:
+            conn = self._open()
+        except:
+            with self._cond:
+                self._size -= 1 + fill
+                if fill:
+                    self._filled = False
+                self._cond.notify_all()
+            raise
+
+        for _ in range(fill):
+            self._open_idle()
+        return conn
+
+    """
+        Returns a borrowed connection to the pool.
+    """
+    def putconn(self, conn):
+        if not conn.closed and conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            # do not hand out a connection with a half-done transaction
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                conn.close()
+
+        with self._cond:
+            if conn.closed or self._closed:
+                if not conn.closed:
+                    conn.close()
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+            # reserve the slot of the replacement like getconn does
+            replace = not self._closed and self._size < self.minconn
+            if replace:
+                self._size += 1
+
+        if replace:
+            self._open_idle()
+
+    """
+        Closes every idle connection; connections still checked out are closed when returned.
+    """
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    """
+        Returns a snapshot of the pool counters.
+    """
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.maxconn,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+            }
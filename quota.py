@@ -0,0 +1,94 @@
+import threading
+import time
+
+from config import read_config
+
+QUOTA_MODES = ("immediate", "buffered")
+
+
+"""
+    In-memory guest query counter used in buffered quota mode.
+    - Queries are counted here instead of with an UPDATE of the users row per query.
+    - A flush is due every flush_every queries or when the oldest unflushed query is
+      flush_interval seconds old; the client then writes the pending count in one statement.
+    - Thread-safe, so a timer thread may flush while the client is running commands.
+"""
+class QuotaBuffer:
+    def __init__(self, flush_every=100, flush_interval=5.0):
+        if flush_every < 1 or flush_interval <= 0:
+            raise ValueError("invalid quota buffer: flush_every=%d flush_interval=%g" % (flush_every, flush_interval))
+
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+
+        self.pending = 0
+        self.first_pending_at = None
+        self.flushes = 0
+        self._lock = threading.Lock()
+
+    """
+        True when the pending count, plus extra queries about to be counted, should be written.
+    """
+    def due(self, extra=0):
+        if self.pending + extra >= self.flush_every:
+            return True
+        return self.first_pending_at is not None and time.monotonic() - self.first_pending_at >= self.flush_interval
+
+    """
+        Returns the count to write together with the next query: pending + 1 if a flush is
+        due (the pending count is then taken), 0 if the query should only be counted in memory.
+    """
+    def take_due(self):
+        with self._lock:
+            if not self.due(1):
+                return 0
+            count, self.pending, self.first_pending_at = self.pending + 1, 0, None
+            self.flushes += 1
+            return count
+
+    """
+        Takes the whole pending count, e.g. for a timer flush.
+    """
+    def take(self):
+        with self._lock:
+            count, self.pending, self.first_pending_at = self.pending, 0, None
+            if count:
+                self.flushes += 1
+            return count
+
+    """
+        Counts queries in memory; also used to put back a count whose flush failed.
+    """
+    def add(self, count=1):
+        if count <= 0:
+            return
+        with self._lock:
+            if self.pending == 0:
+                self.first_pending_at = time.monotonic()
+            self.pending += count
+
+    """
+        Drops the pending count, when the guest row it belongs to is deleted.
+    """
+    def discard(self):
+        with self._lock:
+            self.pending, self.first_pending_at = 0, None
+
+
+"""
+    Returns the QuotaBuffer arguments given in the optional [quota] section, or None in immediate
+    mode (one UPDATE of the users row per query, the default). Every session needs its own buffer.
+"""
+def read_quota_config(config_filename):
+    quota_params = read_config(filename=config_filename, section="quota", required=False)
+
+    mode = quota_params.get("mode", "immediate").lower()
+    if mode not in QUOTA_MODES:
+        raise ValueError("unknown quota mode %r, expected one of %s" % (mode, ", ".join(QUOTA_MODES)))
+    if mode == "immediate":
+        return None
+
+    return {
+        "flush_every": int(quota_params.get("flush_every", 100)),
+        "flush_interval": float(quota_params.get("flush_interval", 5.0)),
+    }
@@ -0,0 +1,107 @@
+import time
+
+from config import read_config, read_flag
+
+# reference tables kept in memory, each loaded whole by its query. The first column is the
+# key, the others the cached row; country names are normalized with lower() by the cache.
+REFERENCE_TABLES = {
+    # country name -> (code, name)
+    "country": "SELECT name, code, name FROM country",
+    # continent name -> (name, area)
+    "continent": "SELECT name, name, area FROM continent",
+    # level_id -> (level_id, name, max_parallel_sessions)
+    "accesslevels": "SELECT level_id, level_id, name, max_parallel_sessions FROM accesslevels ORDER BY level_id",
+}
+
+# tables whose keys are names, looked up case-insensitively like the commands resolve them
+NAME_KEYED_TABLES = ("country", "continent")
+
+
+"""
+    In-memory copy of the reference tables, which the commands read far more often than
+    anything changes them.
+    - A table is loaded whole on its first lookup, with a cursor of the client, and loaded again
+      once it is ttl seconds old, which bounds how stale rows changed by other clients can be.
+    - The client drops the entries its own writes change (a country removed by transfer_city)
+      and, with change notifications, the entries other processes changed.
+    - Counts hits (answered from memory), misses (the table had to be loaded) and
+      invalidations (entries or tables dropped) per table.
+"""
+class ReferenceCache:
+    def __init__(self, ttl=300.0):
+        if ttl <= 0:
+            raise ValueError("invalid reference cache: ttl=%g" % ttl)
+
+        self.ttl = ttl
+        # table -> (loaded_at, {key: row})
+        self.tables = {}
+        self.hits = dict.fromkeys(REFERENCE_TABLES, 0)
+        self.misses = dict.fromkeys(REFERENCE_TABLES, 0)
+        self.invalidations = dict.fromkeys(REFERENCE_TABLES, 0)
+
+    @staticmethod
+    def normalize(table, key):
+        return key.lower() if table in NAME_KEYED_TABLES else key
+
+    """
+        Returns the {key: row} dict of the table. cursor is called for a cursor only when the
+        table has to be loaded.
+    """
+    def rows(self, table, cursor):
+        loaded = self.tables.get(table)
+        if loaded is not None and time.monotonic() - loaded[0] < self.ttl:
+            self.hits[table] += 1
+            return loaded[1]
+
+        self.misses[table] += 1
+        query_ex = cursor()
+        query_ex.execute(REFERENCE_TABLES[table])
+        rows = {self.normalize(table, row[0]): tuple(row[1:]) for row in query_ex.fetchall()}
+        self.tables[table] = (time.monotonic(), rows)
+        return rows
+
+    """
+        Returns the cached row of the key, None when the table has no such row.
+    """
+    def get(self, table, key, cursor):
+        return self.rows(table, cursor).get(self.normalize(table, key))
+
+    """
+        Drops the given keys of the table, or the whole table when keys is None.
+    """
+    def drop(self, table, keys=None):
+        loaded = self.tables.get(table)
+        if loaded is None:
+            return
+
+        if keys is None:
+            del self.tables[table]
+            self.invalidations[table] += 1
+            return
+
+        for key in keys:
+            if loaded[1].pop(self.normalize(table, key), None) is not None:
+                self.invalidations[table] += 1
+
+    """
+        Returns (table, entries, hits, misses, invalidations) of every reference table.
+    """
+    def stats(self):
+        return [(table, len(self.tables[table][1]) if table in self.tables else 0,
+                 self.hits[table], self.misses[table], self.invalidations[table])
+                for table in REFERENCE_TABLES]
+
+
+"""
+    Returns the ReferenceCache arguments given in the optional [reference_cache] section, or
+    None when the cache is disabled (the default).
+"""
+def read_reference_cache_config(config_filename):
+    cache_params = read_config(filename=config_filename, section="reference_cache", required=False)
+
+    if not read_flag(cache_params, "enabled"):
+        return None
+
+    return {
+        "ttl": float(cache_params.get("ttl", 300)),
+    }
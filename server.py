@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+import datetime
+
+import messages
+from async_mp2 import AsyncMp2Client, create_pool
+from mp2 import tokenize_command
+from quota import read_quota_config
+from validators import *
+
+POSTGRESQL_CONFIG_FILE_NAME = "database.cfg"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 3520
+
+# line sent after the output of every command, so clients know the response is complete
+RESPONSE_END = "."
+
+
+"""
+    State of one client connection: its AsyncMp2Client (guest user) and the signed-in admin.
+    Output of the running command is collected in lines until it is sent.
+"""
+class Session:
+    def __init__(self):
+        self.client = None
+        self.admin = None
+        self.lines = []
+
+    def out(self, line):
+        self.lines.append(line)
+
+    def success(self, message):
+        self.out(message)
+
+    def error(self, message):
+        self.out("ERROR: %s" % message)
+
+    def take_output(self):
+        lines, self.lines = self.lines, []
+        return lines
+
+
+"""
+    Validates and executes one tokenized command of a session, like main.execute_command.
+    Returns False when the session should end (successful quit), True otherwise.
+"""
+async def execute_command(session, cmd_tokens):
+    client = session.client
+    cmd = cmd_tokens[0] if len(cmd_tokens) > 0 else ""
+
+    if cmd == "help":
+        client.help()
+
+    elif cmd == "sign_up":
+        validation_result, validation_message = sign_up_validator(session.admin, cmd_tokens)
+
+        if validation_result:
+            _, admin_id, password, level_id = cmd_tokens
+            exec_success, exec_message = await client.sign_up(admin_id=admin_id, password=password, level_id=level_id)
+
+            if exec_success:
+                session.success(exec_message)
+            else:
+                session.error(exec_message)
+        else:
+            session.error(validation_message)
+
+    elif cmd == "sign_in":
+        validation_result, validation_message = sign_in_validator(session.admin, cmd_tokens)
+
+        if validation_result:
+            _, admin_id, password = cmd_tokens
+            admin, exec_message = await client.sign_in(admin_id=admin_id, password=password)
+
+            if admin:
+                session.admin = admin
+                session.success(exec_message)
+            else:
+                session.error(exec_message)
+        else:
+            session.error(validation_message)
+
+    elif cmd == "sign_out":
+        validation_result, validation_message = basic_validator(session.admin, cmd_tokens)
+
+        if validation_result:
+            exec_success, exec_message = await client.sign_out(admin=session.admin)
+
+            if exec_success:
+                session.admin = None
+                session.success(exec_message)
+            else:
+                session.error(exec_message)
+        else:
+            session.error(validation_message)
+
+    elif cmd == "quit":
+        validation_result, validation_message = quit_validator(cmd_tokens)
+
+        if validation_result:
+            exec_success, exec_message = await client.quit(admin=session.admin)
+
+            if exec_success:
+                session.admin = None
+                return False
+            session.error(exec_message)
+        else:
+            session.error(validation_message)
+
+    elif cmd == "show_levels":
+        exec_success, exec_message = await client.show_levels()
+        if exec_success:
+            session.success(exec_message)
+        else:
+            session.error(exec_message)
+
+    elif cmd == "show_my_level":
+        exec_success, exec_message = await client.show_my_level(admin=session.admin)
+        if exec_success:
+            session.success(exec_message)
+        else:
+            session.error(exec_message)
+
+    elif cmd == "change_level":
+        validation_result, validation_message = change_level_validator(cmd_tokens)
+
+        if validation_result:
+            _, level_id = cmd_tokens
+            admin, exec_message = await client.change_level(admin=session.admin, new_level_id=level_id)
+
+            if admin:
+                session.admin = admin
+                session.success(exec_message)
+            else:
+                session.error(exec_message)
+        else:
+            session.error(validation_message)
+
+    elif cmd == "get_statistics":
+        validation_result, validation_message = get_statistics_validator(cmd_tokens)
+
+        if validation_result:
+            name = cmd_tokens[1]
+            country_name = cmd_tokens[2] if len(cmd_tokens) == 3 else None
+            exec_success, exec_message = await client.get_statistics(name=name, country_name=country_name)
+
+            if exec_success:
+                session.success(exec_message)
+            else:
+                session.error(exec_message)
+        else:
+            session.error(validation_message)
+
+    elif cmd == "update_religion":
+        validation_result, validation_message = update_religion_validator(cmd_tokens)
+
+        if validation_result:
+            _, country_name, religion_name1, religion_name2, percentage = cmd_tokens
+            exec_success, exec_message = await client.update_religion(
+                admin=session.admin,
+                country_name=country_name,
+                religion_name1=religion_name1,
+                religion_name2=religion_name2,
+                percentage=percentage
+            )
+
+            if exec_success:
+                session.success(exec_message)
+            else:
+                session.error(exec_message)
+        else:
+            session.error(validation_message)
+
+    elif cmd == "transfer_city":
+        validation_result, validation_message = transfer_city_validator(cmd_tokens)
+
+        if validation_result:
+            _, city_name, current_country, new_country = cmd_tokens
+            exec_success, exec_message = await client.transfer_city(
+                admin=session.admin,
+                city_name=city_name,
+                current_country=current_country,
+                new_country=new_country
+            )
+
+            if exec_success:
+                session.success(exec_message)
+            else:
+                session.error(exec_message)
+        else:
+            session.error(validation_message)
+
+    elif cmd == "adjust_population":
+        validation_result, validation_message = adjust_population_validator(cmd_tokens)
+
+        if validation_result:
+            if len(cmd_tokens) == 4:
+                _, name, country_name, new_population = cmd_tokens
+            else:
+                _, name, new_population = cmd_tokens
+                country_name = None
+
+            exec_success, exec_message = await client.adjust_population(
+                admin=session.admin,
+                name=name,
+                country_name=country_name,
+                new_population=new_population
+            )
+
+            if exec_success:
+                session.success(exec_message)
+            else:
+                session.error(exec_message)
+        else:
+            session.error(validation_message)
+
+    elif cmd == "check_summaries":
+        validation_result, validation_message = check_summaries_validator(cmd_tokens)
+
+        if validation_result:
+            exec_success, exec_message = await client.check_summaries(admin=session.admin)
+
+            if exec_success:
+                session.success(exec_message)
+            else:
+                session.error(exec_message)
+        else:
+            session.error(validation_message)
+
+    elif cmd == "":
+        pass
+
+    else:
+        session.error(messages.CMD_UNDEFINED)
+
+    return True
+
+
+"""
+    Sends the output of the last command followed by a RESPONSE_END line.
+"""
+async def send_output(session, writer):
+    lines = session.take_output()
+    lines.append(RESPONSE_END)
+    writer.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+    # only waits when the client does not read its responses fast enough
+    await writer.drain()
+
+
+"""
+    Serves one client connection. Every line received is a command; its output is sent back
+    followed by a RESPONSE_END line. Commands of a connection run one after another, pipelined
+    commands are read from the socket buffer without waiting for the client.
+    A connection closed without quit is cleaned up as if quit was given.
+"""
+async def handle_connection(pool, quota_settings, reader, writer):
+    session = Session()
+    session.client = AsyncMp2Client(pool, out=session.out, quota_settings=quota_settings)
+    running = True
+
+    try:
+        while running:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # a line longer than the StreamReader limit (64 KiB): the rest of it can not be
+                # told apart from the next command, so it is answered as failed and the
+                # connection is closed
+                session.error(messages.CMD_EXECUTION_FAILED)
+                await send_output(session, writer)
+                break
+            if not line:
+                break
+
+            try:
+                running = await execute_command(session, tokenize_command(line.decode("utf-8", errors="replace")))
+            except Exception:
+                # one failing command must not drop the connection or the server
+                session.error(messages.CMD_EXECUTION_FAILED)
+
+            await send_output(session, writer)
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+
+    finally:
+        try:
+            if running:
+                await session.client.quit(admin=session.admin)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                # the client reset the connection
+                pass
+
+
+"""
+    Removes guest rows left behind by crashed clients every interval seconds.
+"""
+async def sweep_guests_periodically(pool, interval, max_idle):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await pool.fetchval("SELECT sweep_guest_users($1)", max_idle)
+            if removed:
+                print(f"removed {removed} idle guest users")
+        except Exception as error:
+            print(f"guest sweep failed: {error}")
+
+
+async def serve(config_filename, host, port, maxconn=None, sweep_interval=3600, max_idle_hours=24.0):
+    pool = await create_pool(config_filename, maxconn=maxconn)
+    quota_settings = read_quota_config(config_filename)
+
+    sweeper = None
+    if sweep_interval > 0:
+        sweeper = asyncio.ensure_future(
+            sweep_guests_periodically(pool, sweep_interval, datetime.timedelta(hours=max_idle_hours)))
+
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(pool, quota_settings, reader, writer),
+        host, port, limit=2 ** 16
+    )
+    print(f"listening on {host}:{port}")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if sweeper is not None:
+            sweeper.cancel()
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Geographic Information System commands over TCP.")
+    parser.add_argument("--config", default=POSTGRESQL_CONFIG_FILE_NAME, help="database configuration file")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="address to listen on (default %(default)s)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port to listen on (default %(default)s)")
+    parser.add_argument("--maxconn", type=int, help="database connections shared by all clients (default from [pool])")
+    parser.add_argument("--sweep-interval", type=float, default=3600,
+                        help="seconds between sweeps of guest users left by crashed clients, 0 disables (default %(default)s)")
+    parser.add_argument("--max-idle-hours", type=float, default=24.0,
+                        help="guest users inactive for longer than this are swept (default %(default)s)")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.config, args.host, args.port, maxconn=args.maxconn,
+                          sweep_interval=args.sweep_interval, max_idle_hours=args.max_idle_hours))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+import logging
+import queue
+import random
+import re
+import threading
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+import psycopg2
+
+from config import read_config, read_flag
+from metrics import PREPARED_PATTERN, StatementLabels
+
+# statements that can be explained on another connection; SAVEPOINT, PREPARE, COPY, DDL and
+# statements on temp tables of the client session can not
+EXPLAINABLE_KEYWORDS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "VALUES")
+# statements that change or lock rows or use up sequence values, also inside a WITH or a SELECT;
+# they are only explained, running them again would compete with the commands and find the
+# changes of their first run
+WRITE_PATTERN = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|SHARE|nextval|setval)\b", re.IGNORECASE)
+# the volatile functions outside pg_catalog (the command functions of the migrations), which
+# may write as well
+VOLATILE_FUNCTIONS_QUERY = """
+    SELECT DISTINCT p.proname
+    FROM pg_proc p
+    JOIN pg_namespace n ON n.oid = p.pronamespace
+    WHERE n.nspname NOT IN ('pg_catalog', 'information_schema') AND p.provolatile = 'v' AND p.prokind = 'f'
+"""
+# SQLSTATE of a write in a read-only transaction, the guard of the statements that are run again
+READ_ONLY_SQL_TRANSACTION = "25006"
+
+# with nested_plans, auto_explain sends the plans of the slow statements of a connection, those
+# run by the command functions included, to the client as notices
+AUTO_EXPLAIN_SETTINGS = (
+    "LOAD 'auto_explain'",
+    "SET auto_explain.log_min_duration = %s",
+    "SET auto_explain.log_nested_statements = on",
+    "SET auto_explain.log_level = notice",
+)
+AUTO_EXPLAIN_NOTICE = re.compile(r"^\w+:\s+duration: .* plan:", re.DOTALL)
+
+# slow statements waiting for the log thread; more are dropped, the command never waits
+QUEUE_SIZE = 1000
+
+# the log connection gives up on plans that take this long or wait for locks of a command
+EXPLAIN_STATEMENT_TIMEOUT = "30s"
+EXPLAIN_LOCK_TIMEOUT = "2s"
+
+# parameters are logged up to this many characters
+PARAMS_LENGTH = 500
+
+
+"""
+    Log of statements slower than a threshold, written to a rotating file by a background thread.
+    - record() is called for every statement over the threshold on the command path and only
+      queues it; the log thread formats and writes the entry.
+    - A share of the slow statements (sample_rate) is explained by the log thread on its own
+      connection and the plan is written with the entry. Read-only SELECT and WITH statements
+      are run again under EXPLAIN (ANALYZE, BUFFERS) in a read-only transaction; statements that
+      write or call a volatile function (the command functions) only get EXPLAIN, without running.
+    - EXPLAIN of a command function call only shows a Function Scan. With nested_plans, every
+      client connection loads auto_explain, which reports the plans of the slow statements the
+      functions run, with their durations; they are taken from the notices of the connection
+      (see take_nested_plans) and written with the entry. Loading auto_explain needs a superuser
+      or the library in session_preload_libraries; nested_plans is switched off otherwise.
+    - command is the name of the running command, set by the client.
+"""
+class SlowQueryLog:
+    def __init__(self, conn_params, threshold_ms=100.0, sample_rate=0.1, log_file="slow_queries.log",
+                 max_bytes=10485760, backup_count=5, nested_plans=False, statement_names=None,
+                 prepared_statements=None):
+        if threshold_ms < 0 or not 0 <= sample_rate <= 1:
+            raise ValueError("invalid slow query log: threshold_ms=%g sample_rate=%g" % (threshold_ms, sample_rate))
+
+        self.conn_params = conn_params
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.nested_plans = nested_plans
+        self.labels = StatementLabels(statement_names)
+        # prepared statement name -> (statement, parameter names), to explain an EXECUTE
+        self.prepared_statements = prepared_statements or {}
+
+        self.command = None
+        self.logged = 0
+        self.dropped = 0
+
+        self.logger = logging.getLogger("mp2.slow_queries.%x" % id(self))
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                           encoding="utf-8", delay=True)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger.addHandler(self.handler)
+
+        self.conn = None
+        # pattern of the calls of volatile functions, loaded with the log connection
+        self.volatile_calls = None
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.thread = threading.Thread(target=self.run, name="slow-query-log", daemon=True)
+        self.thread.start()
+
+    """
+        Loads auto_explain on a new client connection when nested_plans is on. Called by the
+        client before the connection runs its first command.
+    """
+    def prepare_connection(self, conn):
+        if not self.nested_plans or conn.nested_plans:
+            return
+
+        try:
+            query_ex = conn.cursor()
+            for setting in AUTO_EXPLAIN_SETTINGS:
+                query_ex.execute(setting, (int(self.threshold * 1000),) if "%s" in setting else None)
+            conn.commit()
+            conn.nested_plans = True
+        except psycopg2.Error as error:
+            conn.rollback()
+            self.nested_plans = False
+            self.logger.error("nested plans disabled, auto_explain can not be loaded: %s",
+                              str(error).strip().splitlines()[0])
+
+    """
+        Removes the auto_explain notices from the connection and returns their plans, the
+        plans of the slow statements run by the last statement.
+    """
+    def take_nested_plans(self, conn):
+        plans = [notice.strip() for notice in conn.notices if AUTO_EXPLAIN_NOTICE.match(notice)]
+        del conn.notices[:]
+        return plans
+
+    """
+        Queues a statement that took seconds (at least the threshold) to execute, with the
+        auto_explain plans of the slow statements it ran.
+    """
+    def record(self, query, params, seconds, nested_plans=()):
+        if isinstance(params, dict):
+            params = dict(params)
+        elif params is not None:
+            params = tuple(params)
+
+        explain = self.sample_rate > 0 and random.random() < self.sample_rate
+        try:
+            self.queue.put_nowait((datetime.now(), self.command, query, params, seconds, explain, nested_plans))
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                break
+            try:
+                self.write(*entry)
+            except Exception as error:
+                self.logger.error("slow query log failed: %s", error)
+
+    def write(self, logged_at, command, query, params, seconds, explain, nested_plans):
+        lines = [
+            "%s slow statement %.1f ms, %s in command %s" % (
+                logged_at.isoformat(sep=" ", timespec="milliseconds"), seconds * 1000,
+                self.labels.label(query), command or "-"),
+            "    params: %s" % repr(params)[:PARAMS_LENGTH],
+            "    statement: %s" % " ".join(str(query).split()),
+        ]
+
+        if explain:
+            lines.append("    plan:")
+            lines.extend("      " + line for line in self.explain(query, params))
+
+        if nested_plans:
+            lines.append("    nested plans:")
+            for plan in nested_plans:
+                lines.extend("      " + line for line in plan.splitlines())
+
+        self.logger.info("\n".join(lines))
+        self.logged += 1
+
+    """
+        Returns the plan lines of the statement, or one line saying why there is no plan.
+        Read-only statements are executed under EXPLAIN (ANALYZE, BUFFERS), in a read-only
+        transaction that is always rolled back; the others get EXPLAIN and are not executed.
+    """
+    def explain(self, query, params):
+        text = str(query).strip()
+
+        # prepared statements only exist on the connection of the client, explain their text
+        prepared = PREPARED_PATTERN.match(text)
+        if prepared is not None:
+            keyword, name = prepared.groups()
+            if keyword != "EXECUTE" or name not in self.prepared_statements:
+                return ["(not explainable)"]
+            text, param_names = self.prepared_statements[name]
+            text = text.strip()
+            params = dict(zip(param_names, params or ()))
+
+        if not text.upper().startswith(EXPLAINABLE_KEYWORDS) or ";" in text.rstrip(";"):
+            return ["(not explainable)"]
+
+        try:
+            if self.conn is None or self.conn.closed:
+                self.conn = psycopg2.connect(**self.conn_params)
+                query_ex = self.conn.cursor()
+                query_ex.execute("SET statement_timeout = %s", (EXPLAIN_STATEMENT_TIMEOUT,))
+                query_ex.execute("SET lock_timeout = %s", (EXPLAIN_LOCK_TIMEOUT,))
+                query_ex.execute(VOLATILE_FUNCTIONS_QUERY)
+                names = [re.escape(row[0]) for row in query_ex.fetchall()]
+                self.volatile_calls = re.compile(r"\b(%s)\s*\(" % "|".join(names), re.IGNORECASE) if names else None
+                self.conn.commit()
+
+            query_ex = self.conn.cursor()
+            if self.is_read_only(text):
+                try:
+                    query_ex.execute("SET TRANSACTION READ ONLY")
+                    query_ex.execute("EXPLAIN (ANALYZE, BUFFERS) " + text, params)
+                    return [row[0] for row in query_ex.fetchall()]
+                except psycopg2.Error as error:
+                    if error.pgcode != READ_ONLY_SQL_TRANSACTION:
+                        raise
+                    self.conn.rollback()
+
+            query_ex.execute("EXPLAIN " + text, params)
+            return ["(not run again, it writes: estimates only)"] + [row[0] for row in query_ex.fetchall()]
+
+        except psycopg2.Error as error:
+            return ["(plan unavailable: %s)" % str(error).strip().splitlines()[0]]
+
+        finally:
+            if self.conn is not None and not self.conn.closed:
+                self.conn.rollback()
+
+    """
+        True when the statement neither writes nor calls a volatile function, so it can be run again.
+    """
+    def is_read_only(self, text):
+        if not text.upper().startswith(("SELECT", "WITH", "VALUES")) or WRITE_PATTERN.search(text):
+            return False
+        return self.volatile_calls is None or self.volatile_calls.search(text) is None
+
+    """
+        Writes the queued statements and stops the log thread. Called once when the client closes.
+    """
+    def close(self, timeout=5.0):
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+
+        if self.conn is not None:
+            self.conn.close()
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+
+"""
+    Returns the SlowQueryLog arguments given in the optional [slow_query_log] section, or None
+    when the log is disabled (the default).
+"""
+def read_slow_query_config(config_filename):
+    log_params = read_config(filename=config_filename, section="slow_query_log", required=False)
+
+    if not read_flag(log_params, "enabled"):
+        return None
+
+    return {
+        "threshold_ms": float(log_params.get("threshold_ms", 100)),
+        "sample_rate": float(log_params.get("explain_sample_rate", 0.1)),
+        "log_file": log_params.get("log_file", "slow_queries.log"),
+        "max_bytes": int(log_params.get("max_bytes", 10485760)),
+        "backup_count": int(log_params.get("backup_count", 5)),
+        "nested_plans": read_flag(log_params, "nested_plans"),
+    }
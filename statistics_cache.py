@@ -0,0 +1,127 @@
+import sys
+import time
+from collections import OrderedDict
+
+from config import read_config, read_flag
+
+# bytes counted for an entry besides its key and lines: the entry tuple, its slot in the
+# OrderedDict and the name index
+ENTRY_OVERHEAD = 200
+
+
+"""
+    Bounded cache of get_statistics results, keyed by the normalized (name, country_name) pair.
+    - An entry is the kind of the matched entity (continent, country, city or None when nothing
+      or an ambiguous city matched), the lines printed and the returned (success, message).
+    - Entries expire ttl seconds after they were stored; the least recently used entries are
+      evicted while there are more than max_entries or they take more than about max_bytes.
+    - The client drops the entries of the names its writes touch (see invalidate_names).
+"""
+class StatisticsCache:
+    def __init__(self, max_entries=10000, max_bytes=4194304, ttl=60.0):
+        if max_entries < 1 or max_bytes < 1 or ttl <= 0:
+            raise ValueError("invalid statistics cache: max_entries=%d max_bytes=%d ttl=%g"
+                             % (max_entries, max_bytes, ttl))
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # key -> (stored_at, size, kind, lines, success, message), least recently used first
+        self.entries = OrderedDict()
+        # normalized name -> keys of the entries for it, so a write finds them without a scan
+        self.names = {}
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(name, country_name=None):
+        return name.lower(), country_name.lower() if country_name is not None else None
+
+    """
+        Returns (lines, success, message) of the key, None when it is not cached or expired.
+    """
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if time.monotonic() - entry[0] >= self.ttl:
+            self.remove(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[3], entry[4], entry[5]
+
+    def put(self, key, kind, lines, success, message):
+        if key in self.entries:
+            self.remove(key)
+
+        size = ENTRY_OVERHEAD + sum(sys.getsizeof(part) for part in key if part is not None) + \
+            sum(sys.getsizeof(line) for line in lines)
+        if size > self.max_bytes:
+            return
+
+        self.entries[key] = (time.monotonic(), size, kind, tuple(lines), success, message)
+        self.names.setdefault(key[0], set()).add(key)
+        self.size += size
+
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry[1]
+
+        keys = self.names[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.names[key[0]]
+
+    """
+        Drops every entry for the given names, whatever country_name it was asked with.
+    """
+    def invalidate_names(self, names):
+        for name in names:
+            for key in list(self.names.get(name.lower(), ())):
+                self.remove(key)
+                self.invalidations += 1
+
+    """
+        Drops every entry of the given kind, e.g. the continents when a country is removed.
+    """
+    def invalidate_kind(self, kind):
+        for key in [key for key, entry in self.entries.items() if entry[2] == kind]:
+            self.remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.names.clear()
+        self.size = 0
+
+
+"""
+    Returns the StatisticsCache arguments given in the optional [statistics_cache] section, or
+    None when the cache is disabled (the default).
+"""
+def read_statistics_cache_config(config_filename):
+    cache_params = read_config(filename=config_filename, section="statistics_cache", required=False)
+
+    if not read_flag(cache_params, "enabled"):
+        return None
+
+    return {
+        "max_entries": int(cache_params.get("max_entries", 10000)),
+        "max_bytes": int(cache_params.get("max_bytes", 4194304)),
+        "ttl": float(cache_params.get("ttl", 60)),
+    }
@@ -0,0 +1,38 @@
+import argparse
+import datetime
+
+import psycopg2
+
+from config import read_config
+
+
+"""
+    Removes guest rows of the users table that were not active for max_idle (a timedelta),
+    e.g. left behind by clients that crashed. Returns the number of removed rows.
+"""
+def sweep_guests(conn, max_idle=datetime.timedelta(days=1)):
+    query_ex = conn.cursor()
+    query_ex.execute("SELECT sweep_guest_users(%s)", (max_idle,))
+    removed = query_ex.fetchone()[0]
+    conn.commit()
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove guest users left behind by crashed clients.")
+    parser.add_argument("--config", default="database.cfg", help="database configuration file")
+    parser.add_argument("--max-idle-hours", type=float, default=24.0,
+                        help="remove guests inactive for longer than this (default %(default)s)")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**read_config(filename=args.config, section="postgresql"))
+    try:
+        removed = sweep_guests(conn, datetime.timedelta(hours=args.max_idle_hours))
+    finally:
+        conn.close()
+
+    print(f"removed {removed} guest users")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import random
+import unittest
+
+from metrics import LABEL_LENGTH, SUB_BUCKETS, Histogram, StatementLabels
+
+
+class HistogramBucketTest(unittest.TestCase):
+    def test_small_values_are_exact(self):
+        for value in range(2 * SUB_BUCKETS):
+            self.assertEqual(Histogram.bucket_index(value), value)
+            self.assertEqual(Histogram.bucket_range(value), (value, value))
+
+    def test_first_shared_bucket(self):
+        # 2 * SUB_BUCKETS is where buckets start holding more than one value
+        boundary = 2 * SUB_BUCKETS
+        self.assertEqual(Histogram.bucket_index(boundary - 1), boundary - 1)
+        self.assertEqual(Histogram.bucket_index(boundary), boundary)
+        self.assertEqual(Histogram.bucket_index(boundary + 1), boundary)
+        self.assertEqual(Histogram.bucket_index(boundary + 2), boundary + 1)
+        self.assertEqual(Histogram.bucket_range(boundary), (boundary, boundary + 1))
+
+    def test_powers_of_two_start_a_bucket(self):
+        for bits in range(8, 40):
+            power = 1 << bits
+            below = Histogram.bucket_index(power - 1)
+            at = Histogram.bucket_index(power)
+            with self.subTest(power=power):
+                self.assertEqual(at, below + 1)
+                self.assertEqual(Histogram.bucket_range(at)[0], power)
+                self.assertEqual(Histogram.bucket_range(below)[1], power - 1)
+
+    def test_buckets_are_contiguous(self):
+        for index in range(64 * SUB_BUCKETS):
+            self.assertEqual(Histogram.bucket_range(index + 1)[0], Histogram.bucket_range(index)[1] + 1, index)
+
+    def test_value_is_within_its_bucket(self):
+        rng = random.Random(352)
+        values = [rng.randrange(1 << bits) for bits in range(1, 40) for _ in range(200)]
+        for value in values:
+            lowest, highest = Histogram.bucket_range(Histogram.bucket_index(value))
+            self.assertTrue(lowest <= value <= highest, value)
+            self.assertLessEqual(highest - lowest, lowest / SUB_BUCKETS, value)
+
+
+class HistogramPercentileTest(unittest.TestCase):
+    @staticmethod
+    def exact(values, percent):
+        ordered = sorted(values)
+        rank = max(1, -(-len(ordered) * percent // 100))
+        return ordered[int(rank) - 1]
+
+    def test_empty(self):
+        self.assertEqual(Histogram().percentile(50), 0)
+        self.assertEqual(Histogram().mean(), 0.0)
+
+    def test_exact_below_shared_buckets(self):
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.record(value)
+
+        self.assertEqual(histogram.percentile(50), 50)
+        self.assertEqual(histogram.percentile(99), 99)
+        self.assertEqual(histogram.percentile(100), 100)
+        self.assertEqual(histogram.mean(), 50.5)
+
+    def test_percentile_is_close_to_exact(self):
+        rng = random.Random(2025)
+        values = [int(rng.lognormvariate(8, 1.5)) for _ in range(20000)]
+        histogram = Histogram()
+        for value in values:
+            histogram.record(value)
+
+        for percent in (1, 50, 90, 99, 99.9, 100):
+            exact = self.exact(values, percent)
+            estimate = histogram.percentile(percent)
+            with self.subTest(percent=percent):
+                # the highest value of the bucket of the exact one, so never below it and at
+                # most 1/SUB_BUCKETS (~1.6%) above it
+                self.assertGreaterEqual(estimate, exact)
+                self.assertLessEqual(estimate - exact, exact / SUB_BUCKETS)
+
+    def test_percentile_is_never_above_max(self):
+        histogram = Histogram()
+        histogram.record(1000)
+
+        self.assertEqual(histogram.percentile(50), 1000)
+        self.assertEqual((histogram.min, histogram.max, histogram.count), (1000, 1000, 1))
+
+
+class StatementLabelsTest(unittest.TestCase):
+    def test_known_statement_is_named(self):
+        labels = StatementLabels({"admin_by_id": "SELECT * FROM administrators WHERE admin_id = %(admin_id)s"})
+
+        self.assertEqual(labels.label("SELECT * FROM administrators WHERE admin_id = %(admin_id)s"), "admin_by_id")
+
+    def test_prepared_statements_are_named(self):
+        labels = StatementLabels()
+
+        self.assertEqual(labels.label("EXECUTE admin_by_id (%s)"), "admin_by_id")
+        self.assertEqual(labels.label("  PREPARE admin_by_id AS SELECT 1"), "admin_by_id (prepare)")
+
+    def test_other_text_is_shortened(self):
+        labels = StatementLabels()
+        query = "SELECT   name\n    FROM city\n" + " AND x = 1" * 20
+
+        label = labels.label(query)
+
+        self.assertTrue(label.startswith("SELECT name FROM city AND x = 1"))
+        self.assertEqual(len(label), LABEL_LENGTH)
+
+    def test_labels_are_cached_by_text(self):
+        labels = StatementLabels()
+        query = "SELECT count(*) FROM city"
+
+        self.assertEqual(labels.label(query), query)
+        self.assertEqual(labels.labels[query], query)
+
+        # a second lookup of the same text is answered from the cache
+        labels.labels[query] = "cached"
+        self.assertEqual(labels.label(query), "cached")
+
+if __name__ == "__main__":
+    unittest.main()
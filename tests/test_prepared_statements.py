@@ -0,0 +1,43 @@
+import re
+import unittest
+
+from mp2 import PREPARED_STATEMENTS, STATEMENTS, to_positional
+
+
+class ToPositionalTest(unittest.TestCase):
+    def test_parameters_are_numbered_in_order(self):
+        statement, param_names = to_positional("SELECT %(b)s, %(a)s")
+
+        self.assertEqual(statement, "SELECT $1, $2")
+        self.assertEqual(param_names, ["b", "a"])
+
+    def test_repeated_parameter_keeps_its_number(self):
+        statement, param_names = to_positional(
+            "SELECT * FROM city WHERE lower(name) = lower(%(name)s) AND (%(country)s IS NULL OR country = %(country)s) "
+            "AND name <> %(name)s")
+
+        self.assertEqual(statement,
+                         "SELECT * FROM city WHERE lower(name) = lower($1) AND ($2 IS NULL OR country = $2) "
+                         "AND name <> $1")
+        self.assertEqual(param_names, ["name", "country"])
+
+    def test_escaped_percent_is_unescaped(self):
+        statement, param_names = to_positional("SELECT name FROM city WHERE name LIKE 'A%%' AND population > %(population)s")
+
+        self.assertEqual(statement, "SELECT name FROM city WHERE name LIKE 'A%' AND population > $1")
+        self.assertEqual(param_names, ["population"])
+
+    def test_statement_without_parameters(self):
+        self.assertEqual(to_positional("SELECT 1"), ("SELECT 1", []))
+
+    def test_every_statement_is_converted(self):
+        for name, statement in STATEMENTS.items():
+            positional_statement, param_names = PREPARED_STATEMENTS[name]
+            with self.subTest(name=name):
+                self.assertNotIn("%(", positional_statement)
+                self.assertEqual(set(param_names), set(re.findall(r"%\((\w+)\)s", statement)))
+                self.assertEqual(len(set(re.findall(r"\$(\d+)", positional_statement))), len(param_names))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from unittest import mock
+
+from quota import QuotaBuffer
+
+
+class QuotaBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("quota.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_counts_in_memory_until_flush_every(self):
+        buffer = QuotaBuffer(flush_every=3, flush_interval=5)
+
+        # the first two queries are only counted, the third one is written with them
+        self.assertEqual(buffer.take_due(), 0)
+        buffer.add()
+        self.assertEqual(buffer.take_due(), 0)
+        buffer.add()
+        self.assertEqual(buffer.take_due(), 3)
+
+        self.assertEqual((buffer.pending, buffer.first_pending_at, buffer.flushes), (0, None, 1))
+
+    def test_flush_is_due_after_flush_interval(self):
+        buffer = QuotaBuffer(flush_every=100, flush_interval=5)
+        buffer.add()
+
+        self.now += 4.9
+        self.assertFalse(buffer.due())
+        self.now += 0.1
+        self.assertTrue(buffer.due())
+        self.assertEqual(buffer.take_due(), 2)
+
+    def test_interval_starts_with_first_pending_query(self):
+        buffer = QuotaBuffer(flush_every=100, flush_interval=5)
+        buffer.add()
+        self.now += 3
+        buffer.add()
+
+        self.now += 2
+        self.assertTrue(buffer.due())
+
+    def test_take_returns_whole_pending_count(self):
+        buffer = QuotaBuffer()
+        self.assertEqual(buffer.take(), 0)
+        self.assertEqual(buffer.flushes, 0)
+
+        buffer.add(4)
+        self.assertEqual(buffer.take(), 4)
+        self.assertEqual((buffer.pending, buffer.first_pending_at, buffer.flushes), (0, None, 1))
+
+    def test_failed_flush_is_put_back(self):
+        buffer = QuotaBuffer(flush_every=100, flush_interval=5)
+        buffer.add(2)
+        count = buffer.take()
+
+        self.now += 1
+        buffer.add(count)
+
+        self.assertEqual(buffer.pending, 2)
+        self.assertEqual(buffer.first_pending_at, self.now)
+
+    def test_add_ignores_non_positive_counts(self):
+        buffer = QuotaBuffer()
+        buffer.add(0)
+
+        self.assertEqual(buffer.pending, 0)
+        self.assertIsNone(buffer.first_pending_at)
+
+    def test_discard(self):
+        buffer = QuotaBuffer(flush_every=100, flush_interval=5)
+        buffer.add(7)
+        buffer.discard()
+
+        self.now += 10
+        self.assertFalse(buffer.due())
+        self.assertEqual(buffer.take(), 0)
+
+    def test_invalid_settings_are_rejected(self):
+        with self.assertRaises(ValueError):
+            QuotaBuffer(flush_every=0)
+        with self.assertRaises(ValueError):
+            QuotaBuffer(flush_interval=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
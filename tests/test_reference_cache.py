@@ -0,0 +1,121 @@
+import unittest
+from unittest import mock
+
+from reference_cache import REFERENCE_TABLES, ReferenceCache
+
+
+# cursor factory handing out cursors that answer the reference queries with fixed rows
+class FakeCursors:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def __call__(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, cursors):
+        self.cursors = cursors
+        self.result = None
+
+    def execute(self, query, vars=None):
+        self.cursors.queries.append(query)
+        table = next(table for table, table_query in REFERENCE_TABLES.items() if table_query == query)
+        self.result = list(self.cursors.rows[table])
+
+    def fetchall(self):
+        return self.result
+
+
+class ReferenceCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("reference_cache.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cursors = FakeCursors({
+            "country": [("Germany", "D", "Germany"), ("France", "F", "France")],
+            "continent": [("Europe", "Europe", 9562488)],
+            "accesslevels": [(1, 1, "basic", 1), (2, 2, "pro", 4)],
+        })
+
+    def test_table_is_loaded_once(self):
+        cache = ReferenceCache()
+
+        self.assertEqual(cache.get("country", "Germany", self.cursors), ("D", "Germany"))
+        self.assertEqual(cache.get("country", "France", self.cursors), ("F", "France"))
+        self.assertIsNone(cache.get("country", "Atlantis", self.cursors))
+
+        self.assertEqual(len(self.cursors.queries), 1)
+        self.assertEqual((cache.misses["country"], cache.hits["country"]), (1, 2))
+
+    def test_names_are_case_insensitive(self):
+        cache = ReferenceCache()
+
+        self.assertEqual(cache.get("country", "gERMANY", self.cursors), ("D", "Germany"))
+        self.assertEqual(cache.get("continent", "EUROPE", self.cursors), ("Europe", 9562488))
+
+    def test_other_keys_are_exact(self):
+        cache = ReferenceCache()
+
+        self.assertEqual(cache.get("accesslevels", 2, self.cursors), (2, "pro", 4))
+        self.assertIsNone(cache.get("accesslevels", "2", self.cursors))
+
+    def test_table_is_loaded_again_after_ttl(self):
+        cache = ReferenceCache(ttl=300)
+        cache.get("country", "Germany", self.cursors)
+
+        self.now += 299
+        cache.get("country", "Germany", self.cursors)
+        self.assertEqual(len(self.cursors.queries), 1)
+
+        self.cursors.rows["country"] = [("France", "F", "France")]
+        self.now += 1
+        self.assertIsNone(cache.get("country", "Germany", self.cursors))
+        self.assertEqual(len(self.cursors.queries), 2)
+        self.assertEqual(cache.misses["country"], 2)
+
+    def test_drop_keys(self):
+        cache = ReferenceCache()
+        cache.get("country", "Germany", self.cursors)
+
+        cache.drop("country", ["GERMANY", "Atlantis"])
+
+        self.assertIsNone(cache.get("country", "Germany", self.cursors))
+        self.assertEqual(cache.get("country", "France", self.cursors), ("F", "France"))
+        self.assertEqual(cache.invalidations["country"], 1)
+        self.assertEqual(len(self.cursors.queries), 1)
+
+    def test_drop_table(self):
+        cache = ReferenceCache()
+        cache.get("continent", "Europe", self.cursors)
+
+        cache.drop("continent")
+        cache.drop("country")
+
+        self.assertNotIn("continent", cache.tables)
+        self.assertEqual(cache.invalidations["continent"], 1)
+        self.assertEqual(cache.invalidations["country"], 0)
+        cache.get("continent", "Europe", self.cursors)
+        self.assertEqual(len(self.cursors.queries), 2)
+
+    def test_stats(self):
+        cache = ReferenceCache()
+        cache.get("country", "Germany", self.cursors)
+        cache.get("country", "France", self.cursors)
+
+        self.assertEqual(cache.stats(), [
+            ("country", 2, 1, 1, 0),
+            ("continent", 0, 0, 0, 0),
+            ("accesslevels", 0, 0, 0, 0),
+        ])
+
+    def test_invalid_ttl_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ReferenceCache(ttl=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+import sys
+import unittest
+from unittest import mock
+
+from statistics_cache import ENTRY_OVERHEAD, StatisticsCache
+
+
+# time.monotonic of the cache module, moved forward by the tests
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def entry_size(key, lines):
+    return ENTRY_OVERHEAD + sum(sys.getsizeof(part) for part in key if part is not None) + \
+        sum(sys.getsizeof(line) for line in lines)
+
+
+class StatisticsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("statistics_cache.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def put(self, cache, name, country_name=None, kind="city", lines=("line",)):
+        key = StatisticsCache.key(name, country_name)
+        cache.put(key, kind, list(lines), True, "OK")
+        return key
+
+    def test_key_is_case_insensitive(self):
+        self.assertEqual(StatisticsCache.key("Berlin", "Germany"), ("berlin", "germany"))
+        self.assertEqual(StatisticsCache.key("Berlin"), ("berlin", None))
+
+    def test_get_returns_stored_entry(self):
+        cache = StatisticsCache()
+        key = self.put(cache, "Berlin", lines=("a", "b"))
+
+        self.assertEqual(cache.get(key), (("a", "b"), True, "OK"))
+        self.assertIsNone(cache.get(StatisticsCache.key("Paris")))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = StatisticsCache(max_entries=2)
+        first = self.put(cache, "first")
+        second = self.put(cache, "second")
+        # reading the first one makes the second one the least recently used
+        cache.get(first)
+        third = self.put(cache, "third")
+
+        self.assertEqual(list(cache.entries), [first, third])
+        self.assertNotIn(second, cache.entries)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_put_again_replaces_entry(self):
+        cache = StatisticsCache(max_entries=2)
+        key = self.put(cache, "Berlin", lines=("old",))
+        self.put(cache, "Berlin", lines=("new",))
+
+        self.assertEqual(len(cache.entries), 1)
+        self.assertEqual(cache.get(key)[0], ("new",))
+        self.assertEqual(cache.size, entry_size(key, ["new"]))
+
+    def test_entry_expires_after_ttl(self):
+        cache = StatisticsCache(ttl=60)
+        key = self.put(cache, "Berlin")
+
+        self.clock.now += 59.9
+        self.assertIsNotNone(cache.get(key))
+
+        self.clock.now += 0.1
+        self.assertIsNone(cache.get(key))
+        self.assertNotIn(key, cache.entries)
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(cache.names, {})
+
+    def test_byte_cap_evicts_oldest_entries(self):
+        lines = ("x" * 100,)
+        size = entry_size(StatisticsCache.key("a"), lines)
+        cache = StatisticsCache(max_bytes=2 * size)
+        a = self.put(cache, "a", lines=lines)
+        b = self.put(cache, "b", lines=lines)
+        c = self.put(cache, "c", lines=lines)
+
+        self.assertEqual(list(cache.entries), [b, c])
+        self.assertNotIn(a, cache.entries)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+    def test_entry_larger_than_byte_cap_is_not_stored(self):
+        cache = StatisticsCache(max_bytes=ENTRY_OVERHEAD + 10)
+        key = self.put(cache, "Berlin", lines=("x" * 100,))
+
+        self.assertNotIn(key, cache.entries)
+        self.assertEqual((cache.size, cache.evictions), (0, 0))
+
+    def test_size_accounting_after_remove(self):
+        cache = StatisticsCache()
+        a = self.put(cache, "a", lines=("x" * 10,))
+        b = self.put(cache, "b", lines=("y" * 20, "z"))
+        self.assertEqual(cache.size, entry_size(a, ["x" * 10]) + entry_size(b, ["y" * 20, "z"]))
+
+        cache.remove(a)
+        self.assertEqual(cache.size, entry_size(b, ["y" * 20, "z"]))
+        cache.remove(b)
+        self.assertEqual(cache.size, 0)
+
+    def test_remove_cleans_name_index(self):
+        cache = StatisticsCache()
+        alone = self.put(cache, "Berlin")
+        with_country = self.put(cache, "Berlin", "Germany")
+
+        cache.remove(alone)
+        self.assertEqual(cache.names, {"berlin": {with_country}})
+        cache.remove(with_country)
+        self.assertEqual(cache.names, {})
+
+    def test_invalidate_names_drops_every_country_of_name(self):
+        cache = StatisticsCache()
+        self.put(cache, "Berlin")
+        self.put(cache, "Berlin", "Germany")
+        kept = self.put(cache, "Paris")
+
+        cache.invalidate_names(["BERLIN", "unknown"])
+
+        self.assertEqual(list(cache.entries), [kept])
+        self.assertEqual(cache.names, {"paris": {kept}})
+        self.assertEqual(cache.invalidations, 2)
+        self.assertEqual(cache.size, entry_size(kept, ["line"]))
+
+    def test_invalidate_kind(self):
+        cache = StatisticsCache()
+        self.put(cache, "Europe", kind="continent")
+        kept = self.put(cache, "Germany", kind="country")
+        self.put(cache, "Asia", kind="continent")
+
+        cache.invalidate_kind("continent")
+
+        self.assertEqual(list(cache.entries), [kept])
+        self.assertEqual(set(cache.names), {"germany"})
+        self.assertEqual(cache.invalidations, 2)
+
+    def test_invalid_limits_are_rejected(self):
+        with self.assertRaises(ValueError):
+            StatisticsCache(max_entries=0)
+        with self.assertRaises(ValueError):
+            StatisticsCache(ttl=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
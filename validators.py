@@ -93,6 +93,62 @@ def adjust_population_validator(cmd_tokens):
     
     return True, None
 
+def bulk_adjust_population_validator(cmd_tokens):
+    expected_args_count = 1
+
+    if len(cmd_tokens) != expected_args_count + 1:
+        return False, messages.CMD_NOT_ENOUGH_ARGS % expected_args_count
+
+    return True, None
+
+def bulk_transfer_city_validator(cmd_tokens):
+    expected_args_count = 1
+
+    if len(cmd_tokens) != expected_args_count + 1:
+        return False, messages.CMD_NOT_ENOUGH_ARGS % expected_args_count
+
+    return True, None
+
+def export_validator(cmd_tokens):
+    expected_args_count = 2
+
+    if len(cmd_tokens) not in (expected_args_count + 1, expected_args_count + 2):
+        return False, messages.CMD_NOT_ENOUGH_ARGS % expected_args_count
+
+    return True, None
+
+def list_validator(cmd_tokens):
+    expected_args_count = 1
+
+    if len(cmd_tokens) != expected_args_count + 1:
+        return False, messages.CMD_NOT_ENOUGH_ARGS % expected_args_count
+
+    return True, None
+
+def check_summaries_validator(cmd_tokens):
+    if len(cmd_tokens) == 1:
+        return True, None
+    else:
+        return False, messages.CMD_INVALID_ARGS
+
+def stats_validator(cmd_tokens):
+    if len(cmd_tokens) == 1:
+        return True, None
+    else:
+        return False, messages.CMD_INVALID_ARGS
+
+def pool_stats_validator(cmd_tokens):
+    if len(cmd_tokens) == 1:
+        return True, None
+    else:
+        return False, messages.CMD_INVALID_ARGS
+
+def cache_stats_validator(cmd_tokens):
+    if len(cmd_tokens) == 1:
+        return True, None
+    else:
+        return False, messages.CMD_INVALID_ARGS
+
 
 
 